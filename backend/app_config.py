@@ -0,0 +1,102 @@
+"""
+The app configuration served at /api/config, read from
+config_files/model_settings.json.
+
+The file is validated (models.AppConfig) and serialized once, together with
+a strong ETag for the bytes. Requests answer from that copy, so the frontend's
+repeat requests (it fetches the config on every app load) cost an ETag
+comparison and a 304. A background task checks the file's modification time
+every CONFIG_RELOAD_CHECK_SECONDS, in a worker thread, and loads the file
+again when it changed, so requests never touch the disk. A file that no
+longer validates is logged and the last good configuration stays in use.
+
+Listeners passed as `on_reload` (main.py updates the LLM providers' model
+lists with it) are called with every newly loaded version.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from typing import Callable, Optional
+
+from models import AppConfig
+
+
+class ConfigSnapshot:
+    """One loaded version of the file: the validated settings, their serialized body and ETag."""
+
+    def __init__(self, data: dict, body: bytes, mtime_ns: int):
+        self.data = data
+        self.body = body
+        self.mtime_ns = mtime_ns
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        return etag_matches(self.etag, if_none_match)
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Whether an If-None-Match header names `etag` (weak comparison, as RFC 9110 asks)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+class ConfigFile:
+    def __init__(self, path: str, check_interval: float,
+                 on_reload: Optional[Callable[[ConfigSnapshot], None]] = None):
+        self.path = path
+        self.check_interval = check_interval
+        self.on_reload = on_reload
+        self._snapshot = self._load()
+        # Modification time last looked at, including versions that failed to load.
+        self._seen_mtime_ns = self._snapshot.mtime_ns
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _load(self) -> ConfigSnapshot:
+        """Reads and validates the file. Raises OSError or ValueError (pydantic's ValidationError is one)."""
+        mtime_ns = os.stat(self.path).st_mtime_ns
+        with open(self.path, encoding="utf-8") as f:
+            data = AppConfig.model_validate(json.load(f)).model_dump(mode="json")
+        body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        return ConfigSnapshot(data, body, mtime_ns)
+
+    def current(self) -> ConfigSnapshot:
+        """The configuration to serve (the last version loaded)."""
+        return self._snapshot
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            snapshot = await asyncio.to_thread(self._reload_if_changed)
+            if snapshot is None:
+                continue
+            self._snapshot = snapshot
+            print(f"Config: reloaded {self.path}")
+            if self.on_reload is not None:
+                try:
+                    self.on_reload(snapshot)
+                except Exception as e:
+                    print(f"Config: a listener failed to apply the reloaded {self.path}: {e}")
+
+    def _reload_if_changed(self) -> Optional[ConfigSnapshot]:
+        """Runs in a worker thread. Returns the new version, or None if the file is unchanged or invalid."""
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+            if mtime_ns == self._seen_mtime_ns:
+                return None
+            self._seen_mtime_ns = mtime_ns
+            return self._load()
+        except (OSError, ValueError) as e:
+            print(f"Config: keeping the previous configuration, {self.path} could not be loaded: {e}")
+            return None
@@ -0,0 +1,299 @@
+"""
+Load test for the FastAPI backend in main.py.
+
+The app runs in this process (lifespan included) and is driven through an
+in-memory ASGI transport, so no server or port is needed. Its database is
+either a local MongoDB, using a scratch database that is dropped afterwards,
+or mongomock-motor (which scans whole collections and has no text search,
+so use it to try the harness rather than for numbers). Users are seeded with chat histories of different
+sizes, then every scenario below is run with many concurrent clients, and
+throughput plus p50/p95/p99 latency per endpoint is written to a JSON file.
+
+Run it from the backend folder:
+
+    python benchmarks/load_test.py --mongo-url mongodb://localhost:27017
+    python benchmarks/load_test.py --mock --output before.json
+    python benchmarks/load_test.py --mock --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import db_connections  # noqa: E402
+from chat_store import ChatStore  # noqa: E402
+from models import Conversation, Message  # noqa: E402
+from stats import summarize  # noqa: E402
+
+BENCHMARK_DB = "librechat_benchmark"
+PASSWORD = "benchmark-password"
+# Messages per seeded conversation; larger histories are spread over several conversations.
+MESSAGES_PER_CONVERSATION = 50
+
+
+class SeededUser:
+    def __init__(self, email: str, user_id: str, history_size: int):
+        self.email = email
+        self.id = user_id
+        self.history_size = history_size
+        self.conversation_ids: List[str] = []
+
+
+async def seed_users(user_collection, history_sizes: List[int], password_hash: str) -> List[SeededUser]:
+    """Creates one user per history size, with that many messages spread over conversations."""
+    chat_store = ChatStore(user_collection.database)
+    users = []
+    for index, history_size in enumerate(history_sizes):
+        user = SeededUser(f"bench-{index}-{uuid.uuid4().hex[:8]}@example.com", str(uuid.uuid4()), history_size)
+        await user_collection.insert_one({
+            "_id": user.id,
+            "name": f"Bench User {index}",
+            "email": user.email,
+            "password": password_hash,
+            "role": "USER",
+            "user_dedicated_folder": f"bench_user_{index}",
+            "audio_files_name": [],
+            "file_name": [],
+        })
+        for start in range(0, history_size, MESSAGES_PER_CONVERSATION):
+            count = min(MESSAGES_PER_CONVERSATION, history_size - start)
+            conversation = Conversation(
+                title=f"Seeded conversation {start // MESSAGES_PER_CONVERSATION}",
+                messages=[
+                    Message(role="user" if i % 2 == 0 else "ai", content=f"Seeded message {start + i}. " * 8)
+                    for i in range(count)
+                ],
+            )
+            await chat_store.create_conversation(user.id, conversation)
+            user.conversation_ids.append(conversation.id)
+        users.append(user)
+    return users
+
+
+Scenario = Callable[[httpx.AsyncClient, SeededUser, int], Awaitable[httpx.Response]]
+
+
+def build_scenarios(new_conversation_ids: Dict[str, List[str]]) -> Dict[str, Scenario]:
+    """One request per scenario; `i` is the request's number within its scenario."""
+
+    async def register(client, user, i):
+        return await client.post("/api/auth/register", json={
+            "name": "Load Test", "email": f"new-{uuid.uuid4().hex}@example.com", "password": PASSWORD,
+        })
+
+    async def login(client, user, i):
+        return await client.post("/api/auth/login", json={"email": user.email, "password": PASSWORD})
+
+    async def current_user(client, user, i):
+        return await client.get("/api/user")
+
+    async def list_conversations(client, user, i):
+        return await client.get("/api/conversations")
+
+    async def list_messages(client, user, i):
+        conversation_id = user.conversation_ids[i % len(user.conversation_ids)]
+        return await client.get(f"/api/conversations/{conversation_id}/messages")
+
+    async def search(client, user, i):
+        return await client.get("/api/search", params={"q": f"seeded message {i % 1000}"})
+
+    async def export(client, user, i):
+        return await client.get("/api/conversations/export")
+
+    async def invoke_new(client, user, i):
+        response = await client.post("/api/chat/invoke", json={
+            "user_email": user.email, "user_model": "gpt-4o", "human_text": f"New question {i}",
+        })
+        if response.status_code == 200:
+            new_conversation_ids[user.email].append(response.json()["new_conversation"]["id"])
+        return response
+
+    async def invoke_existing(client, user, i):
+        return await client.post("/api/chat/invoke", json={
+            "user_email": user.email, "user_model": "gpt-4o", "human_text": f"Follow-up {i}",
+            "conversation_id": user.conversation_ids[i % len(user.conversation_ids)],
+        })
+
+    async def upload_text_file(client, user, i):
+        return await client.post(
+            "/api/chat/invoke_with_text_file",
+            data={"user_email": user.email, "model_name": "gpt-4o", "user_message": "Summarize this"},
+            files={"text_file": (f"notes-{i}.txt", f"Load test document {i}.\n".encode() * 2000, "text/plain")},
+        )
+
+    async def delete_conversation(client, user, i):
+        conversation_id = new_conversation_ids[user.email].pop() if new_conversation_ids[user.email] else "missing"
+        return await client.request("DELETE", f"/api/chats/{conversation_id}", json={"user_email": user.email})
+
+    return {
+        "register": register,
+        "login": login,
+        "user": current_user,
+        "conversations": list_conversations,
+        "messages": list_messages,
+        "search": search,
+        "export": export,
+        "invoke_new": invoke_new,
+        "invoke_existing": invoke_existing,
+        "upload_text_file": upload_text_file,
+        "delete": delete_conversation,
+    }
+
+
+async def run_scenario(clients: Dict[str, httpx.AsyncClient], users: List[SeededUser], scenario: Scenario,
+                       requests: int, concurrency: int) -> dict:
+    """Sends `requests` requests from `concurrency` concurrent workers, round-robin over the users."""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        for i in counter:
+            user = users[i % len(users)]
+            started = time.perf_counter()
+            try:
+                response = await scenario(clients[user.email], user, i)
+                outcome = None if response.status_code < 400 else str(response.status_code)
+            except httpx.HTTPError as e:
+                outcome = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            if outcome:
+                errors[outcome] = errors.get(outcome, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {**summarize(latencies, time.perf_counter() - started), "errors": errors}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_comparison(results: dict, baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    print(f"{'endpoint':<18}{'p50 ms':>18}{'p99 ms':>18}{'req/s':>18}")
+    for name, current in results["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before or not current.get("requests"):
+            continue
+        cells = [
+            f"{before[key]:.1f} -> {current[key]:.1f}"
+            for key in ("ms_p50", "ms_p99", "per_second")
+        ]
+        print(f"{name:<18}" + "".join(f"{cell:>18}" for cell in cells))
+
+
+async def run(args) -> dict:
+    import main
+
+    # Keep everything the app writes (uploads, indexes, caches) out of the working tree.
+    original_dir = os.getcwd()
+    scratch_dir = tempfile.mkdtemp(prefix="librechat-load-test-")
+    os.chdir(scratch_dir)
+    db_connections.DB_NAME = BENCHMARK_DB
+    if args.mock:
+        from mongomock_motor import AsyncMongoMockClient
+        mock_collection = AsyncMongoMockClient()[BENCHMARK_DB][db_connections.COLLECTION_NAME]
+
+        async def get_mock_collection(db_url):
+            return mock_collection
+
+        main.get_user_collection = get_mock_collection
+    main.settings.MONGO_URL = args.mongo_url
+    # A few seeded users sending hundreds of requests would mostly measure 429s.
+    main.settings.RATE_LIMITS_ENABLED = int(args.rate_limits)
+
+    lifespan = main.lifespan(main.app)
+    await lifespan.__aenter__()
+    try:
+        user_collection = main.user_collection
+        history_sizes = [int(size) for size in args.history_sizes.split(",")]
+        password_hash = await main.get_password_hash(PASSWORD)
+        users = await seed_users(user_collection, history_sizes, password_hash)
+
+        # One client per user, so the session cookie from logging in is sent along.
+        transport = httpx.ASGITransport(app=main.app)
+        clients = {
+            user.email: httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60)
+            for user in users
+        }
+        for user in users:
+            await clients[user.email].post("/api/auth/login", json={"email": user.email, "password": PASSWORD})
+
+        new_conversation_ids: Dict[str, List[str]] = {user.email: [] for user in users}
+        scenarios = build_scenarios(new_conversation_ids)
+        selected = args.scenarios.split(",") if args.scenarios else list(scenarios)
+
+        endpoints = {}
+        for name in selected:
+            # bcrypt makes register and login far slower than everything else.
+            requests = args.auth_requests if name in ("register", "login") else args.requests
+            endpoints[name] = await run_scenario(clients, users, scenarios[name], requests, args.concurrency)
+            print(f"{name:<18} {endpoints[name]}", file=sys.stderr)
+
+        await asyncio.gather(*(client.aclose() for client in clients.values()))
+    finally:
+        if not args.mock and main.user_collection is not None:
+            await main.user_collection.database.client.drop_database(BENCHMARK_DB)
+        await lifespan.__aexit__(None, None, None)
+        os.chdir(original_dir)
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {
+            "database": "mongomock" if args.mock else args.mongo_url,
+            "history_sizes": history_sizes,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "auth_requests": args.auth_requests,
+            "rate_limits": args.rate_limits,
+        },
+        "endpoints": endpoints,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the chat backend and record latency per endpoint.")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--mock", action="store_true", help="Use mongomock-motor instead of a MongoDB server.")
+    parser.add_argument("--history-sizes", default="10,100,1000,10000",
+                        help="Comma-separated number of seeded messages, one user per entry.")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario.")
+    parser.add_argument("--auth-requests", type=int, default=50, help="Requests for register and login.")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="Keep the rate limits in config_files/rate_limits.json on (they are off by default).")
+    parser.add_argument("--scenarios", default="", help="Comma-separated subset of scenarios to run.")
+    parser.add_argument("--output", default="load_test_results.json")
+    parser.add_argument("--compare", default="", help="Earlier results file to print a comparison against.")
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output)
+    results = asyncio.run(run(args))
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output_path}")
+    if args.compare:
+        print_comparison(results, args.compare)
@@ -0,0 +1,90 @@
+"""
+Compares ways of turning a page of chat history into a JSON response body.
+
+- fastapi_default: what FastAPI does for a returned model or model_dump()
+  dict with the stock JSONResponse: jsonable_encoder, then the json module.
+- model_dump_orjson: model_dump(mode="json") once, then orjson (what
+  TimedJSONResponse does for handlers that return dicts).
+- pydantic_core: pydantic_core.to_json straight from the model (what
+  model_response() in main.py does for the large list endpoints).
+
+Run it from the backend folder:
+
+    python benchmarks/serialization.py --sizes 100,1000,10000
+
+It prints one JSON object with the median time per body and its size.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import orjson
+import pydantic_core
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Message, MessagePage  # noqa: E402
+
+
+def build_page(size: int) -> MessagePage:
+    return MessagePage(
+        messages=[
+            Message(role="user" if i % 2 == 0 else "ai", content=f"Message {i} about something. " * 12)
+            for i in range(size)
+        ],
+        next_before=None,
+    )
+
+
+def fastapi_default(page: MessagePage) -> bytes:
+    return json.dumps(
+        jsonable_encoder(page), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def model_dump_orjson(page: MessagePage) -> bytes:
+    return orjson.dumps(page.model_dump(mode="json"))
+
+
+def pydantic_core_to_json(page: MessagePage) -> bytes:
+    return pydantic_core.to_json(page)
+
+
+METHODS = {
+    "fastapi_default": fastapi_default,
+    "model_dump_orjson": model_dump_orjson,
+    "pydantic_core": pydantic_core_to_json,
+}
+
+
+def measure(func, page: MessagePage, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(page)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization of chat history pages.")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma-separated messages per page.")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    results = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        page = build_page(size)
+        bodies = {name: func(page) for name, func in METHODS.items()}
+        # All three must produce the same document.
+        assert len({json.dumps(json.loads(body), sort_keys=True) for body in bodies.values()}) == 1
+        results.append({
+            "messages": size,
+            "bytes": len(bodies["pydantic_core"]),
+            "ms_median": {name: round(measure(func, page, args.repeat) * 1000, 3) for name, func in METHODS.items()},
+        })
+    print(json.dumps({"repeat": args.repeat, "results": results}, indent=2))
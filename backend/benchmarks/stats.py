@@ -0,0 +1,24 @@
+"""Latency summaries shared by the benchmark scripts."""
+import statistics
+from typing import List
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies: List[float], elapsed: float) -> dict:
+    """Throughput and latency percentiles (in milliseconds) for one batch of timed calls."""
+    if not latencies:
+        return {"requests": 0}
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "ms_mean": round(statistics.fmean(latencies) * 1000, 3),
+        "ms_p50": round(percentile(latencies, 0.50) * 1000, 3),
+        "ms_p95": round(percentile(latencies, 0.95) * 1000, 3),
+        "ms_p99": round(percentile(latencies, 0.99) * 1000, 3),
+        "ms_max": round(max(latencies) * 1000, 3),
+    }
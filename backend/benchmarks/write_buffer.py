@@ -0,0 +1,99 @@
+"""
+Compares per-turn chat writes with the write-behind buffer (chat_write_buffer.py).
+
+Many simulated users append turns to their conversations at the same time,
+once with every turn written immediately and once through the buffer. Run
+it from the backend folder against a scratch database:
+
+    python benchmarks/write_buffer.py --mongo-url mongodb://localhost:27017
+
+or without a server, against mongomock-motor (only useful as a smoke test):
+
+    python benchmarks/write_buffer.py --mock
+
+It prints one JSON object with throughput and save latency for each mode.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_store import ChatStore  # noqa: E402
+from models import Conversation, Message  # noqa: E402
+from stats import summarize  # noqa: E402
+
+BENCHMARK_DB = "librechat_benchmark"
+
+
+async def run_mode(database, buffered: bool, users: int, turns: int, max_messages: int, max_delay_ms: int) -> dict:
+    for name in ("conversations", "messages"):
+        await database.drop_collection(name)
+    chat_store = ChatStore.with_write_buffer(database, max_messages, max_delay_ms) if buffered else ChatStore(database)
+    await chat_store.ensure_indexes()
+    if buffered:
+        chat_store.write_buffer.start()
+
+    conversation_ids = []
+    for user in range(users):
+        conversation = Conversation(title=f"benchmark {user}")
+        await chat_store.create_conversation(f"user-{user}", conversation)
+        conversation_ids.append(conversation.id)
+
+    latencies = []
+
+    async def simulate_user(user: int) -> None:
+        for turn in range(turns):
+            messages = [
+                Message(role="user", content=f"question {turn} " * 10),
+                Message(role="ai", content=f"answer {turn} " * 40),
+            ]
+            started = time.perf_counter()
+            await chat_store.save_turn(f"user-{user}", conversation_ids[user], messages, title="")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(user) for user in range(users)))
+    if buffered:
+        await chat_store.write_buffer.stop()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "mode": "write_buffer" if buffered else "per_turn",
+        "messages_stored": await chat_store.messages.count_documents({}),
+        "flushes": chat_store.write_buffer.flushes if buffered else None,
+        # Latency of save_turn per turn; per_second is turns per second.
+        **summarize(latencies, elapsed),
+    }
+
+
+async def main(args) -> None:
+    if args.mock:
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_url)
+    database = client[BENCHMARK_DB]
+
+    results = []
+    for buffered in (False, True):
+        results.append(await run_mode(
+            database, buffered, args.users, args.turns, args.max_messages, args.max_delay_ms
+        ))
+    await client.drop_database(BENCHMARK_DB)
+    print(json.dumps({"users": args.users, "turns_per_user": args.turns, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-turn chat writes against the write buffer.")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--mock", action="store_true", help="Use mongomock-motor instead of a MongoDB server.")
+    parser.add_argument("--users", type=int, default=100, help="Concurrent users, one conversation each.")
+    parser.add_argument("--turns", type=int, default=20, help="Turns per user.")
+    parser.add_argument("--max-messages", type=int, default=500)
+    parser.add_argument("--max-delay-ms", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""
+Cache invalidation between the worker processes of one server (WEB_WORKERS > 1).
+
+Each worker keeps its own in-process caches, so when one worker changes
+something another may have cached (a deleted conversation, a rebuilt RAG
+index), it publishes a small message and the other workers drop their copy.
+Messages travel over Unix datagram sockets: every worker binds one socket
+in a shared directory and publishing sends to all the others. No broker or
+extra service is needed, and a message costs one local syscall per worker.
+
+On platforms without Unix sockets (Windows) the bus does nothing, which is
+fine for the single-process mode used there.
+"""
+import asyncio
+import json
+import os
+import socket
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+Handler = Callable[[str], None]
+
+
+class CacheBus:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+        self._socket = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._socket is not None
+
+    def subscribe(self, topic: str, handler: Handler) -> None:
+        """Calls `handler(key)` whenever another worker publishes `key` on `topic`."""
+        self._handlers[topic].append(handler)
+
+    def start(self) -> None:
+        if not hasattr(socket, "AF_UNIX"):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.path)
+        self._socket.setblocking(False)
+        asyncio.get_running_loop().add_reader(self._socket.fileno(), self._receive)
+
+    def stop(self) -> None:
+        if self._socket is None:
+            return
+        asyncio.get_running_loop().remove_reader(self._socket.fileno())
+        self._socket.close()
+        self._socket = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def publish(self, topic: str, key: str) -> None:
+        """Tells every other worker to invalidate `key` on `topic`. Never blocks."""
+        if self._socket is None:
+            return
+        message = json.dumps({"topic": topic, "key": key}).encode("utf-8")
+        for name in os.listdir(self.directory):
+            peer = os.path.join(self.directory, name)
+            if peer == self.path or not name.endswith(".sock"):
+                continue
+            try:
+                self._socket.sendto(message, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that has exited.
+                try:
+                    os.remove(peer)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                # That worker's receive buffer is full; it is too busy to matter for one message.
+                print(f"Cache bus: dropped '{topic}' message for {name}")
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except BlockingIOError:
+                return
+            try:
+                message = json.loads(data)
+                handlers = self._handlers.get(message["topic"], [])
+                for handler in handlers:
+                    handler(message["key"])
+            except Exception as e:
+                print(f"Cache bus: could not handle message {data[:100]!r}: {e}")
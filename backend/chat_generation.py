@@ -0,0 +1,88 @@
+"""
+Pluggable backends that generate the AI side of a chat turn.
+
+A backend is an async generator function that receives the ChatRequest and
+the earlier conversation (see context_builder.py) and yields the response
+text piece by piece. The streaming endpoint forwards
+every piece to the client as it arrives; the regular endpoints simply join
+them. Which backend is used is picked by the CHAT_GENERATOR setting.
+When the response cache is on, get_generator() answers repeated prompts
+that start a conversation from it and only calls the backend on a miss.
+"""
+import asyncio
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import llm_providers
+import response_cache
+import settings
+from models import ChatRequest
+
+# (chat_request, history) -> response text; history holds {"role", "content"} dicts, oldest first.
+ResponseGenerator = Callable[[ChatRequest, List[dict]], AsyncIterator[str]]
+
+
+async def fake_generate(chat_request: ChatRequest, history: List[dict]) -> AsyncIterator[str]:
+    """
+    Local stand-in for a real model: streams the old hardcoded response word
+    by word, optionally pausing between words to behave like a slow model.
+    """
+    response = f"This is a hardcoded AI response to your message: {chat_request.human_text}"
+    delay = settings.FAKE_GENERATOR_TOKEN_DELAY_MS / 1000
+    for index, word in enumerate(response.split(" ")):
+        if delay:
+            await asyncio.sleep(delay)
+        yield word if index == 0 else f" {word}"
+
+
+async def provider_generate(chat_request: ChatRequest, history: List[dict]) -> AsyncIterator[str]:
+    """Streams the response from the provider that serves `chat_request.user_model`."""
+    messages = history + [{"role": "user", "content": chat_request.human_text}]
+    async for token in llm_providers.get_registry().stream_chat(chat_request.user_model, messages):
+        yield token
+
+
+GENERATORS: Dict[str, ResponseGenerator] = {
+    "fake": fake_generate,
+    "providers": provider_generate,
+}
+
+
+def cached(generator: ResponseGenerator, cache: response_cache.ResponseCache, scope: str = "") -> ResponseGenerator:
+    """
+    Wraps a backend so a prompt it already answered for the same model is
+    served from `cache` in one piece. A fresh response is only cached once
+    it has been generated completely. Turns with history depend on more
+    than the prompt, so they always go to the backend.
+    """
+    async def generate(chat_request: ChatRequest, history: List[dict]) -> AsyncIterator[str]:
+        if history:
+            async for token in generator(chat_request, history):
+                yield token
+            return
+        response = await cache.get(chat_request.user_model, chat_request.human_text, scope)
+        if response is not None:
+            yield response
+            return
+        tokens = []
+        async for token in generator(chat_request, history):
+            tokens.append(token)
+            yield token
+        await cache.set(chat_request.user_model, chat_request.human_text, "".join(tokens), scope)
+
+    return generate
+
+
+def get_generator(use_cache: bool = True) -> ResponseGenerator:
+    try:
+        generator = GENERATORS[settings.CHAT_GENERATOR]
+    except KeyError:
+        raise RuntimeError(f"Unknown CHAT_GENERATOR '{settings.CHAT_GENERATOR}'. Choose one of: {', '.join(GENERATORS)}")
+    if use_cache and response_cache.cache is not None:
+        return cached(generator, response_cache.cache)
+    return generator
+
+
+async def generate_response(chat_request: ChatRequest, history: Optional[List[dict]] = None,
+                            use_cache: bool = True) -> str:
+    """Runs the configured backend to completion and returns the whole response."""
+    return "".join([token async for token in get_generator(use_cache)(chat_request, history or [])])
@@ -0,0 +1,636 @@
+import asyncio
+import base64
+import datetime
+import re
+from collections import Counter
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import ValidationError
+from pymongo import ASCENDING, DESCENDING, TEXT, ReturnDocument, UpdateOne
+
+from chat_write_buffer import ChatWriteBuffer
+from message_sequence import reserve_sequence
+from file_uploads import BlobStore
+from ttl_cache import TTLCache
+from models import (
+    Conversation, ConversationPage, ConversationSummary, ImportSummary, Message, MessagePage, SearchHit, SearchPage,
+)
+
+# Collection names for the chat history store
+CONVERSATIONS_COLLECTION = "conversations"
+MESSAGES_COLLECTION = "messages"
+# A title match ranks like a message match with twice the text score.
+TITLE_SCORE_WEIGHT = 2.0
+# Characters of a message shown around the first match in search results.
+SNIPPET_LENGTH = 160
+TEXT_SCORE = {"$meta": "textScore"}
+# Conversations whose messages are read with one query while exporting.
+EXPORT_BATCH_SIZE = 100
+# Export lines are sent to the client in chunks of about this size.
+EXPORT_CHUNK_BYTES = 64 * 1024
+# Skipped import lines whose reason is reported back.
+IMPORT_MAX_ERRORS = 20
+
+
+class ConversationNotFound(Exception):
+    """Raised when a conversation does not exist or belongs to another user."""
+
+
+def utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def encode_conversation_cursor(updated_at: datetime.datetime, conversation_id: str) -> str:
+    """Packs the sort key of the last conversation on a page into an opaque cursor."""
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=datetime.timezone.utc)
+    millis = int(updated_at.timestamp() * 1000)
+    return base64.urlsafe_b64encode(f"{millis}:{conversation_id}".encode()).decode()
+
+
+def decode_conversation_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
+    """Reverses encode_conversation_cursor. Raises ValueError on a malformed cursor."""
+    try:
+        millis, conversation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":", 1)
+        updated_at = datetime.datetime.fromtimestamp(int(millis) / 1000, tz=datetime.timezone.utc)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    return updated_at, conversation_id
+
+
+def conversation_record(conversation: dict) -> dict:
+    """The export line for a conversation document."""
+    return {
+        "type": "conversation",
+        "id": conversation["_id"],
+        "title": conversation["title"],
+        "rag_mode": conversation.get("rag_mode", 0),
+        "created_at": conversation.get("created_at"),
+        "updated_at": conversation.get("updated_at"),
+    }
+
+
+def parse_timestamp(value, default: datetime.datetime) -> datetime.datetime:
+    """Reads an ISO 8601 timestamp from an import; ones without a timezone are taken as UTC."""
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise ValueError(f"invalid timestamp {value!r}")
+    timestamp = datetime.datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp
+
+
+def make_snippet(text: str, query: str) -> str:
+    """
+    The part of `text` around the first word of `query` it contains. MongoDB
+    matched on stems, so a word also counts when it shares a stem-sized prefix.
+    """
+    if len(text) <= SNIPPET_LENGTH:
+        return text
+    words = [word for word in re.findall(r"\w+", query.lower()) if len(word) > 1]
+    prefixes = {word[:max(4, len(word) - 3)] for word in words}
+    match = re.search(r"\b(?:" + "|".join(map(re.escape, prefixes)) + ")", text, re.IGNORECASE) if prefixes else None
+    start = max(0, (match.start() if match else 0) - SNIPPET_LENGTH // 4)
+    end = start + SNIPPET_LENGTH
+    return ("..." if start else "") + text[start:end].strip() + ("..." if end < len(text) else "")
+
+
+class ChatStore:
+    """
+    Keeps conversations and messages in their own collections instead of
+    embedding them in the user document.
+
+    A conversation document only holds metadata (title, rag_mode, counters),
+    and every message is a small document of its own, keyed by user id and
+    conversation id. Appending a message never rewrites a growing document,
+    and reading a user no longer pulls their whole history along.
+
+    With `write_buffer` set, turns are queued in a ChatWriteBuffer and written
+    in batches instead (see chat_write_buffer.py). Reads and deletes flush it
+    first, so callers always see their own writes.
+    """
+
+    def __init__(self, database: AsyncIOMotorDatabase, write_buffer: Optional[ChatWriteBuffer] = None):
+        self.conversations = database.get_collection(CONVERSATIONS_COLLECTION)
+        self.messages = database.get_collection(MESSAGES_COLLECTION)
+        self.write_buffer = write_buffer
+        # Conversations already known to belong to a user, so buffered appends
+        # don't need to check ownership in MongoDB every time.
+        self._owned_conversations = TTLCache(max_entries=50_000, ttl_seconds=3600)
+        # When set, deleting messages releases the images they refer to.
+        self.blob_store: Optional[BlobStore] = None
+
+    @classmethod
+    def with_write_buffer(cls, database: AsyncIOMotorDatabase, max_messages: int, max_delay_ms: int,
+                          max_pending_messages: int = 5000) -> "ChatStore":
+        store = cls(database)
+        store.write_buffer = ChatWriteBuffer(
+            store.conversations, store.messages, max_messages, max_delay_ms, max_pending_messages
+        )
+        return store
+
+    async def ensure_indexes(self) -> None:
+        """Creates the indexes used by the lookups below. Safe to call on every startup."""
+        await self.conversations.create_index(
+            [("user_id", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_id_updated_at_id",
+        )
+        await self.messages.create_index(
+            [("conversation_id", ASCENDING), ("seq", ASCENDING)],
+            name="conversation_id_seq",
+            unique=True,
+        )
+        # Text indexes for search(); the user_id prefix limits each search to one user's documents.
+        await self.conversations.create_index([("user_id", ASCENDING), ("title", TEXT)], name="user_id_title_text")
+        await self.messages.create_index([("user_id", ASCENDING), ("content", TEXT)], name="user_id_content_text")
+
+    # --- Writes ---
+
+    async def save_turn(self, user_id: str, conversation_id: Optional[str], messages: List[Message],
+                        title: str, rag_mode: int = 0) -> Optional[Conversation]:
+        """
+        Persists one chat turn. Without a `conversation_id` a new conversation
+        titled `title` is created and returned; otherwise the messages are
+        appended and None is returned. Raises ConversationNotFound if the
+        conversation does not exist for that user.
+        """
+        if not conversation_id:
+            conversation = Conversation(title=title, rag_mode=rag_mode, messages=messages)
+            await self.create_conversation(user_id, conversation)
+            return conversation
+        if not await self.append_messages(user_id, conversation_id, messages):
+            raise ConversationNotFound(conversation_id)
+        return None
+
+    async def create_conversation(self, user_id: str, conversation: Conversation) -> None:
+        """Stores a new conversation together with its first messages."""
+        now = utc_now()
+        conversation_document = {
+            "_id": conversation.id,
+            "user_id": user_id,
+            "title": conversation.title,
+            "rag_mode": conversation.rag_mode,
+            "message_count": len(conversation.messages),
+            # A new conversation numbers its messages from 1.
+            "last_seq": len(conversation.messages),
+            "created_at": now,
+            "updated_at": now,
+        }
+        message_documents = self._message_documents(user_id, conversation.id, conversation.messages, first_seq=1)
+        if self.write_buffer is not None:
+            self._owned_conversations.set((user_id, conversation.id), True)
+            await self.write_buffer.add_conversation(conversation_document, message_documents)
+            return
+
+        writes = [self.conversations.insert_one(conversation_document)]
+        if message_documents:
+            writes.append(self.messages.insert_many(message_documents))
+        # The conversation id is new, so nothing depends on the order of these two writes.
+        await asyncio.gather(*writes)
+
+    async def append_messages(self, user_id: str, conversation_id: str, messages: List[Message]) -> bool:
+        """
+        Appends messages to an existing conversation owned by the user.
+        Returns False if the conversation does not exist for that user.
+
+        Without the write buffer this takes two round trips: one conditional
+        find_one_and_update both checks ownership and reserves the messages'
+        seq numbers (bumping message_count), then insert_many writes them. If
+        the insert fails, message_count is recounted before the error is
+        raised; the reserved seq numbers are left unused, which only leaves a
+        gap in the ordering.
+        """
+        if self.write_buffer is not None:
+            if not await self.owns_conversation(user_id, conversation_id):
+                return False
+            # The buffer numbers them when it writes them.
+            await self.write_buffer.add_messages(
+                user_id, conversation_id, self._message_documents(user_id, conversation_id, messages)
+            )
+            return True
+
+        conversation = await self.conversations.find_one_and_update(
+            {"_id": conversation_id, "user_id": user_id},
+            reserve_sequence(len(messages), updated_at=utc_now()),
+            projection={"last_seq": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if conversation is None:
+            return False
+        first_seq = conversation["last_seq"] - len(messages) + 1
+        try:
+            await self.messages.insert_many(self._message_documents(user_id, conversation_id, messages, first_seq))
+        except Exception:
+            await self._recount_messages(user_id, conversation_id)
+            raise
+        return True
+
+    async def _recount_messages(self, user_id: str, conversation_id: str) -> None:
+        """Sets message_count from the messages actually stored, after an insert that may have partly failed."""
+        try:
+            message_count = await self.messages.count_documents(
+                {"conversation_id": conversation_id, "user_id": user_id}
+            )
+            await self.conversations.update_one(
+                {"_id": conversation_id, "user_id": user_id}, {"$set": {"message_count": message_count}}
+            )
+        except Exception as e:
+            print(f"Chat store: could not recount the messages of conversation {conversation_id}: {e}")
+
+    async def delete_conversation(self, user_id: str, conversation_id: str) -> bool:
+        """
+        Deletes a conversation and all of its messages, and releases the
+        images they refer to. Returns False if the conversation does not
+        exist for that user.
+        """
+        return await self.delete_conversations(user_id, [conversation_id]) > 0
+
+    async def delete_conversations(self, user_id: str, conversation_ids: List[str]) -> int:
+        """
+        Deletes several of the user's conversations and their messages with
+        one delete_many per collection. Ids that don't exist or belong to
+        someone else are skipped. Returns how many conversations were deleted.
+        """
+        if self.write_buffer is not None:
+            await self.write_buffer.flush()
+            for conversation_id in conversation_ids:
+                self._owned_conversations.pop((user_id, conversation_id))
+        delete_result = await self.conversations.delete_many({"_id": {"$in": conversation_ids}, "user_id": user_id})
+        if delete_result.deleted_count == 0:
+            return 0
+        message_filter = {"conversation_id": {"$in": conversation_ids}, "user_id": user_id}
+        image_ids = []
+        if self.blob_store is not None:
+            # One reference per message, so an image sent twice is released twice.
+            image_ids = [
+                doc["image_id"] async for doc in self.messages.find(
+                    {**message_filter, "image_id": {"$ne": None}}, {"image_id": 1}
+                )
+            ]
+        await self.messages.delete_many(message_filter)
+        if image_ids:
+            await self.blob_store.release(Counter(image_ids))
+        return delete_result.deleted_count
+
+    def forget_conversation(self, user_id: str, conversation_id: str) -> None:
+        """
+        Drops what this process has cached about a conversation another
+        worker deleted (see cache_bus.py).
+        """
+        self._owned_conversations.pop((user_id, conversation_id))
+        if self.write_buffer is not None:
+            self.write_buffer.discard(conversation_id)
+
+    # --- Reads ---
+
+    async def owns_conversation(self, user_id: str, conversation_id: str) -> bool:
+        """Whether the conversation exists and belongs to the user; usually answered from memory."""
+        if self._owned_conversations.get((user_id, conversation_id)) \
+                or (self.write_buffer is not None and self.write_buffer.is_pending(conversation_id, user_id)):
+            return True
+        found = await self.conversations.find_one({"_id": conversation_id, "user_id": user_id}, {"_id": 1})
+        if found:
+            self._owned_conversations.set((user_id, conversation_id), True)
+        return found is not None
+
+    async def list_conversations(self, user_id: str, cursor: Optional[str], limit: int) -> ConversationPage:
+        """
+        Returns one page of a user's conversations, most recently updated first.
+        Only the fields the history list needs are read from MongoDB.
+        """
+        await self._flush_for_read(user_id)
+        query: dict = {"user_id": user_id}
+        if cursor:
+            updated_at, conversation_id = decode_conversation_cursor(cursor)
+            query["$or"] = [
+                {"updated_at": {"$lt": updated_at}},
+                {"updated_at": updated_at, "_id": {"$lt": conversation_id}},
+            ]
+
+        docs = await self.conversations.find(
+            query, {"title": 1, "rag_mode": 1, "updated_at": 1}
+        ).sort([("updated_at", DESCENDING), ("_id", DESCENDING)]).limit(limit + 1).to_list(length=limit + 1)
+
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_conversation_cursor(docs[-1]["updated_at"], docs[-1]["_id"])
+
+        return ConversationPage(
+            conversations=[
+                ConversationSummary(id=doc["_id"], title=doc["title"], rag_mode=doc.get("rag_mode", 0))
+                for doc in docs
+            ],
+            next_cursor=next_cursor,
+        )
+
+    async def list_messages(self, user_id: str, conversation_id: str, before: Optional[int], limit: int) -> MessagePage:
+        """
+        Returns the newest `limit` messages of a conversation that are older
+        than the `before` sequence number (or the newest messages if it is None).
+        """
+        await self._flush_for_read(user_id)
+        query: dict = {"conversation_id": conversation_id, "user_id": user_id}
+        if before is not None:
+            query["seq"] = {"$lt": before}
+
+        docs = await self.messages.find(
+            query, {"_id": 0, "user_id": 0, "conversation_id": 0, "created_at": 0}
+        ).sort("seq", DESCENDING).limit(limit + 1).to_list(length=limit + 1)
+
+        next_before = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_before = docs[-1]["seq"]
+
+        docs.reverse()
+        # Documents written by this store are already valid messages, so skip validating them again.
+        return MessagePage(messages=[Message.model_construct(**doc) for doc in docs], next_before=next_before)
+
+    async def search(self, user_id: str, query: str, offset: int, limit: int) -> SearchPage:
+        """
+        Finds the user's messages and conversation titles matching `query`
+        (MongoDB text search: words are stemmed, "quoted phrases" and -excluded
+        words work), best match first, with a snippet for each hit.
+        """
+        await self._flush_for_read(user_id)
+        # Title and message hits are ranked together, so read enough of both to fill this page.
+        window = offset + limit + 1
+        text_query = {"user_id": user_id, "$text": {"$search": query}}
+        title_docs, message_docs = await asyncio.gather(
+            self.conversations.find(text_query, {"title": 1, "score": TEXT_SCORE})
+                .sort([("score", TEXT_SCORE)]).limit(window).to_list(length=window),
+            self.messages.find(
+                text_query, {"_id": 0, "conversation_id": 1, "seq": 1, "role": 1, "content": 1, "score": TEXT_SCORE}
+            ).sort([("score", TEXT_SCORE)]).limit(window).to_list(length=window),
+        )
+
+        ranked = sorted(
+            [(doc["score"] * TITLE_SCORE_WEIGHT, doc) for doc in title_docs] + [(doc["score"], doc) for doc in message_docs],
+            key=lambda scored: scored[0], reverse=True,
+        )
+        page = ranked[offset:offset + limit]
+
+        titles = {doc["_id"]: doc["title"] for doc in title_docs}
+        missing = {doc["conversation_id"] for _, doc in page if "conversation_id" in doc} - titles.keys()
+        if missing:
+            async for doc in self.conversations.find({"_id": {"$in": list(missing)}, "user_id": user_id}, {"title": 1}):
+                titles[doc["_id"]] = doc["title"]
+
+        hits = []
+        for score, doc in page:
+            if "conversation_id" in doc:
+                hits.append(SearchHit(
+                    conversation_id=doc["conversation_id"], conversation_title=titles.get(doc["conversation_id"], ""),
+                    message_seq=doc["seq"], role=doc["role"], snippet=make_snippet(doc["content"], query), score=score,
+                ))
+            else:
+                hits.append(SearchHit(
+                    conversation_id=doc["_id"], conversation_title=doc["title"],
+                    snippet=make_snippet(doc["title"], query), score=score,
+                ))
+        next_offset = offset + limit if len(ranked) > offset + limit else None
+        return SearchPage(hits=hits, next_offset=next_offset)
+
+    async def get_context_slice(self, user_id: str, conversation_id: str, limit: int) -> Tuple[Optional[dict], List[dict]]:
+        """
+        Returns the conversation's rolling summary fields and, oldest first,
+        up to `limit` of its newest messages that the summary doesn't cover.
+        Returns (None, []) if the conversation does not exist for that user.
+        """
+        await self._flush_for_read(user_id)
+        # Both reads go out together; the summary's cut-off is applied afterwards.
+        conversation, docs = await asyncio.gather(
+            self.conversations.find_one(
+                {"_id": conversation_id, "user_id": user_id}, {"summary": 1, "summary_until_seq": 1}
+            ),
+            self.messages.find(
+                {"conversation_id": conversation_id, "user_id": user_id}, {"_id": 0, "role": 1, "content": 1, "seq": 1}
+            ).sort("seq", DESCENDING).limit(limit).to_list(length=limit),
+        )
+        if conversation is None:
+            return None, []
+        summary_until_seq = conversation.get("summary_until_seq", 0)
+        docs = [doc for doc in docs if doc["seq"] > summary_until_seq]
+        docs.reverse()
+        return conversation, docs
+
+    async def iter_message_batches(self, user_id: str, conversation_id: str, after_seq: int, before_seq: int,
+                                   batch_size: int) -> AsyncIterator[List[dict]]:
+        """
+        Yields the messages with `after_seq` < seq < `before_seq`, oldest first,
+        in lists of up to `batch_size`, each read with its own query.
+        """
+        while True:
+            batch = await self.messages.find(
+                {"conversation_id": conversation_id, "user_id": user_id, "seq": {"$gt": after_seq, "$lt": before_seq}},
+                {"_id": 0, "role": 1, "content": 1, "seq": 1},
+            ).sort("seq", ASCENDING).limit(batch_size).to_list(length=batch_size)
+            if not batch:
+                return
+            yield batch
+            after_seq = batch[-1]["seq"]
+
+    async def update_summary(self, user_id: str, conversation_id: str, previous_until_seq: int,
+                             summary: str, until_seq: int) -> bool:
+        """
+        Stores a new rolling summary covering messages up to `until_seq`,
+        unless another turn already moved the summary on from `previous_until_seq`.
+        """
+        update_result = await self.conversations.update_one(
+            {
+                "_id": conversation_id,
+                "user_id": user_id,
+                # A conversation without a summary has no summary_until_seq yet.
+                "summary_until_seq": previous_until_seq or {"$in": [0, None]},
+            },
+            {"$set": {"summary": summary, "summary_until_seq": until_seq}},
+        )
+        return update_result.modified_count > 0
+
+    # --- Export and import ---
+    # An export is NDJSON: a {"type": "conversation", ...} line for each
+    # conversation, followed by a {"type": "message", ...} line for each of
+    # its messages, oldest first.
+
+    async def export_ndjson(self, user_id: str) -> AsyncIterator[bytes]:
+        """
+        Yields the user's whole history as NDJSON, in chunks of about
+        EXPORT_CHUNK_BYTES. Conversations come from one cursor and their
+        messages are read for EXPORT_BATCH_SIZE conversations at a time, so
+        memory use doesn't grow with the size of the history.
+        """
+        await self._flush_for_read(user_id)
+        chunk: List[bytes] = []
+        chunk_size = 0
+        async for record in self._export_records(user_id):
+            line = orjson.dumps(record, option=orjson.OPT_NAIVE_UTC | orjson.OPT_APPEND_NEWLINE)
+            chunk.append(line)
+            chunk_size += len(line)
+            if chunk_size >= EXPORT_CHUNK_BYTES:
+                yield b"".join(chunk)
+                chunk, chunk_size = [], 0
+        if chunk:
+            yield b"".join(chunk)
+
+    async def import_ndjson(self, user_id: str, lines: AsyncIterator[bytes], batch_size: int) -> ImportSummary:
+        """
+        Adds the conversations of an export to the user's history. Each one
+        gets a new id, so importing a file twice makes copies rather than
+        overwriting anything. Documents are written with one insert_many per
+        `batch_size` of them. A line that can't be imported is skipped and
+        reported, and the rest of the file is still imported.
+
+        Images are not carried over: their files live in the blob store of
+        the server the export came from.
+        """
+        summary = ImportSummary()
+        # Conversation id in the file -> id it was imported as
+        imported_ids: Dict[str, str] = {}
+        # Imported conversation id -> seq of its last message so far
+        last_seqs: Counter = Counter()
+        conversation_documents: List[dict] = []
+        message_documents: List[dict] = []
+        line_number = 0
+        async for line in lines:
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                record = orjson.loads(line)
+                kind = record.get("type") if isinstance(record, dict) else None
+                if kind == "conversation":
+                    conversation_documents.append(self._imported_conversation(user_id, record, imported_ids))
+                elif kind == "message":
+                    message_documents.append(self._imported_message(user_id, record, imported_ids, last_seqs))
+                else:
+                    raise ValueError('not a "conversation" or "message" record')
+            except ValidationError as e:
+                self._skip_import_line(summary, line_number, "; ".join(
+                    f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()
+                ))
+            except ValueError as e:  # also orjson.JSONDecodeError
+                self._skip_import_line(summary, line_number, str(e))
+            if len(conversation_documents) + len(message_documents) >= batch_size:
+                await self._write_import_batch(summary, conversation_documents, message_documents)
+                conversation_documents, message_documents = [], []
+        await self._write_import_batch(summary, conversation_documents, message_documents)
+        return summary
+
+    # --- Helpers ---
+
+    async def _flush_for_read(self, user_id: str) -> None:
+        if self.write_buffer is not None and self.write_buffer.has_pending_for_user(user_id):
+            await self.write_buffer.flush()
+
+    async def _export_records(self, user_id: str) -> AsyncIterator[dict]:
+        batch: List[dict] = []
+        conversations = self.conversations.find(
+            {"user_id": user_id}, {"title": 1, "rag_mode": 1, "created_at": 1, "updated_at": 1}
+        ).sort([("updated_at", DESCENDING), ("_id", DESCENDING)])
+        async for conversation in conversations:
+            batch.append(conversation)
+            if len(batch) == EXPORT_BATCH_SIZE:
+                async for record in self._export_batch(user_id, batch):
+                    yield record
+                batch = []
+        async for record in self._export_batch(user_id, batch):
+            yield record
+
+    async def _export_batch(self, user_id: str, conversations: List[dict]) -> AsyncIterator[dict]:
+        # One query for the whole batch; its messages arrive grouped by conversation.
+        not_yet_exported = {conversation["_id"]: conversation for conversation in conversations}
+        if not not_yet_exported:
+            return
+        messages = self.messages.find(
+            {"conversation_id": {"$in": list(not_yet_exported)}, "user_id": user_id},
+            {"_id": 0, "conversation_id": 1, "role": 1, "content": 1, "image_id": 1, "file_name": 1, "created_at": 1},
+        ).sort([("conversation_id", ASCENDING), ("seq", ASCENDING)])
+        async for message in messages:
+            conversation = not_yet_exported.pop(message["conversation_id"], None)
+            if conversation is not None:
+                yield conversation_record(conversation)
+            yield {"type": "message", **message}
+        # Conversations without messages
+        for conversation in not_yet_exported.values():
+            yield conversation_record(conversation)
+
+    @staticmethod
+    def _imported_conversation(user_id: str, record: dict, imported_ids: Dict[str, str]) -> dict:
+        exported_id = record.get("id")
+        if not isinstance(exported_id, str):
+            raise ValueError("conversation without an id")
+        conversation = Conversation(title=record.get("title"), rag_mode=record.get("rag_mode", 0))
+        imported_ids[exported_id] = conversation.id
+        created_at = parse_timestamp(record.get("created_at"), utc_now())
+        return {
+            "_id": conversation.id,
+            "user_id": user_id,
+            "title": conversation.title,
+            "rag_mode": conversation.rag_mode,
+            # Counted up as its messages are written
+            "message_count": 0,
+            "last_seq": 0,
+            "created_at": created_at,
+            "updated_at": parse_timestamp(record.get("updated_at"), created_at),
+        }
+
+    @staticmethod
+    def _imported_message(user_id: str, record: dict, imported_ids: Dict[str, str], last_seqs: Counter) -> dict:
+        exported_id = record.get("conversation_id")
+        conversation_id = imported_ids.get(exported_id) if isinstance(exported_id, str) else None
+        if conversation_id is None:
+            raise ValueError("message before (or without) its conversation")
+        message = Message(role=record.get("role"), content=record.get("content"), file_name=record.get("file_name"))
+        last_seqs[conversation_id] += 1
+        return {
+            **message.model_dump(),
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "seq": last_seqs[conversation_id],
+            "created_at": parse_timestamp(record.get("created_at"), utc_now()),
+        }
+
+    @staticmethod
+    def _skip_import_line(summary: ImportSummary, line_number: int, reason: str) -> None:
+        summary.skipped_lines += 1
+        if len(summary.errors) < IMPORT_MAX_ERRORS:
+            summary.errors.append(f"line {line_number}: {reason}")
+
+    async def _write_import_batch(self, summary: ImportSummary, conversation_documents: List[dict],
+                                  message_documents: List[dict]) -> None:
+        # Conversations first, so a message is never stored without its conversation.
+        if conversation_documents:
+            await self.conversations.insert_many(conversation_documents, ordered=False)
+            summary.conversations += len(conversation_documents)
+        if message_documents:
+            await self.messages.insert_many(message_documents, ordered=False)
+            message_counts = Counter(document["conversation_id"] for document in message_documents)
+            await self.conversations.bulk_write(
+                [UpdateOne({"_id": conversation_id}, {"$inc": {"message_count": count, "last_seq": count}})
+                 for conversation_id, count in message_counts.items()],
+                ordered=False,
+            )
+            summary.messages += len(message_documents)
+
+    @staticmethod
+    def _message_documents(user_id: str, conversation_id: str, messages: List[Message],
+                           first_seq: Optional[int] = None) -> List[dict]:
+        """Message documents, numbered from `first_seq` when it is given."""
+        now = utc_now()
+        documents = []
+        for offset, message in enumerate(messages):
+            document = {
+                **message.model_dump(),
+                "user_id": user_id,
+                "conversation_id": conversation_id,
+                "created_at": now,
+            }
+            if first_seq is not None:
+                document["seq"] = first_seq + offset
+            documents.append(document)
+        return documents
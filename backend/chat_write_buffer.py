@@ -0,0 +1,292 @@
+"""
+Optional write-behind mode for chat turns (CHAT_WRITE_BUFFER=1).
+
+Instead of writing every turn to MongoDB as it happens, ChatStore hands new
+conversations and appended messages to a ChatWriteBuffer. The buffer
+coalesces everything pending for the same conversation and writes it all
+at once: new conversations with one bulk_write, and all messages with one
+unordered insert_many. Messages are numbered when they are written; those
+for existing conversations take their numbers with one atomic update per
+conversation, which also counts them (see message_sequence.py).
+
+A flush happens every `max_delay_ms`, as soon as `max_messages` messages are
+waiting, before any read or delete that could see the pending data, and on
+shutdown. While MongoDB accepts the writes, the most that can be lost if the
+process dies is therefore `max_messages` messages or `max_delay_ms` worth of
+turns, whichever is smaller.
+
+A batch that fails to write (e.g. while MongoDB is unreachable) is put back
+in the queue and retried, with the delay between attempts doubling up to
+RETRY_MAX_DELAY_SECONDS. Turns keep being accepted meanwhile, but only until
+`max_pending_messages` messages are waiting: past that, add_conversation and
+add_messages raise BufferFull (answered with a 503) instead of queueing. So
+during an outage a crash loses at most `max_pending_messages` messages.
+Part of a failed batch may have been written, so a retry is made idempotent:
+messages keep the _id they were given, duplicates are ignored, and the
+conversations involved get their message_count recounted instead of incremented.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from message_sequence import reserve_sequence
+
+# Longest wait between two attempts to write a batch that failed.
+RETRY_MAX_DELAY_SECONDS = 30.0
+DUPLICATE_KEY = 11000
+
+
+class BufferFull(Exception):
+    """Raised when too many messages are waiting for a retry to accept more. Answered with a 503."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Chat history cannot be saved right now, please try again shortly.")
+        self.retry_after = retry_after
+
+
+@dataclass
+class PendingConversation:
+    user_id: str
+    # Set when the conversation itself has not been written yet.
+    new_document: Optional[dict] = None
+    messages: List[dict] = field(default_factory=list)
+    # Set when a flush of this conversation failed, so some of it may already be written.
+    retried: bool = False
+
+
+class ChatWriteBuffer:
+    def __init__(self, conversations, messages, max_messages: int = 500, max_delay_ms: int = 200,
+                 max_pending_messages: int = 5000):
+        self.conversations = conversations
+        self.messages = messages
+        self.max_messages = max_messages
+        self.max_delay = max_delay_ms / 1000
+        self.max_pending_messages = max_pending_messages
+        self._pending: Dict[str, PendingConversation] = {}
+        self._pending_messages = 0
+        # The batch currently being written, so reads can tell they must wait for it.
+        self._flushing: Dict[str, PendingConversation] = {}
+        self._flush_lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        # Backoff after a failed flush; 0 when the last one succeeded.
+        self._retry_delay = 0.0
+        self._next_attempt = 0.0
+        self.flushes = 0
+        self.flushed_messages = 0
+        self.failed_flushes = 0
+        self.rejected_messages = 0
+
+    def start(self) -> None:
+        self._timer = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """Stops the timer and writes out everything still pending."""
+        if self._timer is not None:
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+            self._timer = None
+        await self.flush()
+
+    # --- Queueing ---
+
+    def is_pending(self, conversation_id: str, user_id: str) -> bool:
+        pending = self._pending.get(conversation_id)
+        return pending is not None and pending.user_id == user_id
+
+    def has_pending_for_user(self, user_id: str) -> bool:
+        return any(
+            pending.user_id == user_id
+            for pending in (*self._pending.values(), *self._flushing.values())
+        )
+
+    async def add_conversation(self, conversation_document: dict, message_documents: List[dict]) -> None:
+        self._check_room(len(message_documents))
+        pending = PendingConversation(conversation_document["user_id"], new_document=conversation_document)
+        self._pending[conversation_document["_id"]] = pending
+        await self._add_messages(pending, message_documents)
+
+    async def add_messages(self, user_id: str, conversation_id: str, message_documents: List[dict]) -> None:
+        """Queues messages for a conversation the caller has already checked belongs to `user_id`."""
+        self._check_room(len(message_documents))
+        pending = self._pending.setdefault(conversation_id, PendingConversation(user_id))
+        await self._add_messages(pending, message_documents)
+
+    def _check_room(self, count: int) -> None:
+        """Raises BufferFull rather than let failed flushes pile up more than max_pending_messages."""
+        if self._pending_messages + count > self.max_pending_messages:
+            self.rejected_messages += count
+            raise BufferFull(max(self._next_attempt - time.monotonic(), self.max_delay))
+
+    async def _add_messages(self, pending: PendingConversation, message_documents: List[dict]) -> None:
+        pending.messages.extend(message_documents)
+        self._pending_messages += len(message_documents)
+        if self._pending_messages >= self.max_messages and time.monotonic() >= self._next_attempt:
+            # The caller waits for this flush, which keeps the buffer (and what a crash can lose) bounded.
+            try:
+                await self.flush()
+            except Exception:
+                pass  # Already reported by flush(); the caller's turn stays queued for the retry.
+
+    def discard(self, conversation_id: str) -> None:
+        """Drops whatever is pending for a conversation that has been deleted."""
+        pending = self._pending.pop(conversation_id, None)
+        if pending is not None:
+            self._pending_messages -= len(pending.messages)
+
+    # --- Flushing ---
+
+    async def flush(self) -> None:
+        """
+        Writes everything pending with one bulk_write and one insert_many.
+        If that fails, the batch goes back in the queue and the error is raised.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch = self._flushing = self._pending
+            self._pending = {}
+            self._pending_messages = 0
+            try:
+                message_count = await self._write(batch)
+            except Exception as e:
+                self._requeue(batch)
+                self.failed_flushes += 1
+                self._retry_delay = min(RETRY_MAX_DELAY_SECONDS, max(self.max_delay, self._retry_delay * 2))
+                self._next_attempt = time.monotonic() + self._retry_delay
+                print(f"Chat write buffer: flush failed, {self._pending_messages} messages queued "
+                      f"for a retry in {self._retry_delay:.1f}s: {e}")
+                raise
+            finally:
+                self._flushing = {}
+            self._retry_delay = 0.0
+            self._next_attempt = 0.0
+            self.flushes += 1
+            self.flushed_messages += message_count
+
+    async def _write(self, batch: Dict[str, PendingConversation]) -> int:
+        # 1. New conversations are numbered here and inserted whole.
+        conversation_ops = []
+        reservations = []
+        for conversation_id, pending in batch.items():
+            unnumbered = [document for document in pending.messages if "seq" not in document]
+            if pending.new_document is not None and not pending.retried:
+                document = dict(pending.new_document)
+                number_messages(unnumbered, document["last_seq"] + 1)
+                document["last_seq"] += len(unnumbered)
+                document["message_count"] = len(pending.messages)
+                if pending.messages:
+                    document["updated_at"] = pending.messages[-1]["created_at"]
+                conversation_ops.append(InsertOne(document))
+                continue
+            if pending.new_document is not None:
+                # It may or may not have been inserted by the failed attempt.
+                conversation_ops.append(self._upsert_op(conversation_id, pending))
+            if unnumbered:
+                reservations.append(self._reserve(conversation_id, pending, unnumbered))
+        if conversation_ops:
+            await self.conversations.bulk_write(conversation_ops, ordered=False)
+        # 2. Messages for existing conversations take numbers from their counters.
+        await asyncio.gather(*reservations)
+
+        # 3. insert_many gives each document an _id in place, so a retry inserts the same ones again.
+        message_documents = [
+            document for pending in batch.values() for document in pending.messages if "seq" in document
+        ]
+        if message_documents:
+            await ignore_duplicates(self.messages.insert_many(message_documents, ordered=False))
+        retried = [(conversation_id, pending) for conversation_id, pending in batch.items() if pending.retried]
+        if retried:
+            # After the messages, so the count includes all of them.
+            await self.conversations.bulk_write(
+                [await self._recount_op(conversation_id, pending) for conversation_id, pending in retried],
+                ordered=False,
+            )
+        return len(message_documents)
+
+    async def _reserve(self, conversation_id: str, pending: PendingConversation, unnumbered: List[dict]) -> None:
+        # A retried conversation is recounted afterwards instead of incremented.
+        conversation = await self.conversations.find_one_and_update(
+            {"_id": conversation_id, "user_id": pending.user_id},
+            reserve_sequence(
+                len(unnumbered),
+                updated_at=None if pending.retried else unnumbered[-1]["created_at"],
+                count_messages=not pending.retried,
+            ),
+            projection={"last_seq": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if conversation is None:
+            # Deleted in the meantime; its messages stay unnumbered and are not written.
+            return
+        number_messages(unnumbered, conversation["last_seq"] - len(unnumbered) + 1)
+
+    @staticmethod
+    def _upsert_op(conversation_id: str, pending: PendingConversation) -> UpdateOne:
+        numbered = [document["seq"] for document in pending.messages if "seq" in document]
+        fields = {key: value for key, value in pending.new_document.items() if key not in ("_id", "user_id")}
+        fields["last_seq"] = max(numbered, default=fields["last_seq"])
+        return UpdateOne({"_id": conversation_id, "user_id": pending.user_id}, {"$setOnInsert": fields}, upsert=True)
+
+    async def _recount_op(self, conversation_id: str, pending: PendingConversation) -> UpdateOne:
+        """An update that is correct however much of an earlier attempt was written."""
+        message_count = await self.messages.count_documents(
+            {"conversation_id": conversation_id, "user_id": pending.user_id}
+        )
+        update = {"$set": {"message_count": message_count}}
+        if pending.messages:
+            update["$max"] = {"updated_at": pending.messages[-1]["created_at"]}
+        return UpdateOne({"_id": conversation_id, "user_id": pending.user_id}, update)
+
+    def _requeue(self, batch: Dict[str, PendingConversation]) -> None:
+        """Puts a failed batch back ahead of whatever was queued while it was being written."""
+        for conversation_id, failed in batch.items():
+            failed.retried = True
+            queued = self._pending.get(conversation_id)
+            if queued is not None:
+                failed.messages.extend(queued.messages)
+            self._pending[conversation_id] = failed
+            self._pending_messages += len(failed.messages) - (len(queued.messages) if queued else 0)
+        # Keep the failed conversations first, in their original order.
+        self._pending = {
+            **{conversation_id: self._pending[conversation_id] for conversation_id in batch},
+            **self._pending,
+        }
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(max(self.max_delay, self._next_attempt - time.monotonic()))
+            try:
+                await self.flush()
+            except Exception:
+                pass  # Already reported by flush(); keep the timer alive.
+
+    def stats(self) -> dict:
+        return {
+            "pending_conversations": len(self._pending),
+            "pending_messages": self._pending_messages,
+            "flushes": self.flushes,
+            "flushed_messages": self.flushed_messages,
+            "failed_flushes": self.failed_flushes,
+            "rejected_messages": self.rejected_messages,
+        }
+
+
+def number_messages(message_documents: List[dict], first_seq: int) -> None:
+    for offset, document in enumerate(message_documents):
+        document["seq"] = first_seq + offset
+
+
+async def ignore_duplicates(insert) -> None:
+    """Awaits an unordered insert, treating documents whose _id already exists as written."""
+    try:
+        await insert
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            if error["code"] != DUPLICATE_KEY or "_id" not in error.get("keyPattern", {"_id": 1}):
+                raise
+        if e.details.get("writeConcernErrors"):
+            raise
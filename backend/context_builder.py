@@ -0,0 +1,117 @@
+"""
+Builds the message history sent to the model for a chat turn.
+
+Only the newest messages that fit in CONTEXT_MAX_TOKENS are sent as they
+are. Older messages are folded into a rolling summary stored on the
+conversation document (`summary`, plus `summary_until_seq`, the last message
+it covers), so each turn reads a bounded slice of the conversation: the
+summary and at most CONTEXT_MAX_MESSAGES of the newest messages it doesn't
+cover yet. Messages that fall out of the window, past the token budget or
+past CONTEXT_MAX_MESSAGES, are added to the summary once, incrementally
+(the latter read in batches); the summary is never rebuilt from the full
+history.
+
+Tokens are counted with tiktoken's cl100k_base encoding when tiktoken is
+installed, otherwise estimated locally from words and punctuation.
+"""
+import re
+from typing import List, Optional
+
+from chat_store import ChatStore, ConversationNotFound
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+# Words of each folded message that make it into the summary.
+SUMMARY_WORDS_PER_MESSAGE = 30
+# Messages older than the window are read this many at a time to be folded in.
+SUMMARY_BATCH_SIZE = 200
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # not installed, or the encoding file can't be loaded offline
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Roughly what BPE tokenizers produce for English: one token per word or
+    # punctuation mark, plus one per extra 4 characters of long words.
+    return sum(1 + (len(token) - 1) // 4 for token in TOKEN_PATTERN.findall(text))
+
+
+def summarize_message(message: dict) -> str:
+    """One summary line for a message: who said it and the start of what they said."""
+    first_sentence = SENTENCE_END.split(message["content"].strip(), 1)[0]
+    words = first_sentence.split()
+    text = " ".join(words[:SUMMARY_WORDS_PER_MESSAGE]) + (" ..." if len(words) > SUMMARY_WORDS_PER_MESSAGE else "")
+    speaker = "Assistant" if message["role"] == "ai" else "User"
+    return f"{speaker}: {text}"
+
+
+def extend_summary(summary: str, messages: List[dict], max_tokens: int) -> str:
+    """Appends `messages` to `summary`, dropping its oldest lines to stay within `max_tokens`."""
+    lines = [line for line in summary.split("\n") if line] + [summarize_message(m) for m in messages]
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class ContextBuilder:
+    def __init__(self, chat_store: ChatStore, max_tokens: int, max_messages: int, summary_max_tokens: int):
+        self.chat_store = chat_store
+        self.max_tokens = max_tokens
+        self.max_messages = max_messages
+        self.summary_max_tokens = summary_max_tokens
+
+    async def build(self, user_id: str, conversation_id: Optional[str]) -> List[dict]:
+        """
+        Returns the history to send ahead of the new user message, as
+        provider-style {"role", "content"} dicts: an optional system message
+        with the summary, then the newest messages, oldest first. Raises
+        ConversationNotFound if the conversation is not the user's, so callers
+        can fail before generating anything.
+        """
+        if not conversation_id:
+            return []
+        conversation, messages = await self.chat_store.get_context_slice(user_id, conversation_id, self.max_messages)
+        if conversation is None:
+            raise ConversationNotFound(conversation_id)
+
+        # Keep the newest messages that fit in the token budget.
+        budget = self.max_tokens
+        keep_from = len(messages)
+        while keep_from > 0:
+            cost = count_tokens(messages[keep_from - 1]["content"])
+            if cost > budget:
+                break
+            budget -= cost
+            keep_from -= 1
+        # Some providers (Anthropic, Gemini) reject a conversation that starts with an AI
+        # turn, so a reply cut off from its question goes into the summary with it.
+        while keep_from < len(messages) and messages[keep_from]["role"] == "ai":
+            keep_from += 1
+        overflow, recent = messages[:keep_from], messages[keep_from:]
+
+        summary = conversation.get("summary", "")
+        previous_until_seq = conversation.get("summary_until_seq") or 0
+        until_seq = previous_until_seq
+        if len(messages) == self.max_messages:
+            # The window is full, so older messages the summary doesn't cover yet may
+            # sit between it and the summary; fold those in first, oldest first.
+            async for batch in self.chat_store.iter_message_batches(
+                user_id, conversation_id, previous_until_seq, messages[0]["seq"], SUMMARY_BATCH_SIZE
+            ):
+                summary = extend_summary(summary, batch, self.summary_max_tokens)
+                until_seq = batch[-1]["seq"]
+        if overflow:
+            summary = extend_summary(summary, overflow, self.summary_max_tokens)
+            until_seq = overflow[-1]["seq"]
+        if until_seq != previous_until_seq:
+            await self.chat_store.update_summary(user_id, conversation_id, previous_until_seq, summary, until_seq)
+
+        history = [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}] if summary else []
+        history += [{"role": m["role"], "content": m["content"]} for m in recent]
+        return history
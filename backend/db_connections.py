@@ -1,63 +1,61 @@
-import asyncio
+from typing import Optional
+
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
-import os 
-from dotenv import load_dotenv
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
 
-load_dotenv()
+import settings
+from instrumentation import MongoCommandTimer
 
 # Database and Collection names are now defined as constants
 
 DB_NAME = "librechat_db"
 COLLECTION_NAME = "users"
 
-async def get_user_collection(db_url: str, ) -> AsyncIOMotorCollection:
+async def get_user_collection(db_url: str) -> Optional[AsyncIOMotorCollection]:
     """
-    Establishes an async connection to MongoDB using only a connection string.
-    It checks for the existence of the 'librechat_db' database and 'users'
-    collection, and returns the collection object ready for use.
-
-    MongoDB creates databases and collections lazily on the first write operation.
-    This function checks if they exist *before* any potential write.
+    Establishes an async connection to MongoDB and returns the 'users'
+    collection of the 'librechat_db' database, ready for use.
 
-    
+    The connection pool size and timeouts come from settings.py. A single
+    `ping` verifies the server responds; MongoDB creates the database and
+    collections lazily on the first write, so nothing else is checked here.
+    Returns None if the server cannot be reached.
     """
     print(f"Attempting to connect to MongoDB at {db_url}...")
-    # 1. Create the client
-    client = AsyncIOMotorClient(db_url)
+    client = AsyncIOMotorClient(
+        db_url,
+        maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+        minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=settings.MONGO_SOCKET_TIMEOUT_MS or None,
+        # Feeds MongoDB command timings into /metrics.
+        event_listeners=[MongoCommandTimer()],
+    )
 
     try:
-        # The ismaster command is cheap and does not require auth. It's a good way
+        # The ping command is cheap and does not require auth. It's a good way
         # to verify that the server is responding.
-        await client.admin.command('ismaster')
+        await client.admin.command('ping')
         print(" MongoDB connection successful.")
     except Exception as e:
-        
+        print(" Could not connect to MongoDB.")
         print(f"   Error: {e}")
+        client.close()
         return None # Return None on connection failure
 
-    # 2. Check if the database exists
-    existing_dbs = await client.list_database_names()
-    if DB_NAME in existing_dbs:
-        print(f"Database '{DB_NAME}' already exists.")
-    else:
-        # Note: The database will only be physically created on the first write.
-        print(f"Database '{DB_NAME}' not found. It will be created upon first data insertion.")
-
-    # 3. Get the database object (this works even if the DB doesn't exist yet)
-    database = client[DB_NAME]
-
-    # 4. Check if the collection exists within the database
-    existing_collections = await database.list_collection_names()
-    if COLLECTION_NAME in existing_collections:
-        print(f"Collection '{COLLECTION_NAME}' already exists in '{DB_NAME}'.")
-    else:
-        # Note: The collection will only be physically created on the first write.
-        print(f"Collection '{COLLECTION_NAME}' not found. It will be created upon first data insertion.")
-
-    # 5. Get the collection object and return it
-
-    user_collection = database.get_collection(COLLECTION_NAME)
-    print(f"-> Returning collection object for '{DB_NAME}.{COLLECTION_NAME}'.")
-    return user_collection
+    return client[DB_NAME].get_collection(COLLECTION_NAME)
 
 
+async def ensure_user_indexes(user_collection: AsyncIOMotorCollection) -> None:
+    """
+    Creates the indexes the user lookups rely on. Every login, registration
+    and chat turn finds the user by email, so without this each of them
+    scans the whole collection. create_index is a no-op if the index exists.
+    """
+    try:
+        await user_collection.create_index([("email", ASCENDING)], name="email_unique", unique=True)
+    except OperationFailure as e:
+        # Most likely duplicate emails from before the index existed; the app still works, just slower.
+        print(f"Warning: could not create the unique index on users.email: {e}")
@@ -0,0 +1,75 @@
+"""
+Local, CPU-only text embedders for the RAG index.
+
+The default HashingEmbedder needs no model download: it maps word unigrams
+and bigrams into a fixed number of buckets (the "hashing trick") and
+L2-normalizes the result, so cosine similarity is a plain dot product.
+If sentence-transformers is installed, setting RAG_EMBEDDING_MODEL to one of
+its model names uses that model instead.
+"""
+import re
+import zlib
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=200_000)
+def _bucket(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8"))
+
+
+class HashingEmbedder:
+    name = "hashing-v1"
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def embed(self, texts: List[str], batch_size: int = 256) -> np.ndarray:
+        """Returns one normalized float32 vector per text, built `batch_size` texts at a time."""
+        batches = [self._embed_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        return np.vstack(batches) if batches else np.zeros((0, self.dim), dtype=np.float32)
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            tokens = TOKEN_PATTERN.findall(text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                bucket = _bucket(feature)
+                rows.append(row)
+                columns.append(bucket % self.dim)
+                # One bit of the hash decides the sign, so collisions tend to cancel out.
+                signs.append(1.0 if bucket & 0x80000000 else -1.0)
+
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp)), np.array(signs, dtype=np.float32))
+        # Dampen repeated words, then normalize every row to unit length.
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    """Wraps a sentence-transformers model (optional dependency) running on the CPU."""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = model_name
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        return self._model.encode(
+            texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+
+def load_embedder(model_name: str):
+    if model_name in ("", "hashing", HashingEmbedder.name):
+        return HashingEmbedder()
+    return SentenceTransformerEmbedder(model_name)
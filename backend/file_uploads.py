@@ -0,0 +1,420 @@
+import asyncio
+import datetime
+import hashlib
+import itertools
+import mimetypes
+import os
+import tempfile
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional, Set
+
+from fastapi import UploadFile
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from instrumentation import timed
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process owns the blob folder there.
+    fcntl = None
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it images are shown at full size.
+    Image = None
+
+UPLOADS_COLLECTION = "uploads"
+BLOBS_COLLECTION = "blobs"
+# Served as-is; anything else is sent as application/octet-stream so it can't run as a page.
+IMAGE_CONTENT_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp"}
+THUMBNAIL_FORMAT = "WEBP"
+THUMBNAIL_CONTENT_TYPE = "image/webp"
+# Uploads are read from the request and written to disk in pieces of this size.
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised while streaming an upload as soon as it goes over the size limit."""
+
+
+@dataclass
+class SavedUpload:
+    path: str
+    filename: str
+    sha256: str
+    size: int
+    # True when an identical file was already stored for this user and reused
+    deduplicated: bool = False
+
+
+class UploadStore:
+    """
+    Saves uploaded files into a user's folder without blocking the event loop.
+
+    Each upload is streamed to a temporary file in chunks, with the disk
+    writes running in a worker thread and the size limit checked as the
+    bytes arrive. A sha256 of the content is computed along the way. If the
+    user already stored a file with the same hash, the temporary file is
+    dropped and the existing one is reused; otherwise it is hard-linked into
+    place under a name no other file has. The `uploads` collection remembers
+    which hash lives at which path.
+    """
+
+    def __init__(self, database: AsyncIOMotorDatabase, max_bytes: int):
+        self.uploads = database.get_collection(UPLOADS_COLLECTION)
+        self.max_bytes = max_bytes
+
+    async def ensure_indexes(self) -> None:
+        await self.uploads.create_index(
+            [("user_id", ASCENDING), ("kind", ASCENDING), ("sha256", ASCENDING)],
+            name="user_id_kind_sha256",
+            unique=True,
+        )
+
+    async def save(self, user_id: str, upload: UploadFile, base_dir: str, user_folder: str) -> SavedUpload:
+        """
+        Stores `upload` under base_dir/user_folder and returns where it ended up.
+        Raises UploadTooLarge if the upload is bigger than `max_bytes`.
+        """
+        # Never trust the client's path; only keep the file's own name.
+        filename = os.path.basename(upload.filename or "") or "upload"
+        user_specific_dir = os.path.join(base_dir, user_folder)
+        await asyncio.to_thread(os.makedirs, user_specific_dir, exist_ok=True)
+
+        with timed("file_io"):
+            temp_path, sha256, size = await stream_to_temp_file(upload, user_specific_dir, self.max_bytes)
+        record_filter = {"user_id": user_id, "kind": base_dir, "sha256": sha256}
+        try:
+            existing = await self.uploads.find_one(record_filter, {"path": 1})
+            if existing and await asyncio.to_thread(os.path.exists, existing["path"]):
+                path = existing["path"]
+                return SavedUpload(path, os.path.basename(path), sha256, size, deduplicated=True)
+
+            with timed("file_io"):
+                final_path = await asyncio.to_thread(link_unused_name, temp_path, user_specific_dir, filename, sha256)
+        finally:
+            with timed("file_io"):
+                await asyncio.to_thread(os.remove, temp_path)
+
+        try:
+            # Only replaces the record we looked at (or its absence), so when the same
+            # content is uploaded twice at once, exactly one of the files is kept.
+            await self.uploads.update_one(
+                {**record_filter, "path": existing["path"] if existing else None},
+                {"$set": {
+                    "path": final_path,
+                    "filename": os.path.basename(final_path),
+                    "size": size,
+                    "created_at": datetime.datetime.now(datetime.timezone.utc),
+                }},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            winner = await self.uploads.find_one(record_filter, {"path": 1})
+            with timed("file_io"):
+                await asyncio.to_thread(os.remove, final_path)
+            return SavedUpload(winner["path"], os.path.basename(winner["path"]), sha256, size, deduplicated=True)
+        return SavedUpload(final_path, os.path.basename(final_path), sha256, size)
+
+
+def link_unused_name(source: str, directory: str, filename: str, sha256: str) -> str:
+    """
+    Hard-links `source` into `directory` as `filename`, or under a name
+    prefixed with its hash if a different file already has that name.
+    os.link fails rather than overwrite, so concurrent uploads can't clobber each other.
+    """
+    for attempt in itertools.count():
+        name = filename if attempt == 0 else f"{sha256[:12]}_{filename}" if attempt == 1 \
+            else f"{sha256[:12]}_{attempt}_{filename}"
+        path = os.path.join(directory, name)
+        try:
+            os.link(source, path)
+            return path
+        except FileExistsError:
+            continue
+
+
+async def stream_to_temp_file(upload: UploadFile, directory: str, max_bytes: int):
+    """Copies the upload into a temp file in `directory`, hashing it on the way."""
+    fd, temp_path = await asyncio.to_thread(tempfile.mkstemp, dir=directory, prefix=".upload-", suffix=".part")
+    temp_file = os.fdopen(fd, "wb")
+    digest = hashlib.sha256()
+    size = 0
+
+    def write_chunk(chunk: bytes) -> None:
+        # Hashing and writing both release the GIL, so do them off the event loop together.
+        digest.update(chunk)
+        temp_file.write(chunk)
+
+    try:
+        while chunk := await upload.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"Uploads are limited to {max_bytes} bytes.")
+            await asyncio.to_thread(write_chunk, chunk)
+    except BaseException:
+        await asyncio.to_thread(temp_file.close)
+        await asyncio.to_thread(os.remove, temp_path)
+        raise
+    await asyncio.to_thread(temp_file.close)
+    return temp_path, digest.hexdigest(), size
+
+
+async def iter_lines(upload: UploadFile, max_line_bytes: int) -> AsyncIterator[bytes]:
+    """
+    Yields the lines of an upload (without their line breaks) while it is
+    read in chunks, so a large file is never held in memory as a whole.
+    Raises UploadTooLarge on a line longer than `max_line_bytes`.
+    """
+    pending = b""
+    while chunk := await upload.read(CHUNK_SIZE):
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip(b"\r")
+        if len(pending) > max_line_bytes:
+            raise UploadTooLarge(f"Lines are limited to {max_line_bytes} bytes.")
+    if pending:
+        yield pending.rstrip(b"\r")
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware that answers requests to `limits` (path -> max bytes)
+    with a 413 as soon as their body is too large: right away when the
+    Content-Length says so, otherwise once the bytes received go over.
+    Starlette reads a multipart body completely (spooling files to disk)
+    before the handler runs, so a limit checked in the handler comes after
+    the whole upload has been received.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    too_large = True
+                    raise UploadTooLarge(f"Uploads are limited to {limit} bytes.")
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # Whatever the app makes of the interrupted body is replaced by the 413.
+            if too_large and not response_started:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        if too_large and not response_started:
+            await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit: int) -> None:
+        body = f'{{"detail":"Uploads are limited to {limit} bytes."}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+@dataclass
+class SavedBlob:
+    sha256: str
+    filename: str
+    size: int
+    # True when the same content was already stored (by anyone) and is shared
+    deduplicated: bool = False
+
+
+class BlobStore:
+    """
+    Content-addressed storage for uploaded images.
+
+    Each distinct file is stored once, at <root>/<ab>/<cd>/<sha256>, so equal
+    uploads share a file and different files can never overwrite each other.
+    The `blobs` collection keeps one document per file with its content type
+    and a reference count: save() adds a reference for the message that will
+    point at the blob, release() drops them when messages are deleted, and a
+    blob whose count reaches zero is removed from disk together with its
+    thumbnail. Adding and removing files happen under a lock (an flock on
+    <root>/.lock, so it also holds across worker processes), which keeps a
+    new reference from racing the removal of the same content.
+
+    When Pillow is installed, new images get a thumbnail made in a background
+    thread pool; until it exists, the thumbnail URL serves the original.
+    """
+
+    def __init__(self, database: AsyncIOMotorDatabase, root: str, max_bytes: int,
+                 thumbnail_size: int, thumbnail_executor: Optional[Executor] = None):
+        self.blobs = database.get_collection(BLOBS_COLLECTION)
+        self.root = root
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_executor = thumbnail_executor
+        self._lock = asyncio.Lock()
+        self._lock_file = None
+        # Thumbnails being made, kept referenced until they finish.
+        self._thumbnail_tasks: Set[asyncio.Task] = set()
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def thumbnail_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "thumbnails", sha256[:2], sha256)
+
+    async def save(self, upload: UploadFile) -> SavedBlob:
+        """
+        Stores `upload` and adds one reference to it. Raises UploadTooLarge if
+        the upload is bigger than `max_bytes`.
+        """
+        filename = os.path.basename(upload.filename or "") or "upload"
+        content_type = mimetypes.guess_type(filename)[0]
+        if content_type not in IMAGE_CONTENT_TYPES:
+            content_type = "application/octet-stream"
+        temp_dir = os.path.join(self.root, "tmp")
+        await asyncio.to_thread(os.makedirs, temp_dir, exist_ok=True)
+
+        with timed("file_io"):
+            temp_path, sha256, size = await stream_to_temp_file(upload, temp_dir, self.max_bytes)
+        try:
+            async with self._locked():
+                blob = await self.blobs.find_one_and_update(
+                    {"_id": sha256},
+                    {
+                        "$inc": {"refcount": 1},
+                        "$setOnInsert": {
+                            "size": size,
+                            "content_type": content_type,
+                            "created_at": datetime.datetime.now(datetime.timezone.utc),
+                        },
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                final_path = self.path(sha256)
+                with timed("file_io"):
+                    stored = await asyncio.to_thread(os.path.exists, final_path)
+                    if not stored:
+                        await asyncio.to_thread(os.makedirs, os.path.dirname(final_path), exist_ok=True)
+                        await asyncio.to_thread(os.replace, temp_path, final_path)
+        finally:
+            with timed("file_io"):
+                if await asyncio.to_thread(os.path.exists, temp_path):
+                    await asyncio.to_thread(os.remove, temp_path)
+
+        if not stored and Image is not None and blob["content_type"] in IMAGE_CONTENT_TYPES:
+            task = asyncio.create_task(self._make_thumbnail(sha256))
+            self._thumbnail_tasks.add(task)
+            task.add_done_callback(self._thumbnail_tasks.discard)
+        return SavedBlob(sha256, filename, size, deduplicated=stored)
+
+    async def release(self, references: Dict[str, int]) -> int:
+        """
+        Drops references (sha256 -> how many) and deletes the blobs nothing
+        refers to anymore. Returns how many blobs were deleted.
+        """
+        references = {sha256: count for sha256, count in references.items() if count > 0}
+        if not references:
+            return 0
+        removed = 0
+        async with self._locked():
+            for sha256, count in references.items():
+                blob = await self.blobs.find_one_and_update(
+                    {"_id": sha256}, {"$inc": {"refcount": -count}}, return_document=ReturnDocument.AFTER
+                )
+                if blob is None or blob["refcount"] > 0:
+                    continue
+                await self.blobs.delete_one({"_id": sha256})
+                for path in (self.path(sha256), self.thumbnail_path(sha256)):
+                    try:
+                        await asyncio.to_thread(os.remove, path)
+                    except FileNotFoundError:
+                        pass
+                removed += 1
+        return removed
+
+    async def content_type(self, sha256: str) -> Optional[str]:
+        """The stored content type, or None if there is no such blob."""
+        blob = await self.blobs.find_one({"_id": sha256}, {"content_type": 1})
+        return blob["content_type"] if blob else None
+
+    async def stop(self) -> None:
+        """Waits for the thumbnails still being made."""
+        if self._thumbnail_tasks:
+            await asyncio.gather(*self._thumbnail_tasks, return_exceptions=True)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    @asynccontextmanager
+    async def _locked(self):
+        async with self._lock:
+            if fcntl is None:
+                yield
+                return
+            if self._lock_file is None:
+                await asyncio.to_thread(os.makedirs, self.root, exist_ok=True)
+                self._lock_file = open(os.path.join(self.root, ".lock"), "w")
+            await asyncio.to_thread(fcntl.flock, self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    async def _make_thumbnail(self, sha256: str) -> None:
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self.thumbnail_executor, make_thumbnail, self.path(sha256), self.thumbnail_path(sha256),
+                self.thumbnail_size,
+            )
+        except Exception as e:
+            print(f"Blob store: no thumbnail for {sha256}: {e}")
+            return
+        async with self._locked():
+            # The blob may have been released while its thumbnail was being made.
+            if await self.blobs.find_one({"_id": sha256}, {"_id": 1}) is None:
+                try:
+                    await asyncio.to_thread(os.remove, self.thumbnail_path(sha256))
+                except FileNotFoundError:
+                    pass
+
+
+def make_thumbnail(source: str, target: str, size: int) -> None:
+    """Writes a WebP of `source` scaled to fit in size x size. Runs in a worker thread."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp_path = target + ".part"
+    with Image.open(source) as image:
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image.save(temp_path, THUMBNAIL_FORMAT)
+    os.replace(temp_path, target)
@@ -0,0 +1,176 @@
+"""
+Background queue for "document uploaded" events.
+
+The upload endpoints only enqueue a job and return; a fixed number of worker
+tasks pick jobs up and run the (CPU-heavy) parsing and embedding off the
+request path. Failed jobs are retried with exponential backoff, and the
+status of recent jobs can be polled through /api/ingestion/jobs/{job_id}.
+
+Jobs run in the worker process that accepted them, but their status is also
+written to the `ingestion_jobs` collection, so a poll answered by another
+worker process still finds them.
+"""
+import asyncio
+import dataclasses
+import datetime
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+INGESTION_JOBS_COLLECTION = "ingestion_jobs"
+# Job statuses are kept in MongoDB for this long after the job was submitted.
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+
+def utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+@dataclass
+class IngestionJob:
+    user_folder: str
+    filename: Optional[str] = None
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    status: str = "queued"  # queued -> running -> done | failed
+    attempts: int = 0
+    error: Optional[str] = None
+    created_at: datetime.datetime = field(default_factory=utc_now)
+    finished_at: Optional[datetime.datetime] = None
+
+
+JobHandler = Callable[[IngestionJob], Awaitable[None]]
+
+
+class IngestionQueue:
+    """
+    An asyncio job queue with `concurrency` workers. The handler itself
+    decides where the heavy lifting runs (a thread or a process pool), so
+    the event loop only ever awaits it.
+    """
+
+    def __init__(self, handler: JobHandler, concurrency: int = 2, max_attempts: int = 3,
+                 retry_delay: float = 1.0, max_jobs_kept: int = 1000,
+                 jobs: Optional[AsyncIOMotorCollection] = None):
+        self.handler = handler
+        # Where job statuses are shared with the other worker processes, if anywhere.
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_jobs_kept = max_jobs_kept
+        self._queue: "asyncio.Queue[IngestionJob]" = asyncio.Queue()
+        # Recent jobs by id, oldest first, so finished ones can be forgotten in order.
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._workers: List[asyncio.Task] = []
+
+    async def ensure_indexes(self) -> None:
+        if self.jobs is not None:
+            await self.jobs.create_index(
+                "created_at", name="created_at_ttl", expireAfterSeconds=JOB_RETENTION_SECONDS
+            )
+
+    def start(self) -> None:
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self, drain_timeout: float = 0) -> None:
+        """Waits up to `drain_timeout` seconds for the queued jobs to finish, then cancels the rest."""
+        if drain_timeout > 0 and self._workers:
+            try:
+                await asyncio.wait_for(self._queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                print(f"Ingestion queue: {self._queue.qsize()} job(s) still queued at shutdown were dropped.")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, user_folder: str, filename: Optional[str] = None) -> IngestionJob:
+        """
+        Queues a job for `user_folder`. If a job for the same folder is still
+        waiting to run it already covers this upload, so that job is returned.
+        """
+        for job in reversed(self._jobs.values()):
+            if job.user_folder == user_folder and job.status == "queued":
+                return job
+        job = IngestionJob(user_folder=user_folder, filename=filename)
+        self._jobs[job.id] = job
+        self._forget_old_jobs()
+        # Saved before the id is handed out, so polling it works from the start.
+        await self._save(job)
+        self._queue.put_nowait(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[IngestionJob]:
+        """Finds a job accepted by this process or, failing that, by another one."""
+        job = self._jobs.get(job_id)
+        if job is not None or self.jobs is None:
+            return job
+        document = await self.jobs.find_one({"_id": job_id})
+        if document is None:
+            return None
+        document["id"] = document.pop("_id")
+        return IngestionJob(**document)
+
+    def stats(self) -> dict:
+        """Job counts for this process, as served at /api/metrics/ingestion."""
+        statuses = [job.status for job in self._jobs.values()]
+        return {
+            "workers": self.concurrency,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "failed": statuses.count("failed"),
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: IngestionJob) -> None:
+        job.status = "running"
+        while True:
+            job.attempts += 1
+            await self._save(job)
+            try:
+                await self.handler(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                if job.attempts >= self.max_attempts:
+                    job.status = "failed"
+                    job.finished_at = utc_now()
+                    await self._save(job)
+                    print(f"Ingestion job {job.id} for '{job.user_folder}' failed: {job.error}")
+                    return
+                await asyncio.sleep(self.retry_delay * 2 ** (job.attempts - 1))
+            else:
+                job.status = "done"
+                job.error = None
+                job.finished_at = utc_now()
+                await self._save(job)
+                return
+
+    async def _save(self, job: IngestionJob) -> None:
+        if self.jobs is None:
+            return
+        document = dataclasses.asdict(job)
+        document["_id"] = document.pop("id")
+        try:
+            await self.jobs.replace_one({"_id": job.id}, document, upsert=True)
+        except Exception as e:
+            # Only other processes' view of the job suffers; the job itself carries on.
+            print(f"Ingestion queue: could not save the status of job {job.id}: {e}")
+
+    def _forget_old_jobs(self) -> None:
+        while len(self._jobs) > self.max_jobs_kept:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.status in ("queued", "running"):
+                break
+            del self._jobs[oldest_id]
@@ -0,0 +1,231 @@
+"""
+Request timing and hot-path instrumentation, exposed at /metrics in the
+Prometheus text format.
+
+MetricsMiddleware times every request and records its request and response
+sizes per route. While a request runs, the time it spends in MongoDB (from
+pymongo's command monitoring), bcrypt, file I/O and JSON serialization is
+added up per phase through a context variable, so /metrics shows where each
+route's time goes. Requests slower than SLOW_REQUEST_MS are logged with
+their phase split and, for a sample of them, the stack they were waiting
+in when they crossed the threshold.
+"""
+import asyncio
+import bisect
+import contextvars
+import random
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+# Innermost frames shown for a sampled slow request.
+TRACE_DEPTH = 12
+
+
+class Histogram:
+    """A Prometheus histogram with labels. Safe to observe from any thread."""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(labels, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(labels, list(counts), total[0]) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in sorted(series):
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + "," if label_text else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+            cumulative += counts[-1]
+            yield f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}'
+            yield f"{self.name}_sum{{{label_text}}} {total}"
+            yield f"{self.name}_count{{{label_text}}} {cumulative}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram(
+    "librechat_http_request_duration_seconds", "Time to handle a request, until its response is fully sent.",
+    ("method", "route", "status"), LATENCY_BUCKETS,
+)
+REQUEST_BYTES = Histogram(
+    "librechat_http_request_size_bytes", "Size of request bodies.", ("method", "route"), SIZE_BUCKETS,
+)
+RESPONSE_BYTES = Histogram(
+    "librechat_http_response_size_bytes", "Size of response bodies.", ("method", "route"), SIZE_BUCKETS,
+)
+PHASE_SECONDS = Histogram(
+    "librechat_http_request_phase_seconds",
+    "Time a request spent in one phase (mongodb, bcrypt, file_io, serialization).",
+    ("route", "phase"), LATENCY_BUCKETS,
+)
+MONGODB_COMMAND_SECONDS = Histogram(
+    "librechat_mongodb_command_duration_seconds", "Duration of MongoDB commands, from command monitoring.",
+    ("command", "outcome"), LATENCY_BUCKETS,
+)
+ALL_METRICS = (REQUEST_SECONDS, REQUEST_BYTES, RESPONSE_BYTES, PHASE_SECONDS, MONGODB_COMMAND_SECONDS)
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in ALL_METRICS for line in metric.render()) + "\n"
+
+
+# --- Per-request phase timing ---
+# Seconds per phase for the request being handled. Motor runs pymongo in a
+# thread pool but copies the context, so the command listener sees it too.
+_request_phases: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_phases", default=None
+)
+# Guards the phase dicts, which the executor threads update alongside the event loop.
+_phases_lock = threading.Lock()
+
+
+def record_phase(phase: str, seconds: float) -> None:
+    phases = _request_phases.get()
+    if phases is not None:
+        with _phases_lock:
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Adds the time spent inside the block to `phase` of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - started)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """pymongo command listener; pass it to the client with event_listeners=[...]."""
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._record(event.command_name, "success", event.duration_micros)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._record(event.command_name, "failure", event.duration_micros)
+
+    @staticmethod
+    def _record(command: str, outcome: str, duration_micros: int) -> None:
+        seconds = duration_micros / 1_000_000
+        MONGODB_COMMAND_SECONDS.observe((command, outcome), seconds)
+        record_phase("mongodb", seconds)
+
+
+# --- Middleware ---
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (rather than BaseHTTPMiddleware) so streaming
+    responses are timed until their last byte and aren't buffered.
+    """
+
+    def __init__(self, app, slow_request_ms: int = 0, trace_sample_rate: float = 0.0):
+        self.app = app
+        self.slow_request_seconds = slow_request_ms / 1000
+        self.trace_sample_rate = trace_sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        phases: Dict[str, float] = {}
+        token = _request_phases.set(phases)
+        sizes = {"request": 0, "response": 0}
+        response_status = ["500"]
+        trace: List[str] = []
+        watchdog = None
+        if self.slow_request_seconds and random.random() < self.trace_sample_rate:
+            watchdog = asyncio.get_running_loop().call_later(
+                self.slow_request_seconds, _capture_stack, asyncio.current_task(), trace
+            )
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                response_status[0] = str(message["status"])
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_phases.reset(token)
+            if watchdog is not None:
+                watchdog.cancel()
+            # The router stores the matched route in the scope; label by its template, not the raw path.
+            route = scope.get("route")
+            route_label = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            REQUEST_SECONDS.observe((method, route_label, response_status[0]), elapsed)
+            REQUEST_BYTES.observe((method, route_label), sizes["request"])
+            RESPONSE_BYTES.observe((method, route_label), sizes["response"])
+            # A copy: a command the request started but didn't wait for may still be adding to it.
+            with _phases_lock:
+                phases = dict(phases)
+            for phase, seconds in phases.items():
+                PHASE_SECONDS.observe((route_label, phase), seconds)
+            if self.slow_request_seconds and elapsed >= self.slow_request_seconds:
+                split = ", ".join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in sorted(phases.items()))
+                print(f"Slow request: {method} {route_label} -> {response_status[0]} "
+                      f"in {elapsed * 1000:.1f}ms ({split or 'no instrumented phases'})")
+                if trace:
+                    print(trace[0], end="")
+
+
+def _capture_stack(task: Optional[asyncio.Task], trace: List[str]) -> None:
+    """Records where a request is waiting once it has become slow."""
+    if task is None or task.done():
+        return
+    # Task.get_stack() stops at the task's own coroutine; follow what it awaits instead.
+    frames = []
+    awaiting = task.get_coro()
+    while awaiting is not None:
+        frame = getattr(awaiting, "cr_frame", None) or getattr(awaiting, "gi_frame", None) \
+            or getattr(awaiting, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        awaiting = getattr(awaiting, "cr_await", None) or getattr(awaiting, "gi_yieldfrom", None) \
+            or getattr(awaiting, "ag_await", None)
+    # The outer frames are the same framework plumbing for every request.
+    summary = traceback.StackSummary.extract((frame, frame.f_lineno) for frame in frames[-TRACE_DEPTH:])
+    trace.append("  Waiting in:\n" + "".join("  " + line for line in summary.format()))
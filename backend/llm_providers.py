@@ -0,0 +1,286 @@
+"""
+Async clients for the LLM providers listed in config_files/model_settings.json.
+
+The model lists come from model_settings.json and the connection settings
+(base URL, API key variable, concurrency, timeouts) from
+provider_settings.json. Both are read at startup; when model_settings.json
+changes, main.py hands the new model lists to ProviderRegistry.set_models
+(a provider that wasn't configured at startup still needs a restart; so do
+changes to provider_settings.json). Every provider keeps
+a single long-lived httpx.AsyncClient, so its keep-alive connections (HTTP/2
+when the `h2` package is installed) and TLS sessions are reused across chat
+turns, and a semaphore caps how many requests it has in flight.
+"""
+import asyncio
+import importlib.util
+import json
+import os
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config_files")
+MODEL_SETTINGS_PATH = os.path.join(CONFIG_DIR, "model_settings.json")
+PROVIDER_SETTINGS_PATH = os.path.join(CONFIG_DIR, "provider_settings.json")
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class ProviderError(Exception):
+    """Raised when a provider cannot produce a response."""
+
+
+class Provider:
+    """
+    Base class for one provider endpoint. Subclasses only describe the wire
+    protocol: how to build the streaming request and how to pull the text out
+    of each streamed event.
+    """
+
+    def __init__(self, name: str, models: List[str], config: dict, base_url: str, api_key: Optional[str]):
+        self.name = name
+        self.models = models
+        self.api_key = api_key
+        self.max_concurrency = config.get("maxConcurrency", 16)
+        timeouts = config.get("timeouts", {})
+        self._slot_timeout = timeouts.get("pool", 10)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            http2=config.get("http2", True) and HTTP2_AVAILABLE,
+            headers=self.auth_headers(),
+            timeout=httpx.Timeout(
+                connect=timeouts.get("connect", 5),
+                read=timeouts.get("read", 60),
+                write=timeouts.get("write", 10),
+                pool=timeouts.get("pool", 10),
+            ),
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=config.get("maxKeepaliveConnections", 16),
+                keepalive_expiry=60,
+            ),
+        )
+
+    def auth_headers(self) -> dict:
+        return {}
+
+    def build_request(self, model: str, messages: List[dict]) -> httpx.Request:
+        raise NotImplementedError
+
+    def parse_event(self, event: dict) -> Optional[str]:
+        raise NotImplementedError
+
+    async def stream_chat(self, model: str, messages: List[dict]) -> AsyncIterator[str]:
+        """Sends `messages` to `model` and yields the response text as it streams in."""
+        if not self.api_key:
+            raise ProviderError(f"No API key configured for provider '{self.name}'.")
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self._slot_timeout)
+        except asyncio.TimeoutError:
+            raise ProviderError(f"Provider '{self.name}' is at its concurrency limit.")
+
+        try:
+            response = await self.client.send(self.build_request(model, messages), stream=True)
+            try:
+                if response.status_code >= 400:
+                    body = await response.aread()
+                    raise ProviderError(f"Provider '{self.name}' returned HTTP {response.status_code}: {body[:200]!r}")
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if not payload or payload == "[DONE]":
+                        continue
+                    try:
+                        event = json.loads(payload)
+                    except ValueError as e:
+                        raise ProviderError(f"Provider '{self.name}' sent a malformed event: {payload[:200]!r}") from e
+                    text = self.parse_event(event)
+                    if text:
+                        yield text
+            finally:
+                await response.aclose()
+        except httpx.HTTPError as e:
+            raise ProviderError(f"Request to provider '{self.name}' failed: {e}") from e
+        finally:
+            self._slots.release()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class OpenAIProvider(Provider):
+    """OpenAI's chat completions API, also spoken by Groq."""
+
+    def auth_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+    def build_request(self, model: str, messages: List[dict]) -> httpx.Request:
+        return self.client.build_request("POST", "chat/completions", json={
+            "model": model,
+            "messages": [
+                {"role": "assistant" if m["role"] == "ai" else m["role"], "content": m["content"]}
+                for m in messages
+            ],
+            "stream": True,
+        })
+
+    def parse_event(self, event: dict) -> Optional[str]:
+        choices = event.get("choices") or [{}]
+        return choices[0].get("delta", {}).get("content")
+
+
+class AnthropicProvider(Provider):
+    """Anthropic's messages API."""
+
+    def auth_headers(self) -> dict:
+        headers = {"anthropic-version": "2023-06-01"}
+        if self.api_key:
+            headers["x-api-key"] = self.api_key
+        return headers
+
+    def build_request(self, model: str, messages: List[dict]) -> httpx.Request:
+        body = {
+            "model": model,
+            "max_tokens": 1024,
+            "messages": [
+                {"role": "assistant" if m["role"] == "ai" else "user", "content": m["content"]}
+                for m in messages if m["role"] != "system"
+            ],
+            "stream": True,
+        }
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        if system:
+            body["system"] = system
+        return self.client.build_request("POST", "messages", json=body)
+
+    def parse_event(self, event: dict) -> Optional[str]:
+        if event.get("type") == "content_block_delta":
+            return event.get("delta", {}).get("text")
+        return None
+
+
+class GoogleProvider(Provider):
+    """Google's Gemini generateContent API."""
+
+    def auth_headers(self) -> dict:
+        return {"x-goog-api-key": self.api_key} if self.api_key else {}
+
+    def build_request(self, model: str, messages: List[dict]) -> httpx.Request:
+        body = {"contents": [
+            {"role": "model" if m["role"] == "ai" else "user", "parts": [{"text": m["content"]}]}
+            for m in messages if m["role"] != "system"
+        ]}
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        if system:
+            body["systemInstruction"] = {"parts": [{"text": system}]}
+        return self.client.build_request(
+            "POST",
+            f"models/{model}:streamGenerateContent",
+            params={"alt": "sse"},
+            json=body,
+        )
+
+    def parse_event(self, event: dict) -> Optional[str]:
+        candidates = event.get("candidates") or [{}]
+        parts = candidates[0].get("content", {}).get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+
+
+def endpoint_models(endpoint: dict) -> List[str]:
+    """The models an endpoint of model_settings.json serves, its title model included."""
+    models = list(endpoint.get("models", []))
+    if endpoint.get("titleModel") and endpoint["titleModel"] not in models:
+        models.append(endpoint["titleModel"])
+    return models
+
+
+PROTOCOLS = {
+    "openai": OpenAIProvider,
+    "anthropic": AnthropicProvider,
+    "google": GoogleProvider,
+}
+
+
+class ProviderRegistry:
+    """Routes a model name (ChatRequest.user_model) to the provider that serves it."""
+
+    def __init__(self, providers: Dict[str, Provider]):
+        self.providers = providers
+        self._by_model = {model: provider for provider in providers.values() for model in provider.models}
+
+    @classmethod
+    def from_config_files(cls, base_url_override: str = "") -> "ProviderRegistry":
+        """
+        Builds every provider found in both config files. With
+        `base_url_override` set, all providers talk to `<override>/<name>`
+        instead (see mock_llm_server.py) and no real API keys are needed.
+        """
+        with open(MODEL_SETTINGS_PATH, encoding="utf-8") as f:
+            endpoints = json.load(f)["endpoints"]
+        with open(PROVIDER_SETTINGS_PATH, encoding="utf-8") as f:
+            provider_settings = json.load(f)
+
+        providers = {}
+        for name, endpoint in endpoints.items():
+            config = provider_settings.get(name)
+            if config is None:
+                continue
+            models = endpoint_models(endpoint)
+
+            api_key = os.getenv(config.get("apiKeyEnv", ""))
+            base_url = config["baseURL"]
+            if base_url_override:
+                base_url = f"{base_url_override.rstrip('/')}/{name}"
+                api_key = api_key or "mock"
+            providers[name] = PROTOCOLS[config["protocol"]](name, models, config, base_url, api_key)
+        return cls(providers)
+
+    def set_models(self, endpoints: Dict[str, dict]) -> None:
+        """
+        Routes the models of a reloaded model_settings.json. The providers and
+        their connections are kept; endpoints without a provider are ignored.
+        """
+        models = {name: endpoint_models(endpoint) for name, endpoint in endpoints.items() if name in self.providers}
+        by_model = {model: self.providers[name] for name, names in models.items() for model in names}
+        for name, provider in self.providers.items():
+            provider.models = models.get(name, [])
+        # Swapped in one assignment, so a lookup sees either the old routing or the new one.
+        self._by_model = by_model
+
+    def for_model(self, model: str) -> Provider:
+        try:
+            return self._by_model[model]
+        except KeyError:
+            raise ProviderError(f"No provider is configured for model '{model}'.")
+
+    def stream_chat(self, model: str, messages: List[dict]) -> AsyncIterator[str]:
+        return self.for_model(model).stream_chat(model, messages)
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(provider.aclose() for provider in self.providers.values()))
+
+
+# --- Shared registry ---
+# Created once at application startup and closed at shutdown (see main.py).
+registry: Optional[ProviderRegistry] = None
+
+
+def start_providers(base_url_override: str = "") -> ProviderRegistry:
+    global registry
+    registry = ProviderRegistry.from_config_files(base_url_override)
+    return registry
+
+
+async def stop_providers() -> None:
+    global registry
+    if registry is not None:
+        await registry.aclose()
+        registry = None
+
+
+def get_registry() -> ProviderRegistry:
+    if registry is None:
+        raise ProviderError("LLM providers have not been started.")
+    return registry
@@ -1,60 +1,434 @@
 import uvicorn
-from fastapi import Body, FastAPI, HTTPException, status, Response, Request, UploadFile, File, Form
+from fastapi import Body, FastAPI, HTTPException, Path, Query, status, Response, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-import uuid
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import asyncio
+import dataclasses
+import math
 import os
-import shutil
+import secrets
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from typing import Optional
 
+import anyio
+import orjson
+import pydantic_core
+from pydantic import BaseModel
+
 # Import the specific collection type for better code completion and type checking
 from motor.motor_asyncio import AsyncIOMotorCollection
-from passlib.context import CryptContext
+from pymongo.errors import DuplicateKeyError
 
 # --- Local Imports ---
-from db_connections import get_user_collection
+from db_connections import ensure_user_indexes, get_user_collection
+from app_config import ConfigFile, ConfigSnapshot, etag_matches
+from chat_store import ChatStore, ConversationNotFound
+from chat_write_buffer import BufferFull
+from cache_bus import CacheBus
+from context_builder import ContextBuilder
+from password_hashing import HashPoolBusy, PasswordHasher
+from file_uploads import (
+    BlobStore, RequestSizeLimit, SavedBlob, SavedUpload, THUMBNAIL_CONTENT_TYPE, UploadStore, UploadTooLarge,
+    iter_lines,
+)
+from chat_generation import generate_response, get_generator
+import llm_providers
+from llm_providers import ProviderError
+import response_cache
+from instrumentation import MetricsMiddleware, render_metrics, timed
+from embeddings import load_embedder
+from ttl_cache import TTLCache
+from session_tokens import InvalidToken, SessionTokens
+from rag_engine import RagEngine, build_rag_prompt
+from ingestion_queue import INGESTION_JOBS_COLLECTION, IngestionJob, IngestionQueue
+from rate_limits import (
+    RATE_LIMITS_COLLECTION, AdmissionControl, AdmissionSlot, MemoryBuckets, MongoBuckets, Overloaded, RateLimited,
+    RateLimiter, load_rate_limits,
+)
+import settings
 from utils.file_functions import generate_formatted_name
-from models import DeleteChatRequest, RegisterRequest, LoginRequest, User, ChatRequest, Message, Conversation
-
-# --- FastAPI App Configuration ---
-# Create the FastAPI app instance
-app = FastAPI()
+from models import (
+    BulkDeleteRequest, DeleteChatRequest, RegisterRequest, LoginRequest, User, ChatRequest, Message, ConversationPage,
+    MessagePage, SearchPage, ImportSummary,
+)
 
 # --- Database Variable ---
-# We declare the variable here, but it will be initialized during the app's startup event.
+# We declare the variable here, but it will be initialized during the app's startup.
 # Using Optional and AsyncIOMotorCollection provides proper type hinting.
 user_collection: Optional[AsyncIOMotorCollection] = None
-
-# --- Lifespan Events for DB Connection ---
-@app.on_event("startup")
-async def startup_db_client():
+# Conversations and messages live in their own collections (see chat_store.py).
+chat_store: Optional[ChatStore] = None
+# Picks the part of a conversation that is sent to the model (see context_builder.py).
+context_builder: Optional[ContextBuilder] = None
+# Streams uploads to disk and deduplicates them per user (see file_uploads.py).
+upload_store: Optional[UploadStore] = None
+# Uploaded images, stored once per content and reference counted (see file_uploads.py).
+blob_store: Optional[BlobStore] = None
+thumbnail_executor: Optional[ThreadPoolExecutor] = None
+# Indexes and searches the documents users uploaded to text_files/ (see rag_engine.py).
+rag_engine: Optional[RagEngine] = None
+# Parses and embeds uploaded documents in the background (see ingestion_queue.py).
+ingestion_queue: Optional[IngestionQueue] = None
+ingestion_executor: Optional[ProcessPoolExecutor] = None
+# bcrypt runs in its own bounded thread pool so it never blocks the event loop.
+password_hasher: Optional[PasswordHasher] = None
+# Per-user and per-model token buckets, and the cap on concurrent chat turns (see rate_limits.py).
+rate_limiter: Optional[RateLimiter] = None
+admission: Optional[AdmissionControl] = None
+# The configuration served at /api/config, reloaded when the file changes (see app_config.py).
+app_config: Optional[ConfigFile] = None
+# Tells the other worker processes which cached entries went stale (see cache_bus.py).
+cache_bus: Optional[CacheBus] = None
+
+# --- Lifespan: Startup and Shutdown ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     """
-    This function runs when the FastAPI application starts.
-    It establishes the database connection and assigns the collection object.
+    Runs around the application's lifetime. Startup establishes the database
+    connection, makes sure the indexes exist and starts the background
+    workers; shutdown stops them again.
     """
     # Use 'global' to modify the variable defined in the outer scope
-    global user_collection
-    MONGO_DATABASE_URL = "mongodb://localhost:27017" # It's good practice to keep the URL here or load from env
+    global user_collection, chat_store, context_builder, upload_store, rag_engine, ingestion_queue, ingestion_executor, password_hasher, cache_bus, app_config, blob_store, thumbnail_executor, rate_limiter, admission
+    # An invalid config file stops startup here rather than on the first request.
+    app_config = ConfigFile(
+        llm_providers.MODEL_SETTINGS_PATH, settings.CONFIG_RELOAD_CHECK_SECONDS, on_reload=reload_provider_models
+    )
+    app_config.start()
     print("Application startup: Initializing database connection...")
-    user_collection = await get_user_collection(MONGO_DATABASE_URL)
+    user_collection = await get_user_collection(settings.MONGO_URL)
     
     if user_collection is None:
         # If the connection fails, the app should not start.
         # This provides a clear failure signal.
         raise Exception("Fatal: Could not connect to the database. Application shutting down.")
+
+    if settings.CHAT_WRITE_BUFFER:
+        chat_store = ChatStore.with_write_buffer(
+            user_collection.database,
+            settings.CHAT_WRITE_BUFFER_MAX_MESSAGES,
+            settings.CHAT_WRITE_BUFFER_MAX_DELAY_MS,
+            settings.CHAT_WRITE_BUFFER_MAX_PENDING_MESSAGES,
+        )
+        chat_store.write_buffer.start()
+    else:
+        chat_store = ChatStore(user_collection.database)
+    context_builder = ContextBuilder(
+        chat_store, settings.CONTEXT_MAX_TOKENS, settings.CONTEXT_MAX_MESSAGES, settings.CONTEXT_SUMMARY_MAX_TOKENS
+    )
+    upload_store = UploadStore(user_collection.database, settings.UPLOAD_MAX_BYTES)
+    thumbnail_executor = ThreadPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix="thumbnail")
+    blob_store = BlobStore(
+        user_collection.database, settings.BLOB_DIR, settings.UPLOAD_MAX_BYTES,
+        settings.THUMBNAIL_SIZE, thumbnail_executor,
+    )
+    chat_store.blob_store = blob_store
+    # Index creation is idempotent, so this is cheap once the indexes exist.
+    await asyncio.gather(
+        ensure_user_indexes(user_collection),
+        chat_store.ensure_indexes(),
+        upload_store.ensure_indexes(),
+    )
+    password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_LIMIT)
+    if settings.RATE_LIMITS_ENABLED:
+        rate_limit_config = load_rate_limits()
+        if settings.RATE_LIMIT_BACKEND == "mongodb":
+            buckets = MongoBuckets(user_collection.database.get_collection(RATE_LIMITS_COLLECTION))
+            await buckets.ensure_indexes()
+        else:
+            buckets = MemoryBuckets()
+        rate_limiter = RateLimiter(rate_limit_config, buckets)
+        admission_config = rate_limit_config["admission"]
+        admission = AdmissionControl(
+            admission_config["maxInFlight"], admission_config["maxQueue"], admission_config["queueTimeoutSeconds"]
+        )
+    llm_providers.start_providers(settings.LLM_PROVIDER_BASE_URL)
+    response_cache.start_cache(
+        settings.RESPONSE_CACHE, settings.RESPONSE_CACHE_MAX_BYTES,
+        settings.RESPONSE_CACHE_TTL_SECONDS, settings.RESPONSE_CACHE_PATH,
+    )
+    if settings.INGESTION_PROCESS_WORKERS > 0:
+        ingestion_executor = ProcessPoolExecutor(max_workers=settings.INGESTION_PROCESS_WORKERS)
+    rag_engine = RagEngine(
+        "text_files", settings.RAG_INDEX_DIR, load_embedder(settings.RAG_EMBEDDING_MODEL),
+        settings.RAG_TOP_K, executor=ingestion_executor,
+    )
+    ingestion_queue = IngestionQueue(
+        ingest_documents, settings.INGESTION_CONCURRENCY, settings.INGESTION_MAX_ATTEMPTS,
+        jobs=user_collection.database.get_collection(INGESTION_JOBS_COLLECTION),
+    )
+    await ingestion_queue.ensure_indexes()
+    ingestion_queue.start()
+    cache_bus = CacheBus(settings.CACHE_BUS_DIR)
+    cache_bus.subscribe("conversation_deleted", forget_conversation)
+    cache_bus.subscribe("rag_index", rag_engine.forget_index)
+    cache_bus.start()
     print("Application startup: Database connection successful.")
 
+    yield
+
+    # The server has stopped accepting requests and waited for in-flight ones
+    # (up to SHUTDOWN_GRACE_SECONDS); finish the background work next.
+    await ingestion_queue.stop(drain_timeout=settings.INGESTION_DRAIN_SECONDS)
+    if chat_store.write_buffer is not None:
+        # Whatever is still buffered is written before the database connection closes.
+        await chat_store.write_buffer.stop()
+    cache_bus.stop()
+    await blob_store.stop()
+    thumbnail_executor.shutdown()
+    password_hasher.shutdown()
+    if ingestion_executor is not None:
+        ingestion_executor.shutdown(wait=False, cancel_futures=True)
+    await app_config.stop()
+    await llm_providers.stop_providers()
+    response_cache.stop_cache()
+    user_collection.database.client.close()
+
+
+# --- FastAPI App Configuration ---
+# Create the FastAPI app instance
+class TimedJSONResponse(JSONResponse):
+    """
+    The default JSON response, rendered with orjson and counted as
+    "serialization" in /metrics.
+    """
+
+    def render(self, content) -> bytes:
+        with timed("serialization"):
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def model_response(model: BaseModel) -> Response:
+    """
+    Serializes a response model straight to JSON bytes (in pydantic-core),
+    for large responses. Returning a Response skips FastAPI's validation and
+    jsonable_encoder pass over the model; `response_model` still documents it.
+    """
+    with timed("serialization"):
+        body = pydantic_core.to_json(model)
+    return Response(content=body, media_type="application/json")
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
+
+
+@app.exception_handler(ProviderError)
+async def provider_error_handler(request: Request, exc: ProviderError):
+    return JSONResponse(status_code=status.HTTP_502_BAD_GATEWAY, content={"detail": str(exc)})
+
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS, content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
+async def ingest_documents(job: IngestionJob) -> None:
+    """Ingestion queue handler: indexes whatever is new in the user's document folder."""
+    if await rag_engine.sync(job.user_folder):
+        cache_bus.publish("rag_index", job.user_folder)
+
+
+def forget_conversation(key: str) -> None:
+    """Cache bus handler for a conversation another worker deleted; `key` is "user_id/conversation_id"."""
+    user_id, conversation_id = key.split("/", 1)
+    chat_store.forget_conversation(user_id, conversation_id)
+
+
+def reload_provider_models(config: ConfigSnapshot) -> None:
+    """App config listener: routes the models of a reloaded model_settings.json to the providers."""
+    if llm_providers.registry is not None:
+        llm_providers.registry.set_models(config.data["endpoints"])
+
 
 # --- Password Hashing ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def hash_pool_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="The server is busy, please try again shortly.",
+        headers={"Retry-After": "1"},
+    )
+
+async def verify_password(plain_password, hashed_password):
+    try:
+        with timed("bcrypt"):
+            return await password_hasher.verify(plain_password, hashed_password)
+    except HashPoolBusy:
+        raise hash_pool_busy()
+
+async def get_password_hash(password):
+    try:
+        with timed("bcrypt"):
+            return await password_hasher.hash(password)
+    except HashPoolBusy:
+        raise hash_pool_busy()
+
+
+# --- Sessions ---
+if not settings.SESSION_SECRET:
+    print("Warning: SESSION_SECRET is not set; using a random key, so sessions end when the server restarts.")
+session_tokens = SessionTokens(settings.SESSION_SECRET or secrets.token_urlsafe(32), settings.SESSION_TTL_SECONDS)
+# Only the fields the User response needs; chat history is paged in separately.
+USER_PROFILE_PROJECTION = {"name": 1, "email": 1}
+profile_cache: TTLCache[dict] = TTLCache(settings.PROFILE_CACHE_MAX_ENTRIES, settings.PROFILE_CACHE_TTL_SECONDS)
+
+
+def set_session_cookie(response: Response, user_id: str) -> None:
+    response.set_cookie(
+        key="token",
+        value=session_tokens.issue(user_id),
+        max_age=settings.SESSION_TTL_SECONDS,
+        httponly=True,
+        samesite="lax",
+    )
+
+
+async def get_session_profile(request: Request) -> Optional[dict]:
+    """
+    Returns the profile of the user the session cookie belongs to, or None
+    if there is no valid session. The token is checked locally and the
+    profile usually comes from the cache, so this rarely touches MongoDB.
+    """
+    token = request.cookies.get("token")
+    if not token:
+        return None
+    try:
+        user_id = session_tokens.verify(token)
+    except InvalidToken:
+        return None
+
+    profile = profile_cache.get(user_id)
+    if profile is None:
+        profile = await user_collection.find_one({"_id": user_id}, USER_PROFILE_PROJECTION)
+        if profile is None:
+            return None
+        profile_cache.set(user_id, profile)
+    return profile
+
+
+async def require_session_profile(request: Request) -> dict:
+    """Like get_session_profile, but raises a 401 when there is no valid session."""
+    profile = await get_session_profile(request)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not logged in.")
+    return profile
+
+
+# --- Chat History Helpers ---
+# The only user fields the chat handlers need. Neither changes after registration,
+# so they are cached by email and most chat turns skip the user lookup entirely.
+USER_FIELDS_PROJECTION = {"_id": 1, "user_dedicated_folder": 1}
+user_fields_cache: TTLCache[dict] = TTLCache(settings.USER_CACHE_MAX_ENTRIES, settings.USER_CACHE_TTL_SECONDS)
+
+
+async def get_user_or_404(email: str) -> dict:
+    """
+    Looks up the fields the chat handlers need for a user, without pulling
+    the rest of the user document. Raises a 404 if the user does not exist.
+    """
+    user = user_fields_cache.get(email)
+    if user is None:
+        user = await user_collection.find_one({"email": email}, USER_FIELDS_PROJECTION)
+        if not user:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
+        user_fields_cache.set(email, user)
+    return user
+
+
+async def save_upload_or_413(user: dict, upload: UploadFile, base_dir: str) -> SavedUpload:
+    """Streams an upload into the user's folder, turning an oversized upload into a 413."""
+    try:
+        return await upload_store.save(
+            user["_id"], upload, base_dir, user.get("user_dedicated_folder", "default_user")
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+
+async def save_image_or_413(image: UploadFile) -> SavedBlob:
+    """Stores an uploaded image in the blob store, turning an oversized upload into a 413."""
+    try:
+        return await blob_store.save(image)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def admit_chat_turn(user: dict, model: Optional[str]) -> AdmissionSlot:
+    """
+    Applies the user's and the model's rate limits and takes one of the
+    in-flight chat turn slots. Raises RateLimited (429) or Overloaded (503).
+    """
+    if rate_limiter is None:
+        return AdmissionSlot()
+    await rate_limiter.check(user["_id"], model)
+    return await admission.acquire()
+
+
+def conversation_not_found(conversation_id: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=f"Conversation with ID '{conversation_id}' was not found in the user's history."
+    )
+
+
+async def require_conversation(user: dict, conversation_id: Optional[str]) -> None:
+    """Raises a 404 for a conversation that isn't the user's, before any work is done for the turn."""
+    if conversation_id and not await chat_store.owns_conversation(user["_id"], conversation_id):
+        raise conversation_not_found(conversation_id)
+
+
+async def build_history(user: dict, conversation_id: Optional[str]) -> list:
+    """The history sent to the model with the turn; a 404 if the conversation isn't the user's."""
+    try:
+        return await context_builder.build(user["_id"], conversation_id)
+    except ConversationNotFound:
+        raise conversation_not_found(conversation_id)
+
+
+async def save_chat_turn(user: dict, conversation_id: Optional[str], user_message: Message,
+                         ai_message: Message, title: str, rag_mode: int = 0) -> dict:
+    """
+    Saves a user message and the AI's reply, creating the conversation if
+    `conversation_id` is empty, and returns the response every chat endpoint
+    sends back. Raises a 404 if the conversation is not the user's.
+    """
+    try:
+        new_conversation = await chat_store.save_turn(
+            user["_id"], conversation_id, [user_message, ai_message], title, rag_mode
+        )
+    except ConversationNotFound:
+        raise conversation_not_found(conversation_id)
+    except BufferFull as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+    return {
+        "ai_response": ai_message.content,
+        # The frontend adds a returned conversation to the history list.
+        "new_conversation": new_conversation.model_dump(mode="json") if new_conversation else None,
+    }
 
 
 # --- Middleware ---
+# Added first so it runs inside CORS and the 413 still carries the CORS headers.
+app.add_middleware(RequestSizeLimit, limits={
+    path: settings.UPLOAD_MAX_BYTES + settings.UPLOAD_FORM_OVERHEAD_BYTES
+    for path in ("/api/chat/invoke_with_image", "/api/chat/invoke_with_text_file")
+})
 origins = ["http://localhost:3090"]
 app.add_middleware(
     CORSMiddleware,
@@ -63,22 +437,33 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if settings.METRICS_ENABLED:
+    # Added last so it is the outermost middleware and times everything else too.
+    app.add_middleware(
+        MetricsMiddleware,
+        slow_request_ms=settings.SLOW_REQUEST_MS,
+        trace_sample_rate=settings.SLOW_REQUEST_TRACE_SAMPLE_RATE,
+    )
 
 
 # --- API Routes ---
 # All routes below will now work correctly because `user_collection` is a
 # valid AsyncIOMotorCollection object, initialized during startup.
 
+def email_taken() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A user with this email already exists.")
+
+
 @app.post("/api/auth/register")
 async def register(register_data: RegisterRequest):
     """
     Handles user registration.
     """
-    existing_user = await user_collection.find_one({"email": register_data.email})
+    existing_user = await user_collection.find_one({"email": register_data.email}, {"_id": 1})
     if existing_user:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A user with this email already exists.")
+        raise email_taken()
     
-    hashed_password = get_password_hash(register_data.password)
+    hashed_password = await get_password_hash(register_data.password)
     user_id = str(uuid.uuid4())
     
     folder_name_for_user = generate_formatted_name(register_data.name)
@@ -90,11 +475,14 @@ async def register(register_data: RegisterRequest):
         "role": "USER",
         "user_dedicated_folder": folder_name_for_user,
         "audio_files_name": [],
-        "chat_history": [],
         "file_name": [],
     }
     
-    await user_collection.insert_one(new_user)
+    try:
+        await user_collection.insert_one(new_user)
+    except DuplicateKeyError:
+        # Another registration for the same email got in while the password was hashed.
+        raise email_taken()
     return {"message": "User registered successfully"}
 
 
@@ -102,11 +490,11 @@ async def register(register_data: RegisterRequest):
 async def login(login_data: LoginRequest, response: Response):
     user = await user_collection.find_one({"email": login_data.email})
     
-    if not user or not verify_password(login_data.password, user["password"]):
+    if not user or not await verify_password(login_data.password, user["password"]):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
-    # NOTE: It's better practice to use a real JWT library for tokens.
-    response.set_cookie(key="token", value=f"fake-jwt-for-{user['_id']}", httponly=True)
+    set_session_cookie(response, user["_id"])
+    profile_cache.set(user["_id"], {"_id": user["_id"], "name": user["name"], "email": user["email"]})
     return {"user": User(**user)}
 
 @app.post("/api/auth/logout")
@@ -115,16 +503,14 @@ async def logout(response: Response):
     return {"message": "Logged out successfully"}
 
 @app.post("/api/auth/refresh")
-async def refresh_token(request: Request):
-    token = request.cookies.get("token")
-    if not token:
+async def refresh_token(request: Request, response: Response):
+    if not request.cookies.get("token"):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Session expired.")
-    
-    # SECURITY NOTE: This logic is insecure. You should parse the token to get the user ID
-    # and then query the database for that specific user.
-    # e.g., user_id = parse_token(token) -> user = await user_collection.find_one({"_id": user_id})
-    user = await user_collection.find_one() # This just gets an arbitrary user from the DB.
+
+    user = await get_session_profile(request)
     if user:
+        # Extend the session with a freshly signed token.
+        set_session_cookie(response, user["_id"])
         return {"user": User(**user)}
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid session.")
 
@@ -134,75 +520,224 @@ async def get_user(request: Request):
     """
     Checks for a session cookie and returns the user if found.
     """
-    token = request.cookies.get("token")
-    if not token:
-        return None # No cookie, so no user logged in.
-    
-    # Same security note as /api/auth/refresh applies here.
-    user = await user_collection.find_one()
+    user = await get_session_profile(request)
     if user:
         return User(**user)
-    
-    return None
+
+    return None # No valid session, so no user logged in.
+
+
+@app.get("/api/conversations", response_model=ConversationPage)
+async def list_conversations(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    Returns one page of the logged-in user's conversations (id, title and rag_mode only),
+    most recently updated first. Pass `next_cursor` back as `cursor` for the next page.
+    """
+    user = await require_session_profile(request)
+    try:
+        return model_response(await chat_store.list_conversations(user["_id"], cursor, limit))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@app.get("/api/search", response_model=SearchPage)
+async def search_conversations(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    offset: int = Query(0, ge=0, le=1000),
+    limit: int = Query(20, ge=1, le=50),
+):
+    """
+    Searches the logged-in user's messages and conversation titles, best match
+    first. Pass `next_offset` back as `offset` for the next page.
+    """
+    user = await require_session_profile(request)
+    return model_response(await chat_store.search(user["_id"], q, offset, limit))
+
+
+@app.get("/api/conversations/{conversation_id}/messages", response_model=MessagePage)
+async def list_conversation_messages(
+    request: Request,
+    conversation_id: str,
+    before: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+):
+    """
+    Returns the newest messages of one of the logged-in user's conversations,
+    oldest first. Pass `next_before` back as `before` to load older messages.
+    """
+    user = await require_session_profile(request)
+    return model_response(await chat_store.list_messages(user["_id"], conversation_id, before, limit))
+
+
+@app.get("/api/conversations/export")
+async def export_conversations(request: Request):
+    """
+    Streams all of the logged-in user's conversations and messages as NDJSON
+    (see ChatStore.export_ndjson), without building the export in memory.
+    """
+    user = await require_session_profile(request)
+    return StreamingResponse(
+        chat_store.export_ndjson(user["_id"]),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="conversations.ndjson"'},
+    )
+
+
+@app.post("/api/conversations/import", response_model=ImportSummary)
+async def import_conversations(request: Request, file: UploadFile = File(...)):
+    """
+    Adds the conversations of an NDJSON export to the logged-in user's history,
+    reading the file line by line and writing it in batches. Returns how many
+    conversations and messages were imported and which lines were skipped.
+    """
+    user = await require_session_profile(request)
+    try:
+        return await chat_store.import_ndjson(
+            user["_id"], iter_lines(file, settings.IMPORT_MAX_LINE_BYTES), settings.IMPORT_BATCH_SIZE
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics():
+    """Request, phase and MongoDB timings in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/metrics/password_hashing")
+async def password_hashing_metrics():
+    """Reports the bcrypt pool's queue depth, in-flight calls and rejections."""
+    return password_hasher.stats()
+
+
+@app.get("/api/metrics/response_cache")
+async def response_cache_metrics():
+    """Reports response cache hits, misses and size (null when the cache is off)."""
+    return await response_cache.cache.stats() if response_cache.cache is not None else None
+
+
+@app.get("/api/metrics/admission")
+async def admission_metrics():
+    """Reports in-flight and shed chat turns and rate-limited requests (null when limits are off)."""
+    if rate_limiter is None:
+        return None
+    return {"admission": admission.stats(), "rate_limits": rate_limiter.stats()}
+
+
+@app.get("/api/metrics/chat_write_buffer")
+async def chat_write_buffer_metrics():
+    """Reports how much the chat write buffer holds and has flushed (null when it is off)."""
+    return chat_store.write_buffer.stats() if chat_store.write_buffer is not None else None
+
+
+@app.get("/api/metrics/ingestion")
+async def ingestion_metrics():
+    """Reports the ingestion queue's workers and its queued, running and failed jobs."""
+    return ingestion_queue.stats()
 
 
 @app.get("/api/config")
-async def get_config():
-    """Provides the frontend with app configuration, including available models."""
-    return {
-        "appTitle": "LibreChat",
-        "endpoints": {
-            "openAI": { "apiKey": "user_provided", "models": ["gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"], "titleConvo": True, "titleModel": "gpt-3.5-turbo" },
-            "google": { "apiKey": "user_provided", "models": ["gemini-1.5-flash-latest", "gemini-1.5-pro-latest", "gemini-pro"], "titleConvo": True, "titleModel": "gemini-pro" },
-            "anthropic": { "apiKey": "user_provided", "models": ["claude-3-opus-20240229", "claude-3-sonnet-20240229", "claude-3-haiku-20240307"], "titleConvo": True, "titleModel": "claude-3-haiku-20240307" },
-            "groq": { "apiKey": "user_provided", "models": ["compound", "llama3-70b-8192", "mixtral-8x7b-32768"], "titleConvo": True, "titleModel": "llama3-8b-8192" }
-        },
-        "registration": { "allowRegistration": True },
-        "user": None,
-        "serverVersion": "0.0.6-py-mongo",
+async def get_config(request: Request):
+    """
+    Provides the frontend with app configuration, including available models,
+    from config_files/model_settings.json. Clients that send back the ETag
+    get a 304 while the file is unchanged.
+    """
+    config = app_config.current()
+    headers = {
+        "ETag": config.etag,
+        "Cache-Control": f"public, max-age={settings.CONFIG_MAX_AGE_SECONDS}, must-revalidate",
     }
+    if config.matches(request.headers.get("if-none-match")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=config.body, media_type="application/json", headers=headers)
 
 
 
 
 @app.post("/api/chat/invoke")
 async def handle_chat(chat_request: ChatRequest):
-    # ... (find user logic)
-
-    user_query_message = Message(role="user", content=chat_request.human_text)
-    ai_response_message = Message(role="ai", content=f"This is a hardcoded AI response to your message: {chat_request.human_text}")
-
-    if not chat_request.conversation_id:
-        # This is a NEW conversation
-        new_conversation = Conversation(
+    user = await get_user_or_404(chat_request.user_email)
+    with await admit_chat_turn(user, chat_request.user_model):
+        user_query_message = Message(role="user", content=chat_request.human_text)
+        history = await build_history(user, chat_request.conversation_id)
+        ai_response_message = Message(role="ai", content=await generate_response(chat_request, history))
+
+        return await save_chat_turn(
+            user, chat_request.conversation_id, user_query_message, ai_response_message,
             title=chat_request.human_text,
-            messages=[user_query_message, ai_response_message]
-        )
-        
-        await user_collection.update_one(
-            {"email": chat_request.user_email},
-            {"$push": {"chat_history": new_conversation.model_dump()}}
-        )
-        
-        # **CHANGE HERE: Return the full new conversation object**
-        response_data = {
-            "ai_response": ai_response_message.content,
-            "new_conversation": new_conversation.model_dump()
-        }
-    else:
-        # This is an EXISTING conversation
-        await user_collection.update_one(
-            {"email": chat_request.user_email, "chat_history.id": chat_request.conversation_id},
-            {"$push": {"chat_history.$.messages": {"$each": [user_query_message.model_dump(), ai_response_message.model_dump()]}}}
         )
 
-        # **CHANGE HERE: Indicate that no new conversation was created**
-        response_data = {
-            "ai_response": ai_response_message.content,
-            "new_conversation": None
-        }
-    
-    return response_data
+
+def sse_event(event: str, data: dict) -> str:
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+@app.post("/api/chat/invoke_stream")
+async def handle_chat_stream(chat_request: ChatRequest):
+    """
+    Streaming variant of /api/chat/invoke. The AI response is sent as
+    Server-Sent Events while it is being generated: one "token" event per
+    piece of text, then a "done" event carrying the same payload
+    /api/chat/invoke returns (or an "error" event).
+
+    The turn is saved once, after generation finishes. If the client
+    disconnects before that, generation is cancelled and nothing is saved.
+    """
+    user = await get_user_or_404(chat_request.user_email)
+    slot = await admit_chat_turn(user, chat_request.user_model)
+    try:
+        history = await build_history(user, chat_request.conversation_id)
+    except BaseException:
+        slot.release()
+        raise
+    generator = get_generator()
+
+    async def event_stream():
+        with slot:
+            tokens = []
+            try:
+                async for token in generator(chat_request, history):
+                    tokens.append(token)
+                    yield sse_event("token", {"text": token})
+            except ProviderError as e:
+                yield sse_event("error", {"detail": str(e)})
+                return
+
+            user_query_message = Message(role="user", content=chat_request.human_text)
+            ai_response_message = Message(role="ai", content="".join(tokens))
+
+            # The response is complete, so finish saving it even if the client goes away now.
+            with anyio.CancelScope(shield=True):
+                try:
+                    response_data = await save_chat_turn(
+                        user, chat_request.conversation_id, user_query_message, ai_response_message,
+                        title=chat_request.human_text,
+                    )
+                except HTTPException as e:
+                    response_data = None
+                    error_detail = e.detail
+
+            if response_data is None:
+                yield sse_event("error", {"detail": error_detail})
+                return
+            yield sse_event("done", response_data)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also frees the slot if the client left before the stream started.
+        background=BackgroundTask(slot.release),
+    )
 
 
 @app.post("/api/chat/invoke_with_image")
@@ -219,59 +754,91 @@ async def handle_chat_with_image(
     Handles a chat message with an image, saves the image,
     and updates the conversation history in MongoDB.
     """
-    user = await user_collection.find_one({"email": user_email})
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
-
-    # --- Save the image file (your existing logic) ---
-    user_folder_name = user.get("user_dedicated_folder", "default_user")
-    base_image_dir = "images"
-    user_specific_dir = os.path.join(base_image_dir, user_folder_name)
-    os.makedirs(user_specific_dir, exist_ok=True)
-    file_path = os.path.join(user_specific_dir, image_file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(image_file.file, buffer)
-
-    # --- Create the message objects ---
-    # The user's message now includes the image path
-    user_query_message = Message(
-        role="user",
-        content=user_message,
-        image_path=file_path
-    )
-    # The AI's response
-    ai_response_message = Message(
-        role="ai",
-        content=f"I have received your image '{image_file.filename}'. What would you like to know about it?"
-    )
-
-    # --- Update the database (same logic as your text endpoint) ---
-    if not conversation_id:
-        # Create a new conversation
-        new_conversation = Conversation(
-            title=user_message or "Image Query",
-            messages=[user_query_message, ai_response_message]
+    user = await get_user_or_404(user_email)
+    await require_conversation(user, conversation_id)
+    with await admit_chat_turn(user, model_name):
+        # --- Save the image file (streamed to disk, stored once per content) ---
+        saved_image = await save_image_or_413(image_file)
+
+        # --- Create the message objects ---
+        # The user's message refers to the image by its content hash
+        user_query_message = Message(
+            role="user",
+            content=user_message,
+            image_id=saved_image.sha256
         )
-        await user_collection.update_one(
-            {"email": user_email},
-            {"$push": {"chat_history": new_conversation.model_dump()}}
+        # The AI's response
+        ai_response_message = Message(
+            role="ai",
+            content=f"I have received your image '{saved_image.filename}'. What would you like to know about it?"
         )
-        # Return the new conversation object so the frontend can update
-        return {
-            "ai_response": ai_response_message.content,
-            "new_conversation": new_conversation.model_dump()
-        }
-    else:
-        # Append to an existing conversation
-        await user_collection.update_one(
-            {"email": user_email, "chat_history.id": conversation_id},
-            {"$push": {"chat_history.$.messages": {"$each": [user_query_message.model_dump(), ai_response_message.model_dump()]}}}
+
+        # --- Update the database (same logic as your text endpoint) ---
+        try:
+            response = await save_chat_turn(
+                user, conversation_id, user_query_message, ai_response_message,
+                title=user_message or "Image Query",
+            )
+        except Exception:
+            # No message refers to the image after all.
+            await blob_store.release({saved_image.sha256: 1})
+            raise
+        return {**response, "image_id": saved_image.sha256}
+
+
+# --- Uploaded Files ---
+BLOB_ID = Path(..., pattern="^[0-9a-f]{64}$")
+# Blobs never change, so browsers may keep them for good.
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+blob_content_types: TTLCache[str] = TTLCache(10_000, 3600)
+
+
+async def serve_blob(request: Request, path: str, etag: str, content_type: str, cache_control: str) -> Response:
+    """
+    Sends a file with its ETag, answering a matching If-None-Match with a 304.
+    FileResponse handles Range requests and uses the server's sendfile
+    support (the ASGI pathsend extension) when it has one.
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control, "X-Content-Type-Options": "nosniff"}
+    if etag_matches(etag, request.headers.get("if-none-match")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found.")
+    return FileResponse(path, stat_result=stat_result, media_type=content_type, headers=headers)
+
+
+async def get_blob_content_type(request: Request, sha256: str) -> str:
+    """Checks the session and returns the blob's content type, or raises a 401/404."""
+    await require_session_profile(request)
+    content_type = blob_content_types.get(sha256)
+    if content_type is None:
+        content_type = await blob_store.content_type(sha256)
+        if content_type is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found.")
+        blob_content_types.set(sha256, content_type)
+    return content_type
+
+
+@app.get("/api/files/{sha256}")
+async def get_file(request: Request, sha256: str = BLOB_ID):
+    """Serves an uploaded image by its content hash."""
+    content_type = await get_blob_content_type(request, sha256)
+    return await serve_blob(request, blob_store.path(sha256), f'"{sha256}"', content_type, IMMUTABLE_CACHE_CONTROL)
+
+
+@app.get("/api/files/{sha256}/thumbnail")
+async def get_file_thumbnail(request: Request, sha256: str = BLOB_ID):
+    """Serves an uploaded image's thumbnail, or the image itself while there is none."""
+    content_type = await get_blob_content_type(request, sha256)
+    thumbnail_path = blob_store.thumbnail_path(sha256)
+    if await asyncio.to_thread(os.path.exists, thumbnail_path):
+        return await serve_blob(
+            request, thumbnail_path, f'"{sha256}-thumbnail"', THUMBNAIL_CONTENT_TYPE, IMMUTABLE_CACHE_CONTROL
         )
-        # Return null for new_conversation as it's an existing chat
-        return {
-            "ai_response": ai_response_message.content,
-            "new_conversation": None
-        }
+    # Not cached for long, so the thumbnail replaces it once it is ready.
+    return await serve_blob(request, blob_store.path(sha256), f'"{sha256}"', content_type, "private, no-cache")
 
 
 
@@ -289,88 +856,82 @@ async def handle_chat_with_text_file(
     Handles a chat message with a text file, saves the file,
     and updates the conversation history in MongoDB.
     """
-    user = await user_collection.find_one({"email": user_email})
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
-
-    # --- Save the text file (your existing logic) ---
-    user_folder_name = user.get("user_dedicated_folder", "default_user")
-    base_text_dir = "text_files"
-    user_specific_dir = os.path.join(base_text_dir, user_folder_name)
-    os.makedirs(user_specific_dir, exist_ok=True)
-    file_path = os.path.join(user_specific_dir, text_file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(text_file.file, buffer)
-
-    # --- Create the message objects ---
-    user_query_message = Message(
-        role="user",
-        content=user_message,
-        file_name=text_file.filename # Save the filename in the message
-    )
-    ai_response_message = Message(
-        role="ai",
-        content=f"I have received your file '{text_file.filename}'. How can I help you with it?"
-    )
+    user = await get_user_or_404(user_email)
+    await require_conversation(user, conversation_id)
+    with await admit_chat_turn(user, model_name):
+        # --- Save the text file (streamed to disk, deduplicated per user) ---
+        saved_file = await save_upload_or_413(user, text_file, "text_files")
+        # Parsing and embedding happen in the background; this request doesn't wait for them.
+        ingestion_job = await ingestion_queue.submit(
+            user.get("user_dedicated_folder", "default_user"), saved_file.filename
+        )
 
-    # --- Update the database (same logic as your other endpoints) ---
-    if not conversation_id:
-        # Create a new conversation
-        new_conversation = Conversation(
-            title=user_message or f"Query on {text_file.filename}",
-            messages=[user_query_message, ai_response_message]
+        # --- Create the message objects ---
+        user_query_message = Message(
+            role="user",
+            content=user_message,
+            file_name=saved_file.filename # Save the filename in the message
         )
-        await user_collection.update_one(
-            {"email": user_email},
-            {"$push": {"chat_history": new_conversation.model_dump()}}
+        ai_response_message = Message(
+            role="ai",
+            content=f"I have received your file '{saved_file.filename}'. How can I help you with it?"
         )
-        # Return the new conversation object to fix the frontend bug
-        return {
-            "ai_response": ai_response_message.content,
-            "new_conversation": new_conversation.model_dump()
-        }
-    else:
-        # Append to an existing conversation
-        await user_collection.update_one(
-            {"email": user_email, "chat_history.id": conversation_id},
-            {"$push": {"chat_history.$.messages": {"$each": [user_query_message.model_dump(), ai_response_message.model_dump()]}}}
+
+        # --- Update the database (same logic as your other endpoints) ---
+        response_data = await save_chat_turn(
+            user, conversation_id, user_query_message, ai_response_message,
+            title=user_message or f"Query on {saved_file.filename}",
         )
-        # Return null because it's not a new conversation
-        return {
-            "ai_response": ai_response_message.content,
-            "new_conversation": None
-        }
+        response_data["ingestion_job_id"] = ingestion_job.id
+        return response_data
+
+
+@app.get("/api/ingestion/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """Reports the status of a background document ingestion job."""
+    job = await ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Ingestion job '{job_id}' not found.")
+    return dataclasses.asdict(job)
 
 
 @app.delete("/api/chats/{conversation_id}")
 async def delete_chat_history(conversation_id: str, request_body: DeleteChatRequest = Body(...)):
     """
-    Finds a user by email and removes a specific conversation
-    from their chat_history array using the conversation's ID.
+    Finds a user by email and removes a specific conversation,
+    together with all of its messages, from the chat store.
     """
-    # 1. First, find the user document to ensure it exists.
-    user = await user_collection.find_one({"email": request_body.user_email})
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"User with email '{request_body.user_email}' not found."
-        )
+    # 1. First, find the user to ensure it exists (usually answered from the cache).
+    user = await get_user_or_404(request_body.user_email)
 
-    # 2. If the user exists, perform the update using $pull.
-    update_result = await user_collection.update_one(
-        {"email": request_body.user_email},
-        {"$pull": {"chat_history": {"id": conversation_id}}}
-    )
+    # 2. Delete the conversation; this only matches conversations owned by the user.
+    deleted = await chat_store.delete_conversation(user["_id"], conversation_id)
+    if not deleted:
+        raise conversation_not_found(conversation_id)
+    cache_bus.publish("conversation_deleted", f"{user['_id']}/{conversation_id}")
+
+    return {"status": "success", "message": "Conversation deleted successfully."}
 
-    # 3. Check if the document was successfully modified.
-    # If matched_count is 1 but modified_count is 0, it means the conversation ID was not found.
-    if update_result.modified_count == 0:
+
+@app.post("/api/chats/bulk_delete")
+async def bulk_delete_chat_history(request: Request, request_body: BulkDeleteRequest):
+    """
+    Deletes many of the logged-in user's conversations, and their messages, at once.
+    Ids that aren't in the user's history are skipped; the response says
+    how many conversations were deleted.
+    """
+    user = await require_session_profile(request)
+    if len(request_body.conversation_ids) > settings.BULK_DELETE_MAX_IDS:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Conversation with ID '{conversation_id}' was not found in the user's history."
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.BULK_DELETE_MAX_IDS} conversations can be deleted at once.",
         )
+    conversation_ids = list(dict.fromkeys(request_body.conversation_ids))
+    deleted = await chat_store.delete_conversations(user["_id"], conversation_ids)
+    for conversation_id in conversation_ids:
+        cache_bus.publish("conversation_deleted", f"{user['_id']}/{conversation_id}")
 
-    return {"status": "success", "message": "Conversation deleted successfully."}
+    return {"status": "success", "deleted": deleted}
 
 @app.post("/api/chat/invoke_rag")
 async def handle_chat_with_rag(chat_request: ChatRequest):
@@ -378,49 +939,54 @@ async def handle_chat_with_rag(chat_request: ChatRequest):
     Handles a RAG query, saves it to the database with rag_mode=1,
     and returns the response.
     """
-    user = await user_collection.find_one({"email": chat_request.user_email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    # In a real RAG implementation, you would use the query to find documents
-    # and pass them as context to your LLM here.
-    
-    user_query_message = Message(role="user", content=chat_request.human_text)
-    ai_response_message = Message(
-        role="ai", 
-        content=f"[Answer from Documents]: This is a RAG response to your message: '{chat_request.human_text}'"
-    )
+    user = await get_user_or_404(chat_request.user_email)
+    await require_conversation(user, chat_request.conversation_id)
+    with await admit_chat_turn(user, chat_request.user_model):
+        # Find the passages of the user's uploaded documents closest to the question
+        # and hand them to the model as context.
+        user_folder = user.get("user_dedicated_folder", "default_user")
+        # Documents that are not indexed yet (e.g. added outside the upload endpoint) are
+        # picked up in the background; this answer uses what is already indexed.
+        if await asyncio.to_thread(rag_engine.is_stale, user_folder):
+            await ingestion_queue.submit(user_folder)
+        # Cached answers are only reused while the user's documents stay the same.
+        cache_scope = f"rag:{rag_engine.index_version(user_folder)}"
+        cache = response_cache.cache
+        answer = await cache.get(chat_request.user_model, chat_request.human_text, cache_scope) if cache else None
+        if answer is None:
+            hits = await rag_engine.search(user_folder, chat_request.human_text)
+            if hits:
+                rag_request = chat_request.model_copy(update={"human_text": build_rag_prompt(chat_request.human_text, hits)})
+                answer = await generate_response(rag_request, use_cache=False)
+                if cache:
+                    await cache.set(chat_request.user_model, chat_request.human_text, answer, cache_scope)
+            else:
+                answer = "I could not find anything related to this in your uploaded documents."
+
+        user_query_message = Message(role="user", content=chat_request.human_text)
+        ai_response_message = Message(
+            role="ai", 
+            content=f"[Answer from Documents]: {answer}"
+        )
 
-    # --- Database Logic (this is the crucial part) ---
-    if not chat_request.conversation_id:
-        # Create a new conversation with rag_mode set to 1
-        new_conversation = Conversation(
+        # --- Database Logic (this is the crucial part) ---
+        return await save_chat_turn(
+            user, chat_request.conversation_id, user_query_message, ai_response_message,
             title=chat_request.human_text,
             rag_mode=1, # Mark this as a RAG conversation
-            messages=[user_query_message, ai_response_message]
-        )
-        await user_collection.update_one(
-            {"email": chat_request.user_email},
-            {"$push": {"chat_history": new_conversation.model_dump()}}
-        )
-        # MUST return the new_conversation object to fix the frontend bug
-        return {
-            "ai_response": ai_response_message.content,
-            "new_conversation": new_conversation.model_dump()
-        }
-    else:
-        # Append to an existing conversation
-        await user_collection.update_one(
-            {"email": chat_request.user_email, "chat_history.id": chat_request.conversation_id},
-            {"$push": {"chat_history.$.messages": {"$each": [user_query_message.model_dump(), ai_response_message.model_dump()]}}}
         )
-        # Return null because it's not a new conversation
-        return {
-            "ai_response": ai_response_message.content,
-            "new_conversation": None
-        }
 
 
 # --- Main entry point for running the app ---
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if settings.WEB_WORKERS > 1:
+        # Workers import this module on their own, so pass them one session key
+        # (otherwise each would pick a random one and reject the others' cookies).
+        os.environ.setdefault("SESSION_SECRET", settings.SESSION_SECRET or secrets.token_urlsafe(32))
+    uvicorn.run(
+        "main:app",
+        host=settings.WEB_HOST,
+        port=settings.WEB_PORT,
+        workers=settings.WEB_WORKERS,
+        timeout_graceful_shutdown=settings.SHUTDOWN_GRACE_SECONDS,
+    )
\ No newline at end of file
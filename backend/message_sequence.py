@@ -0,0 +1,30 @@
+"""
+Message sequence numbers.
+
+Every message document has a `seq` that orders it within its conversation
+(and is the `before` cursor for paging). Each conversation keeps a counter,
+`last_seq`, and writers take numbers from it with one atomic update, so
+several requests or worker processes can append to the same conversation
+without two messages ever getting the same number.
+"""
+import datetime
+import time
+from typing import List, Optional
+
+
+def reserve_sequence(count: int, updated_at: Optional[datetime.datetime] = None,
+                     count_messages: bool = True) -> List[dict]:
+    """
+    Update pipeline that takes the conversation's next `count` sequence
+    numbers; afterwards its `last_seq` is the highest of them. It also adds
+    the messages to `message_count` and moves `updated_at` on, unless told not to.
+    """
+    # Conversations from before the counter used microsecond timestamps as seq;
+    # starting their counter at the current time keeps new messages after those.
+    legacy_start = time.time_ns() // 1000
+    fields = {"last_seq": {"$add": [{"$ifNull": ["$last_seq", legacy_start]}, count]}}
+    if count_messages:
+        fields["message_count"] = {"$add": [{"$ifNull": ["$message_count", 0]}, count]}
+    if updated_at is not None:
+        fields["updated_at"] = {"$max": ["$updated_at", updated_at]}
+    return [{"$set": fields}]
@@ -0,0 +1,89 @@
+"""
+One-shot migration that moves the embedded `chat_history` arrays out of the
+user documents and into the `conversations` and `messages` collections.
+
+Run it from the backend folder:
+
+    python migrate_chat_history.py --mongo-url mongodb://localhost:27017
+
+The script is safe to re-run: conversations are upserted by id, their
+messages are replaced, and `chat_history` is only removed from a user
+document once all of its conversations have been copied.
+"""
+import argparse
+import asyncio
+import datetime
+
+from db_connections import get_user_collection
+from chat_store import ChatStore, utc_now
+from models import Conversation
+
+
+async def migrate_user(user_collection, chat_store: ChatStore, user: dict, dry_run: bool) -> int:
+    """Copies one user's chat_history into the chat store. Returns the number of conversations."""
+    base_time = utc_now()
+    conversations = [Conversation(**conversation) for conversation in user.get("chat_history", [])]
+
+    for index, conversation in enumerate(conversations):
+        if dry_run:
+            continue
+        # Keep the original array order: older conversations get earlier timestamps.
+        timestamp = base_time + datetime.timedelta(milliseconds=index)
+        await chat_store.conversations.replace_one(
+            {"_id": conversation.id},
+            {
+                "user_id": user["_id"],
+                "title": conversation.title,
+                "rag_mode": conversation.rag_mode,
+                "message_count": len(conversation.messages),
+                "last_seq": len(conversation.messages),
+                "created_at": timestamp,
+                "updated_at": timestamp,
+            },
+            upsert=True,
+        )
+        await chat_store.messages.delete_many({"conversation_id": conversation.id})
+        if conversation.messages:
+            await chat_store.messages.insert_many([
+                {
+                    **message.model_dump(),
+                    "user_id": user["_id"],
+                    "conversation_id": conversation.id,
+                    "seq": seq,
+                    "created_at": timestamp,
+                }
+                for seq, message in enumerate(conversation.messages, start=1)
+            ])
+
+    if not dry_run:
+        await user_collection.update_one(
+            {"_id": user["_id"]}, {"$unset": {"chat_history": ""}}
+        )
+    return len(conversations)
+
+
+async def main(mongo_url: str, dry_run: bool) -> None:
+    user_collection = await get_user_collection(mongo_url)
+    if user_collection is None:
+        raise SystemExit("Could not connect to the database.")
+
+    chat_store = ChatStore(user_collection.database)
+    await chat_store.ensure_indexes()
+
+    migrated_users = 0
+    migrated_conversations = 0
+    async for user in user_collection.find({"chat_history": {"$exists": True}}):
+        count = await migrate_user(user_collection, chat_store, user, dry_run)
+        migrated_users += 1
+        migrated_conversations += count
+        print(f"{'[dry run] ' if dry_run else ''}{user.get('email')}: {count} conversation(s)")
+
+    print(f"Done. Users: {migrated_users}, conversations: {migrated_conversations}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move embedded chat_history arrays into the chat store.")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be migrated.")
+    args = parser.parse_args()
+    asyncio.run(main(args.mongo_url, args.dry_run))
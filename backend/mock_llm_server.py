@@ -0,0 +1,74 @@
+"""
+A local stand-in for the OpenAI, Anthropic and Google APIs, so the provider
+layer can be exercised fully offline. Every provider in provider_settings.json
+is served under its own prefix and answers with a streamed echo of the last
+user message.
+
+    python mock_llm_server.py --port 8001
+    LLM_PROVIDER_BASE_URL=http://127.0.0.1:8001 CHAT_GENERATOR=providers python main.py
+"""
+import argparse
+import asyncio
+import json
+import os
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI()
+
+# Pause between streamed words, to behave like a real model.
+TOKEN_DELAY = int(os.getenv("MOCK_TOKEN_DELAY_MS", "20")) / 1000
+
+
+def mock_reply(provider: str, model: str, last_message: str) -> list:
+    return f"[{provider}/{model}] You said: {last_message}".split(" ")
+
+
+async def sse(events, trailer: str = ""):
+    for event in events:
+        if TOKEN_DELAY:
+            await asyncio.sleep(TOKEN_DELAY)
+        yield f"data: {json.dumps(event)}\n\n"
+    if trailer:
+        yield f"data: {trailer}\n\n"
+
+
+def sse_response(events, trailer: str = "") -> StreamingResponse:
+    return StreamingResponse(sse(events, trailer), media_type="text/event-stream")
+
+
+@app.post("/{provider}/chat/completions")
+async def openai_chat_completions(provider: str, request: Request):
+    body = await request.json()
+    words = mock_reply(provider, body["model"], body["messages"][-1]["content"])
+    events = [{"choices": [{"delta": {"content": w if i == 0 else f" {w}"}}]} for i, w in enumerate(words)]
+    return sse_response(events, trailer="[DONE]")
+
+
+@app.post("/{provider}/messages")
+async def anthropic_messages(provider: str, request: Request):
+    body = await request.json()
+    words = mock_reply(provider, body["model"], body["messages"][-1]["content"])
+    events = [{"type": "message_start"}]
+    events += [{"type": "content_block_delta", "delta": {"type": "text_delta", "text": w if i == 0 else f" {w}"}} for i, w in enumerate(words)]
+    events += [{"type": "message_stop"}]
+    return sse_response(events)
+
+
+@app.post("/{provider}/models/{model_action}")
+async def google_generate_content(provider: str, model_action: str, request: Request):
+    body = await request.json()
+    model = model_action.split(":", 1)[0]
+    words = mock_reply(provider, model, body["contents"][-1]["parts"][0]["text"])
+    events = [{"candidates": [{"content": {"role": "model", "parts": [{"text": w if i == 0 else f" {w}"}]}}]} for i, w in enumerate(words)]
+    return sse_response(events)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve mock LLM provider APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
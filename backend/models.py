@@ -10,6 +10,8 @@ class Message(BaseModel):
     role: str  # "user" or "ai"
     content: str
     image_path: Optional[str] = None
+    # sha256 of an uploaded image in the blob store, served at /api/files/{image_id}
+    image_id: Optional[str] = None
     # Add a field to store the filename when RAG is used
     file_name: Optional[str] = None
 
@@ -57,7 +59,8 @@ class User(BaseModel):
     id: str = Field(alias="_id")
     name: str
     email: str
-    chat_history: List[Conversation] = [] # Use the new Conversation model
+    # Chat history is no longer part of the user; it is paged in through
+    # /api/conversations and /api/conversations/{id}/messages.
     
     class Config:
         populate_by_name = True
@@ -67,6 +70,80 @@ class DeleteChatRequest(BaseModel):
     user_email: str
 
 
+class ConversationSummary(BaseModel):
+    """A conversation as shown in the history sidebar, without its messages."""
+    id: str
+    title: str
+    rag_mode: int = 0
+
+class ConversationPage(BaseModel):
+    conversations: List[ConversationSummary]
+    # Opaque cursor for the next page, None when there are no more conversations
+    next_cursor: Optional[str] = None
+
+class MessagePage(BaseModel):
+    # Oldest message first, so the page can be rendered as-is
+    messages: List[Message]
+    # Pass this as `before` to load the previous (older) page, None at the start
+    next_before: Optional[int] = None
+
+class SearchHit(BaseModel):
+    conversation_id: str
+    conversation_title: str
+    # The matching message, or None when the conversation's title matched
+    message_seq: Optional[int] = None
+    role: Optional[str] = None
+    # The part of the message (or the title) around the first matching word
+    snippet: str
+    score: float
+
+class SearchPage(BaseModel):
+    # Best match first
+    hits: List[SearchHit]
+    # Pass this as `offset` for the next page, None when there are no more hits
+    next_offset: Optional[int] = None
+
+class BulkDeleteRequest(BaseModel):
+    conversation_ids: List[str] = Field(min_length=1)
+
+class ImportSummary(BaseModel):
+    conversations: int = 0
+    messages: int = 0
+    # Lines that could not be imported, e.g. invalid JSON or a message for an unknown conversation
+    skipped_lines: int = 0
+    # Why the first few of them were skipped, as "line N: reason"
+    errors: List[str] = []
+
+
+# --- App configuration (config_files/model_settings.json, served at /api/config) ---
+# Unknown keys are kept, so the file can grow fields the frontend reads before the backend does.
+
+class EndpointConfig(BaseModel):
+    apiKey: str
+    models: List[str] = Field(min_length=1)
+    titleConvo: bool = False
+    titleModel: Optional[str] = None
+
+    class Config:
+        extra = "allow"
+
+class RegistrationConfig(BaseModel):
+    allowRegistration: bool = True
+
+    class Config:
+        extra = "allow"
+
+class AppConfig(BaseModel):
+    appTitle: str
+    endpoints: Dict[str, EndpointConfig]
+    registration: RegistrationConfig = RegistrationConfig()
+    user: Optional[dict] = None
+    serverVersion: str
+
+    class Config:
+        extra = "allow"
+
+
 # models.py
 
 from pydantic import BaseModel, Field
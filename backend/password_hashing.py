@@ -0,0 +1,72 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from passlib.context import CryptContext
+
+T = TypeVar("T")
+
+
+class HashPoolBusy(Exception):
+    """Raised when too many hash/verify calls are already waiting for a worker."""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification in a dedicated, bounded thread pool.
+
+    A single bcrypt call takes 100-300 ms of CPU. Running it inside an async
+    handler blocks the event loop, and every other request with it. Here the
+    work goes to a few worker threads (bcrypt releases the GIL), and once
+    `max_queue` calls are already waiting, new calls fail fast with
+    HashPoolBusy instead of piling up behind a login storm.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        # Only touched from the event loop thread, so no lock is needed.
+        self._pending = 0
+        self._peak_queue_depth = 0
+        self._completed = 0
+        self._rejected = 0
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(self._context.verify, plain_password, hashed_password)
+
+    async def _run(self, func: Callable[..., T], *args) -> T:
+        if self._pending >= self.max_workers + self.max_queue:
+            self._rejected += 1
+            raise HashPoolBusy("Password hashing pool is saturated.")
+
+        self._pending += 1
+        self._peak_queue_depth = max(self._peak_queue_depth, self.queue_depth)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+            self._completed += 1
+
+    @property
+    def queue_depth(self) -> int:
+        """Calls waiting for a free worker (not counting the ones being hashed right now)."""
+        return max(0, self._pending - self.max_workers)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "queue_limit": self.max_queue,
+            "in_flight": min(self._pending, self.max_workers),
+            "queue_depth": self.queue_depth,
+            "peak_queue_depth": self._peak_queue_depth,
+            "completed": self._completed,
+            "rejected": self._rejected,
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
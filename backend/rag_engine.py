@@ -0,0 +1,270 @@
+"""
+Retrieval for /api/chat/invoke_rag over the documents a user uploaded to
+text_files/<user_dedicated_folder>/.
+
+Every user gets a small on-disk index. Documents are parsed, chunked and
+embedded in batches only when they are new or changed on disk, by jobs on
+the ingestion queue (see ingestion_queue.py); a question then costs one
+query embedding plus a single matrix-vector product over the memory-mapped
+chunk vectors.
+"""
+import asyncio
+import json
+import os
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from embeddings import load_embedder
+
+try:
+    import fcntl
+except ImportError:  # Windows: only one process writes the index there anyway.
+    fcntl = None
+from utils.document_parsing import SUPPORTED_EXTENSIONS, chunk_text, extract_text
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+
+
+@dataclass
+class RagHit:
+    text: str
+    source: str
+    score: float
+
+
+class UserIndex:
+    """
+    One user's index, stored in its own directory:
+
+        manifest.json      indexed files (size/mtime), embedder and current version
+        vectors-<n>.npy    float32 matrix with one unit-length row per chunk
+        chunks-<n>.jsonl   chunk text and source file, row for row
+
+    Vectors are opened memory-mapped, so they are paged in by the OS instead
+    of being read into memory. Every write produces a new version and swaps
+    the manifest atomically; readers keep using the files they opened. The
+    previous version's files are kept until the next write, so a reader in
+    another process that has just read the old manifest can still open them.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.manifest = {"version": 0, "embedder": None, "files": {}}
+        self.vectors: Optional[np.ndarray] = None
+        self.chunks: List[dict] = []
+
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+            version = self.manifest["version"]
+            self.vectors = np.load(self._path("vectors", version, "npy"), mmap_mode="r")
+            with open(self._path("chunks", version, "jsonl"), encoding="utf-8") as f:
+                self.chunks = [json.loads(line) for line in f]
+
+    def _path(self, kind: str, version: int, extension: str) -> str:
+        return os.path.join(self.directory, f"{kind}-{version}.{extension}")
+
+    def search(self, query_vector: np.ndarray, k: int) -> List[RagHit]:
+        """Returns the k chunks most similar to the (unit-length) query vector."""
+        if self.vectors is None or len(self.vectors) == 0:
+            return []
+        # Rows are unit length, so the dot product is the cosine similarity.
+        scores = self.vectors @ query_vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        # Chunks that share no words with the query are not worth sending to the model.
+        return [RagHit(self.chunks[i]["text"], self.chunks[i]["source"], float(scores[i])) for i in top if scores[i] > 0]
+
+    def write(self, files: dict, embedder_name: str, vectors: np.ndarray, chunks: List[dict], append: bool) -> "UserIndex":
+        """
+        Writes a new version of the index, either appending `vectors`/`chunks`
+        to the current ones or replacing them, and returns it loaded.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        old_version = self.manifest["version"]
+        version = old_version + 1
+        keep = append and self.vectors is not None
+
+        old_rows = len(self.vectors) if keep else 0
+        out = np.lib.format.open_memmap(
+            self._path("vectors", version, "npy"), mode="w+", dtype=np.float32,
+            shape=(old_rows + len(vectors), vectors.shape[1]),
+        )
+        if keep:
+            out[:old_rows] = self.vectors
+        out[old_rows:] = vectors
+        out.flush()
+        del out
+
+        with open(self._path("chunks", version, "jsonl"), "w", encoding="utf-8") as f:
+            for chunk in (self.chunks if keep else []) + chunks:
+                f.write(json.dumps(chunk) + "\n")
+
+        manifest = {"version": version, "embedder": embedder_name, "files": files}
+        temp_manifest = os.path.join(self.directory, MANIFEST_FILE + ".tmp")
+        with open(temp_manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(temp_manifest, os.path.join(self.directory, MANIFEST_FILE))
+
+        # The version before the old one is no longer named by any manifest. Its files
+        # may still be mapped by a reader (and can't be removed on Windows); that's fine.
+        for kind, extension in (("vectors", "npy"), ("chunks", "jsonl")):
+            try:
+                os.remove(self._path(kind, old_version - 1, extension))
+            except OSError:
+                pass
+        return UserIndex(self.directory)
+
+
+class RagEngine:
+    """
+    Keeps every user's index in sync with their uploaded documents and searches it.
+
+    Syncing runs in a worker thread, or in `executor` when a process pool is
+    given, so heavy parsing and embedding can't starve the API of CPU.
+    """
+
+    def __init__(self, documents_dir: str, index_dir: str, embedder, top_k: int = 4,
+                 executor: Optional[Executor] = None):
+        self.documents_dir = documents_dir
+        self.index_dir = index_dir
+        self.embedder = embedder
+        self.top_k = top_k
+        self.executor = executor
+        self._indexes: Dict[str, UserIndex] = {}
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def _scan_documents(self, user_folder: str) -> Dict[str, dict]:
+        """Lists the user's supported documents with their size and modification time."""
+        directory = os.path.join(self.documents_dir, user_folder)
+        if not os.path.isdir(directory):
+            return {}
+        files = {}
+        for entry in os.scandir(directory):
+            # Dotfiles include uploads that are still being written.
+            if entry.is_file() and not entry.name.startswith(".") \
+                    and os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS:
+                stat = entry.stat()
+                files[entry.name] = {"size": stat.st_size, "mtime": stat.st_mtime}
+        return files
+
+    def _get_index(self, user_folder: str) -> UserIndex:
+        if user_folder not in self._indexes:
+            directory = os.path.join(self.index_dir, user_folder)
+            try:
+                index = UserIndex(directory)
+            except FileNotFoundError:
+                # Other processes wrote two versions since the manifest was read; the new one names files that exist.
+                index = UserIndex(directory)
+            self._indexes[user_folder] = index
+        return self._indexes[user_folder]
+
+    def forget_index(self, user_folder: str) -> None:
+        """Makes the next search reopen the user's index, after another process rewrote it."""
+        self._indexes.pop(user_folder, None)
+
+    def is_stale(self, user_folder: str) -> bool:
+        """True if the user's documents on disk differ from what is indexed."""
+        return self._scan_documents(user_folder) != self._get_index(user_folder).manifest["files"]
+
+    def index_version(self, user_folder: str) -> str:
+        """Names the current version of the user's index; it changes whenever the index is rewritten."""
+        return f"{user_folder}:{self._get_index(user_folder).manifest['version']}"
+
+    def sync_blocking(self, user_folder: str) -> int:
+        """
+        Embeds the user's documents that are not indexed yet. New files are
+        appended; if any indexed file changed or disappeared, the index is
+        rebuilt. Returns how many files were (re)embedded. Runs in a thread.
+        """
+        with _index_lock(os.path.join(self.index_dir, user_folder)):
+            # Several worker processes may sync the same user, so always start from what is on disk.
+            index = self._indexes[user_folder] = UserIndex(os.path.join(self.index_dir, user_folder))
+            return self._sync_index(index, user_folder)
+
+    def _sync_index(self, index: UserIndex, user_folder: str) -> int:
+        current = self._scan_documents(user_folder)
+        indexed = index.manifest["files"]
+
+        rebuild = index.manifest["embedder"] not in (None, self.embedder.name) or any(
+            current.get(name) != info for name, info in indexed.items()
+        )
+        to_embed = sorted(current) if rebuild else sorted(name for name in current if name not in indexed)
+        if not to_embed and not rebuild:
+            return 0
+
+        chunks = []
+        for name in to_embed:
+            try:
+                text = extract_text(os.path.join(self.documents_dir, user_folder, name))
+            except Exception as e:
+                # Keep it in the manifest so a broken file isn't retried until it changes.
+                print(f"RAG: could not read '{name}' for '{user_folder}': {e}")
+                continue
+            chunks.extend({"text": chunk, "source": name} for chunk in chunk_text(text))
+
+        vectors = self.embedder.embed([chunk["text"] for chunk in chunks]) if chunks \
+            else np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self._indexes[user_folder] = index.write(current, self.embedder.name, vectors, chunks, append=not rebuild)
+        return len(to_embed)
+
+    async def sync(self, user_folder: str) -> int:
+        """Brings the user's index up to date. Called by the ingestion queue's workers."""
+        async with self._locks[user_folder]:
+            if not isinstance(self.executor, ProcessPoolExecutor):
+                return await asyncio.get_running_loop().run_in_executor(self.executor, self.sync_blocking, user_folder)
+            embedded = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _sync_in_subprocess,
+                self.documents_dir, self.index_dir, self.embedder.name, user_folder,
+            )
+            # The index was rewritten by another process; reopen it here.
+            self._indexes[user_folder] = UserIndex(os.path.join(self.index_dir, user_folder))
+            return embedded
+
+    async def search(self, user_folder: str, query: str, k: Optional[int] = None) -> List[RagHit]:
+        """Returns the indexed chunks closest to `query`."""
+        query_vector = (await asyncio.to_thread(self.embedder.embed, [query]))[0]
+        return self._get_index(user_folder).search(query_vector, k or self.top_k)
+
+
+_subprocess_engines: Dict[tuple, RagEngine] = {}
+
+def _sync_in_subprocess(documents_dir: str, index_dir: str, embedder_name: str, user_folder: str) -> int:
+    """Entry point for process pool workers; each worker keeps its own engine and embedder."""
+    key = (documents_dir, index_dir, embedder_name)
+    if key not in _subprocess_engines:
+        _subprocess_engines[key] = RagEngine(documents_dir, index_dir, load_embedder(embedder_name))
+    return _subprocess_engines[key].sync_blocking(user_folder)
+
+
+@contextmanager
+def _index_lock(directory: str):
+    """Holds an exclusive lock on a user's index directory across processes."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def build_rag_prompt(question: str, hits: List[RagHit]) -> str:
+    """Puts the retrieved passages in front of the question for the model."""
+    context = "\n\n".join(f"[{i + 1}] ({hit.source}) {hit.text}" for i, hit in enumerate(hits))
+    return (
+        "Answer the question using only the document excerpts below. "
+        "If they do not contain the answer, say so.\n\n"
+        f"{context}\n\nQuestion: {question}"
+    )
@@ -0,0 +1,235 @@
+"""
+Rate limits and admission control for the chat endpoints.
+
+Every chat turn takes a token from two token buckets: one for the user and
+one for the model they asked for. A bucket holds up to `capacity` tokens and
+refills at `refillPerSecond`, so short bursts pass and sustained floods are
+refused with a 429 and a Retry-After saying when the next token is due.
+
+Buckets live in memory by default, which limits each worker process on its
+own. With RATE_LIMIT_BACKEND=mongodb they are kept in MongoDB instead and
+shared by all workers; each check is then one atomic update.
+
+Independently of who is asking, AdmissionControl caps how many chat turns
+run at once. A few more may wait for a free slot for a short while; past
+that, requests are shed right away with a 503, before queueing drives the
+latency of everything else up.
+
+The limits are read from config_files/rate_limits.json at startup.
+"""
+import asyncio
+import datetime
+import json
+import math
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+
+RATE_LIMITS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config_files", "rate_limits.json")
+RATE_LIMITS_COLLECTION = "rate_limits"
+# In-memory buckets are pruned once there are this many; full buckets are dropped.
+MAX_MEMORY_BUCKETS = 100_000
+
+
+class RateLimited(Exception):
+    """Raised when a user or model has used up its bucket. Answered with a 429."""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Too many requests for this {scope}, please try again in {math.ceil(retry_after)}s.")
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    """Raised when too many chat turns are already running. Answered with a 503."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("The server is busy, please try again shortly.")
+        self.retry_after = retry_after
+
+
+class BucketLimit:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+
+    @classmethod
+    def from_config(cls, config: dict) -> "BucketLimit":
+        limit = cls(float(config["capacity"]), float(config["refillPerSecond"]))
+        if limit.capacity < 1 or limit.refill_per_second <= 0:
+            raise ValueError(f"Invalid rate limit {config}: capacity must be >= 1 and refillPerSecond > 0.")
+        return limit
+
+
+# --- Bucket backends ---
+# take() removes one token if there is one and returns 0, otherwise it
+# returns how many seconds until there will be one.
+
+class MemoryBuckets:
+    def __init__(self):
+        # key -> (tokens, monotonic time they were counted at, monotonic time the bucket is full again)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+
+    async def take(self, key: str, limit: BucketLimit) -> float:
+        now = time.monotonic()
+        tokens, updated_at, _ = self._buckets.get(key, (limit.capacity, now, now))
+        tokens = min(limit.capacity, tokens + (now - updated_at) * limit.refill_per_second)
+        if tokens >= 1:
+            self._set(key, limit, tokens - 1, now)
+            if len(self._buckets) > MAX_MEMORY_BUCKETS:
+                self._prune(now)
+            return 0.0
+        self._set(key, limit, tokens, now)
+        return (1 - tokens) / limit.refill_per_second
+
+    def _set(self, key: str, limit: BucketLimit, tokens: float, now: float) -> None:
+        # Each bucket keeps its own refill time, since user and model limits refill at different rates.
+        self._buckets[key] = (tokens, now, now + (limit.capacity - tokens) / limit.refill_per_second)
+
+    def _prune(self, now: float) -> None:
+        # A bucket idle long enough to have refilled is the same as no bucket.
+        self._buckets = {key: value for key, value in self._buckets.items() if now < value[2]}
+
+
+class MongoBuckets:
+    """Buckets shared by every worker, one document each, updated atomically in MongoDB."""
+
+    def __init__(self, collection: AsyncIOMotorCollection):
+        self.collection = collection
+
+    async def ensure_indexes(self) -> None:
+        # Buckets that have refilled completely are deleted by MongoDB.
+        await self.collection.create_index("expires_at", name="expires_at_ttl", expireAfterSeconds=0)
+
+    async def take(self, key: str, limit: BucketLimit) -> float:
+        now = time.time()
+        refilled = {"$min": [
+            limit.capacity,
+            {"$add": [
+                {"$ifNull": ["$tokens", limit.capacity]},
+                {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, limit.refill_per_second]},
+            ]},
+        ]}
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+            seconds=limit.capacity / limit.refill_per_second
+        )
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now, "expires_at": expires_at}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / limit.refill_per_second
+
+
+class RateLimiter:
+    def __init__(self, config: dict, buckets):
+        self.buckets = buckets
+        self.user_limit = BucketLimit.from_config(config["perUser"])
+        models = config.get("perModel", {})
+        self.default_model_limit = BucketLimit.from_config(models["default"]) if "default" in models else None
+        self.model_limits = {
+            model: BucketLimit.from_config(limit) for model, limit in models.items() if model != "default"
+        }
+        self.limited = {"user": 0, "model": 0}
+
+    async def check(self, user_id: str, model: Optional[str]) -> None:
+        """Takes a token for the user and one for the model, or raises RateLimited."""
+        retry_after = await self.buckets.take(f"user:{user_id}", self.user_limit)
+        if retry_after:
+            self.limited["user"] += 1
+            raise RateLimited("user", retry_after)
+        model_limit = self.model_limits.get(model, self.default_model_limit)
+        if model and model_limit is not None:
+            retry_after = await self.buckets.take(f"model:{model}", model_limit)
+            if retry_after:
+                self.limited["model"] += 1
+                raise RateLimited("model", retry_after)
+
+    def stats(self) -> dict:
+        return {"backend": type(self.buckets).__name__, "limited": dict(self.limited)}
+
+
+# --- Admission control ---
+
+class AdmissionSlot:
+    """
+    One admitted chat turn. Release it (or leave its `with` block) when the
+    turn is over. A slot without an AdmissionControl is unlimited.
+    """
+
+    def __init__(self, admission: Optional["AdmissionControl"] = None):
+        self._admission = admission
+        self._released = False
+
+    def release(self) -> None:
+        # Streaming responses release from two places, so this must be idempotent.
+        if not self._released and self._admission is not None:
+            self._released = True
+            self._admission._release()
+
+    def __enter__(self) -> "AdmissionSlot":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class AdmissionControl:
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_in_flight)
+        # Only touched from the event loop thread, so no lock is needed.
+        self._in_flight = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._shed = 0
+
+    async def acquire(self) -> AdmissionSlot:
+        """Waits (briefly) for a free slot, or raises Overloaded."""
+        if self._slots.locked():
+            if self._waiting >= self.max_queue:
+                self._shed += 1
+                raise Overloaded(retry_after=1)
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._shed += 1
+                raise Overloaded(retry_after=max(1.0, self.queue_timeout))
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+        self._in_flight += 1
+        self._admitted += 1
+        return AdmissionSlot(self)
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "queue_limit": self.max_queue,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "admitted": self._admitted,
+            "shed": self._shed,
+        }
+
+
+def load_rate_limits(path: str = RATE_LIMITS_PATH) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
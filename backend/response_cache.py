@@ -0,0 +1,207 @@
+"""
+Opt-in cache of AI responses for repeated questions (RESPONSE_CACHE setting).
+
+Entries are keyed by the model plus the normalized prompt (case, Unicode
+form and whitespace don't matter) and, for RAG answers, a scope naming the
+version of the user's document index, so re-indexing invalidates them.
+Two backends are available: "memory", an in-process LRU dict, and "disk",
+a SQLite file that survives restarts and is shared by all worker processes.
+Both expire entries after a TTL and evict the least recently used ones to
+stay under a size bound in bytes.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFKC", prompt).casefold()).strip()
+
+
+def cache_key(model: str, prompt: str, scope: str = "") -> str:
+    material = "\0".join((model, scope, normalize_prompt(prompt)))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """LRU dict of key -> (expires_at, response, size), bounded by the total size of the responses."""
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.size_bytes = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, response: str) -> None:
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, response, size)
+        self.size_bytes += size
+        while self.size_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        self.size_bytes -= self._entries.pop(key)[2]
+
+    async def usage(self) -> Tuple[int, int]:
+        """Number of entries and their total size in bytes."""
+        return len(self._entries), self.size_bytes
+
+    def close(self) -> None:
+        self._entries.clear()
+        self.size_bytes = 0
+
+
+class DiskBackend:
+    """
+    The same cache kept in a SQLite file. Every query runs in a worker
+    thread; a lock serializes them on the single connection. Other worker
+    processes write to the same file, so the total size is always read from
+    the table, in the same transaction that adds an entry and evicts.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, response: str) -> None:
+        await asyncio.to_thread(self._set, key, response)
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def _set(self, key: str, response: str) -> None:
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so no other process changes the total meanwhile.
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, response, size, now + self.ttl_seconds, now),
+                )
+                size_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                while size_bytes > self.max_bytes:
+                    oldest = self._db.execute("SELECT key, size FROM responses ORDER BY last_used LIMIT 1").fetchone()
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (oldest[0],))
+                    size_bytes -= oldest[1]
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    async def usage(self) -> Tuple[int, int]:
+        """Number of entries and their total size in bytes."""
+        return await asyncio.to_thread(self._usage)
+
+    def _usage(self) -> Tuple[int, int]:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, model: str, prompt: str, scope: str = "") -> Optional[str]:
+        response = await self.backend.get(cache_key(model, prompt, scope))
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    async def set(self, model: str, prompt: str, response: str, scope: str = "") -> None:
+        await self.backend.set(cache_key(model, prompt, scope), response)
+
+    async def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        entries, size_bytes = await self.backend.usage()
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "entries": entries,
+            "size_bytes": size_bytes,
+            "max_bytes": self.backend.max_bytes,
+        }
+
+
+# --- Shared cache ---
+# Created at application startup when RESPONSE_CACHE is "memory" or "disk" (see main.py).
+cache: Optional[ResponseCache] = None
+
+
+def start_cache(backend_name: str, max_bytes: int, ttl_seconds: float, path: str) -> Optional[ResponseCache]:
+    global cache
+    if backend_name == "memory":
+        cache = ResponseCache(MemoryBackend(max_bytes, ttl_seconds))
+    elif backend_name == "disk":
+        cache = ResponseCache(DiskBackend(path, max_bytes, ttl_seconds))
+    elif backend_name in ("", "off"):
+        cache = None
+    else:
+        raise RuntimeError(f"Unknown RESPONSE_CACHE '{backend_name}'. Choose one of: off, memory, disk")
+    return cache
+
+
+def stop_cache() -> None:
+    global cache
+    if cache is not None:
+        cache.backend.close()
+        cache = None
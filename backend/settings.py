@@ -0,0 +1,156 @@
+"""
+Runtime settings for the backend, read once from the environment (or the .env file).
+Every value has a default, so the app runs without any configuration.
+"""
+import os
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+# --- Password Hashing ---
+# Number of threads that run bcrypt. bcrypt releases the GIL, so these hash in parallel.
+PASSWORD_HASH_WORKERS = env_int("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1))
+# How many hash/verify calls may wait for a free worker before new ones are rejected with a 503.
+PASSWORD_HASH_QUEUE_LIMIT = env_int("PASSWORD_HASH_QUEUE_LIMIT", 32)
+
+# --- File Uploads ---
+# Largest accepted upload. Upload requests are cut off with a 413 as soon as their body
+# goes over this plus UPLOAD_FORM_OVERHEAD_BYTES (room for the other form fields).
+UPLOAD_MAX_BYTES = env_int("UPLOAD_MAX_BYTES", 25 * 1024 * 1024)
+UPLOAD_FORM_OVERHEAD_BYTES = env_int("UPLOAD_FORM_OVERHEAD_BYTES", 64 * 1024)
+# Uploaded images are stored once per content, under their sha256, in this folder.
+BLOB_DIR = os.getenv("BLOB_DIR", "blobs")
+# Longest side of the thumbnails made for uploaded images (needs Pillow).
+THUMBNAIL_SIZE = env_int("THUMBNAIL_SIZE", 256)
+# Threads that make thumbnails in the background.
+THUMBNAIL_WORKERS = env_int("THUMBNAIL_WORKERS", 2)
+
+# --- Chat Generation ---
+# Which backend in chat_generation.GENERATORS produces the AI responses:
+# "fake" (local echo) or "providers" (the LLM APIs in config_files/).
+CHAT_GENERATOR = os.getenv("CHAT_GENERATOR", "fake")
+# Pause between words of the fake generator, to exercise streaming locally.
+FAKE_GENERATOR_TOKEN_DELAY_MS = env_int("FAKE_GENERATOR_TOKEN_DELAY_MS", 0)
+# Set to the address of mock_llm_server.py to send every provider request there instead.
+LLM_PROVIDER_BASE_URL = os.getenv("LLM_PROVIDER_BASE_URL", "")
+
+# --- RAG ---
+# Where each user's vector index is kept (one sub-folder per user).
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", "rag_index")
+# "hashing" (built in) or the name of a sentence-transformers model, if that package is installed.
+RAG_EMBEDDING_MODEL = os.getenv("RAG_EMBEDDING_MODEL", "hashing")
+# Number of document chunks handed to the model with each question.
+RAG_TOP_K = env_int("RAG_TOP_K", 4)
+
+# --- Document Ingestion ---
+# Background workers that parse and embed uploaded documents.
+INGESTION_CONCURRENCY = env_int("INGESTION_CONCURRENCY", 2)
+# Attempts per job before it is marked as failed (retries back off exponentially).
+INGESTION_MAX_ATTEMPTS = env_int("INGESTION_MAX_ATTEMPTS", 3)
+# Run the parsing/embedding in this many separate processes; 0 uses a thread instead.
+INGESTION_PROCESS_WORKERS = env_int("INGESTION_PROCESS_WORKERS", 0)
+
+# --- MongoDB ---
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+# Connections the Motor client may open (per process) and keep open while idle.
+MONGO_MAX_POOL_SIZE = env_int("MONGO_MAX_POOL_SIZE", 100)
+MONGO_MIN_POOL_SIZE = env_int("MONGO_MIN_POOL_SIZE", 0)
+# How long to wait for a usable server / a new connection before failing.
+MONGO_SERVER_SELECTION_TIMEOUT_MS = env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
+MONGO_CONNECT_TIMEOUT_MS = env_int("MONGO_CONNECT_TIMEOUT_MS", 5000)
+# Per-operation socket timeout; 0 means no timeout.
+MONGO_SOCKET_TIMEOUT_MS = env_int("MONGO_SOCKET_TIMEOUT_MS", 0)
+
+# --- User Lookup Cache ---
+# The chat endpoints cache each user's id and folder by email for this long (0 disables it).
+USER_CACHE_TTL_SECONDS = env_int("USER_CACHE_TTL_SECONDS", 300)
+USER_CACHE_MAX_ENTRIES = env_int("USER_CACHE_MAX_ENTRIES", 10_000)
+
+# --- Sessions ---
+# Key that signs the session cookies. Set it in production: without it a random
+# key is generated at startup and every restart logs all users out.
+SESSION_SECRET = os.getenv("SESSION_SECRET", "")
+# How long a login stays valid; /api/auth/refresh issues a new token.
+SESSION_TTL_SECONDS = env_int("SESSION_TTL_SECONDS", 7 * 24 * 3600)
+# Profiles (id, name, email) served by /api/user are cached per user for this long.
+PROFILE_CACHE_TTL_SECONDS = env_int("PROFILE_CACHE_TTL_SECONDS", 300)
+PROFILE_CACHE_MAX_ENTRIES = env_int("PROFILE_CACHE_MAX_ENTRIES", 10_000)
+
+# --- Chat Write Buffer ---
+# 1 queues chat turns in memory and writes them to MongoDB in batches (see chat_write_buffer.py).
+CHAT_WRITE_BUFFER = env_int("CHAT_WRITE_BUFFER", 0)
+# A flush happens once this many messages are waiting, and at least this often,
+# which also bounds what a crash can lose while MongoDB is reachable.
+CHAT_WRITE_BUFFER_MAX_MESSAGES = env_int("CHAT_WRITE_BUFFER_MAX_MESSAGES", 500)
+CHAT_WRITE_BUFFER_MAX_DELAY_MS = env_int("CHAT_WRITE_BUFFER_MAX_DELAY_MS", 200)
+# While flushes fail, turns are queued for a retry up to this many messages and
+# answered with a 503 after that; this bounds what a crash can lose during an outage.
+CHAT_WRITE_BUFFER_MAX_PENDING_MESSAGES = env_int("CHAT_WRITE_BUFFER_MAX_PENDING_MESSAGES", 5000)
+
+# --- Response Cache ---
+# "off", "memory" (per process) or "disk" (a SQLite file) to reuse answers to repeated prompts.
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "off")
+RESPONSE_CACHE_TTL_SECONDS = env_int("RESPONSE_CACHE_TTL_SECONDS", 3600)
+# Total size of the cached responses; the least recently used ones are evicted beyond it.
+RESPONSE_CACHE_MAX_BYTES = env_int("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+
+# --- Metrics ---
+# Time every request and serve the results at /metrics (Prometheus text format).
+METRICS_ENABLED = env_int("METRICS_ENABLED", 1)
+# Log requests that take longer than this (0 turns the log off)...
+SLOW_REQUEST_MS = env_int("SLOW_REQUEST_MS", 1000)
+# ...and for this fraction of requests, also where a slow one was waiting.
+SLOW_REQUEST_TRACE_SAMPLE_RATE = env_float("SLOW_REQUEST_TRACE_SAMPLE_RATE", 0.1)
+
+# --- Conversation Context ---
+# Token budget for the earlier messages sent to the model with each turn.
+CONTEXT_MAX_TOKENS = env_int("CONTEXT_MAX_TOKENS", 3000)
+# At most this many recent messages are read per turn; older ones live in the summary.
+CONTEXT_MAX_MESSAGES = env_int("CONTEXT_MAX_MESSAGES", 100)
+# Size of the rolling summary of messages that no longer fit in the budget.
+CONTEXT_SUMMARY_MAX_TOKENS = env_int("CONTEXT_SUMMARY_MAX_TOKENS", 500)
+
+# --- Server ---
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = env_int("WEB_PORT", 8000)
+# Worker processes started by `python main.py`; each has its own MongoDB client and caches.
+WEB_WORKERS = env_int("WEB_WORKERS", 1)
+# On shutdown, how long in-flight requests (and streaming chat turns) get to finish.
+SHUTDOWN_GRACE_SECONDS = env_int("SHUTDOWN_GRACE_SECONDS", 30)
+# Then how long queued document ingestion jobs get before they are cancelled.
+INGESTION_DRAIN_SECONDS = env_int("INGESTION_DRAIN_SECONDS", 10)
+# Workers tell each other to drop stale cache entries through sockets in this folder.
+CACHE_BUS_DIR = os.getenv("CACHE_BUS_DIR", os.path.join(tempfile.gettempdir(), f"librechat-cache-bus-{WEB_PORT}"))
+
+# --- App Config (/api/config) ---
+# How often config_files/model_settings.json is checked for changes.
+CONFIG_RELOAD_CHECK_SECONDS = env_float("CONFIG_RELOAD_CHECK_SECONDS", 2)
+# How long browsers may reuse /api/config before revalidating it (0: always ask, usually getting a 304).
+CONFIG_MAX_AGE_SECONDS = env_int("CONFIG_MAX_AGE_SECONDS", 0)
+
+# --- Rate Limits (limits themselves are in config_files/rate_limits.json) ---
+RATE_LIMITS_ENABLED = env_int("RATE_LIMITS_ENABLED", 1)
+# "memory" (per worker process) or "mongodb" (shared by all workers).
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+# --- Bulk Conversation Operations ---
+# Most conversation ids accepted by one /api/chats/bulk_delete request.
+BULK_DELETE_MAX_IDS = env_int("BULK_DELETE_MAX_IDS", 1000)
+# Documents written per insert_many while importing an NDJSON export.
+IMPORT_BATCH_SIZE = env_int("IMPORT_BATCH_SIZE", 1000)
+# Longest line (one conversation or message) an import file may contain.
+IMPORT_MAX_LINE_BYTES = env_int("IMPORT_MAX_LINE_BYTES", 1024 * 1024)
@@ -0,0 +1,49 @@
+import os
+import re
+import zipfile
+from typing import List
+from xml.etree import ElementTree
+
+# File types the RAG ingestion pipeline knows how to read
+SUPPORTED_EXTENSIONS = {".txt", ".md", ".docx"}
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def extract_text(file_path: str) -> str:
+    """
+    Returns the plain text of a .txt, .md or .docx file.
+
+    A .docx file is a zip archive; its body lives in word/document.xml as a
+    list of paragraphs (w:p) made of text runs (w:t), so no extra library
+    is needed to read it.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".docx":
+        with zipfile.ZipFile(file_path) as archive:
+            root = ElementTree.fromstring(archive.read("word/document.xml"))
+        paragraphs = [
+            "".join(node.text or "" for node in paragraph.iter(f"{WORD_NAMESPACE}t"))
+            for paragraph in root.iter(f"{WORD_NAMESPACE}p")
+        ]
+        return "\n".join(p for p in paragraphs if p.strip())
+    if extension in SUPPORTED_EXTENSIONS:
+        with open(file_path, encoding="utf-8", errors="replace") as f:
+            return f.read()
+    raise ValueError(f"Unsupported document type: {extension}")
+
+
+def chunk_text(text: str, chunk_words: int = 200, overlap_words: int = 40) -> List[str]:
+    """
+    Splits text into chunks of about `chunk_words` words. Consecutive chunks
+    share `overlap_words` words, so a sentence cut at a boundary still
+    appears whole in one of them.
+    """
+    words = re.findall(r"\S+", text)
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap_words)
+    return [
+        " ".join(words[start:start + chunk_words])
+        for start in range(0, max(1, len(words) - overlap_words), step)
+    ]
@@ -12,6 +12,8 @@ interface ChatViewProps {
   isNewChat: boolean;
   isSidebarOpen: boolean;
   messages: Message[];
+  hasOlderMessages: boolean;
+  onLoadOlderMessages: () => void;
   // 1. Update the onSendMessage signature to include the model
   onSendMessage: (message: string, model: string, image?: File, textFile?: File, isRagActive?: boolean) => void;
   isRagActive: boolean;
@@ -25,6 +27,8 @@ export default function ChatView({
   isNewChat,
   isSidebarOpen,
   messages,
+  hasOlderMessages,
+  onLoadOlderMessages,
   onSendMessage,
   isRagActive,
   setIsRagActive,
@@ -82,7 +86,7 @@ export default function ChatView({
         {headerContent}
       </header>
       <main className="flex-1 overflow-y-auto">
-        <Messages messages={messages} />
+        <Messages messages={messages} hasOlder={hasOlderMessages} onLoadOlder={onLoadOlderMessages} />
       </main>
       <div className="w-full shrink-0">
         <div className="mx-auto w-full max-w-3xl px-4 pb-4">
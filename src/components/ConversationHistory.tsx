@@ -1,7 +1,12 @@
 // src/components/ConversationHistory.tsx
 
-import React from 'react';
-import type { Conversation } from '../services/chatApi';
+import React, { useEffect, useState } from 'react';
+import { useAuth } from '../contexts/AuthContext';
+import { searchConversations } from '../services/chatApi';
+import type { Conversation, SearchHit } from '../services/chatApi';
+
+// Wait this long after the last keystroke before searching
+const SEARCH_DELAY_MS = 300;
 
 // A simple trash can icon for the delete button
 function DeleteIcon() {
@@ -18,6 +23,8 @@ interface ConversationHistoryProps {
   onSelectConversation: (id: string) => void;
   onDeleteConversation: (id: string) => void; // New prop
   activeConversationId: string | null;
+  hasMore: boolean; // More conversations can be paged in from the server
+  onLoadMore: () => void;
 }
 
 export default function ConversationHistory({
@@ -25,16 +32,90 @@ export default function ConversationHistory({
   onSelectConversation,
   onDeleteConversation, // Destructure new prop
   activeConversationId,
+  hasMore,
+  onLoadMore,
 }: ConversationHistoryProps) {
-  
+  const { user } = useAuth();
+  const [query, setQuery] = useState('');
+  const [hits, setHits] = useState<SearchHit[]>([]);
+  const [nextOffset, setNextOffset] = useState<number | null>(null);
+
+  useEffect(() => {
+    if (!user || !query.trim()) {
+      setHits([]);
+      setNextOffset(null);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(() => {
+      searchConversations(query.trim())
+        .then(page => {
+          if (cancelled) return;
+          setHits(page.hits);
+          setNextOffset(page.next_offset);
+        })
+        .catch(error => console.error('Search failed:', error));
+    }, SEARCH_DELAY_MS);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [query, user]);
+
+  const loadMoreHits = () => {
+    if (!user || nextOffset === null) return;
+    searchConversations(query.trim(), nextOffset)
+      .then(page => {
+        setHits(prev => [...prev, ...page.hits]);
+        setNextOffset(page.next_offset);
+      })
+      .catch(error => console.error('Search failed:', error));
+  };
+
   const handleDeleteClick = (e: React.MouseEvent, convoId: string) => {
     e.stopPropagation(); // Prevent the conversation from being selected when deleting
     onDeleteConversation(convoId);
   };
 
+  const isSearching = query.trim() !== '';
+
   return (
     <div className="flex-1 overflow-y-auto pr-2">
-      <div className="flex flex-col gap-2 text-sm text-gray-300">
+      <input
+        type="search"
+        value={query}
+        onChange={(e) => setQuery(e.target.value)}
+        placeholder="Search chats"
+        className="mb-2 w-full rounded-lg bg-zinc-900 px-3 py-2 text-sm text-white placeholder-gray-500 outline-none focus:ring-1 focus:ring-zinc-600"
+      />
+      {isSearching && (
+        <div className="flex flex-col gap-2 text-sm text-gray-300">
+          {hits.map((hit) => (
+            <div
+              key={`${hit.conversation_id}-${hit.message_seq ?? 'title'}`}
+              onClick={() => onSelectConversation(hit.conversation_id)}
+              className={`rounded-lg px-3 py-2 text-left transition-colors cursor-pointer hover:bg-zinc-800 ${
+                activeConversationId === hit.conversation_id ? 'bg-zinc-700' : ''
+              }`}
+            >
+              <div className="truncate">{hit.conversation_title}</div>
+              {hit.message_seq !== null && (
+                <div className="line-clamp-2 text-xs text-gray-500">{hit.snippet}</div>
+              )}
+            </div>
+          ))}
+          {hits.length === 0 && <div className="px-3 py-2 text-xs text-gray-500">No matches</div>}
+          {nextOffset !== null && (
+            <button
+              onClick={loadMoreHits}
+              className="rounded-lg px-3 py-2 text-left text-xs text-gray-400 transition-colors hover:bg-zinc-800 hover:text-white"
+            >
+              Load more
+            </button>
+          )}
+        </div>
+      )}
+      <div className={`flex flex-col gap-2 text-sm text-gray-300 ${isSearching ? 'hidden' : ''}`}>
         {conversations.map((convo) => (
           <div
             key={convo.id}
@@ -55,6 +136,14 @@ export default function ConversationHistory({
             </button>
           </div>
         ))}
+        {hasMore && (
+          <button
+            onClick={onLoadMore}
+            className="rounded-lg px-3 py-2 text-left text-xs text-gray-400 transition-colors hover:bg-zinc-800 hover:text-white"
+          >
+            Load more
+          </button>
+        )}
       </div>
     </div>
   );
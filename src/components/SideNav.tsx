@@ -30,6 +30,8 @@ interface SideNavProps {
   onSelectConversation: (id: string) => void;
   onDeleteConversation: (id: string) => void;
   activeConversationId: string | null;
+  hasMoreConversations: boolean;
+  onLoadMoreConversations: () => void;
   onOpenSettings: () => void; // New prop to open the modal
 }
 
@@ -40,6 +42,8 @@ export default function SideNav({
   onSelectConversation,
   onDeleteConversation,
   activeConversationId,
+  hasMoreConversations,
+  onLoadMoreConversations,
   onOpenSettings, // Destructure the new prop
 }: SideNavProps) {
   const { user, logout } = useAuth();
@@ -98,6 +102,8 @@ export default function SideNav({
         onSelectConversation={onSelectConversation}
         onDeleteConversation={onDeleteConversation}
         activeConversationId={activeConversationId}
+        hasMore={hasMoreConversations}
+        onLoadMore={onLoadMoreConversations}
       />
 
       <div ref={menuRef} className="relative mt-auto border-t border-zinc-700 pt-2">
@@ -2,6 +2,7 @@
 
 import React, { useEffect, useRef } from 'react';
 import { motion } from 'framer-motion';
+import { fileUrl } from '../../services/chatApi';
 import type { Message } from '../../services/chatApi';
 import { useAuth } from '../../contexts/AuthContext';
 
@@ -50,18 +51,32 @@ function UserAvatar({ name }: { name: string }) {
 
 interface MessagesProps {
   messages: Message[];
+  hasOlder?: boolean; // Older messages can be paged in from the server
+  onLoadOlder?: () => void;
 }
 
-export default function Messages({ messages }: MessagesProps) {
+export default function Messages({ messages, hasOlder, onLoadOlder }: MessagesProps) {
   const { user } = useAuth();
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
+  // Only follow new messages at the bottom; paging in older ones keeps the scroll position.
+  const lastMessage = messages[messages.length - 1];
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
-  }, [messages]);
+  }, [lastMessage?.content, messages.length]);
 
   return (
     <div className="space-y-6 p-4">
+      {hasOlder && onLoadOlder && (
+        <div className="flex justify-center">
+          <button
+            onClick={onLoadOlder}
+            className="rounded-md px-3 py-1 text-xs text-gray-400 transition-colors hover:bg-zinc-700 hover:text-white"
+          >
+            Load earlier messages
+          </button>
+        </div>
+      )}
       {messages.map((msg, index) => (
         <motion.div
           key={index}
@@ -80,7 +95,21 @@ export default function Messages({ messages }: MessagesProps) {
               msg.role === 'user' ? 'bg-blue-600' : 'bg-zinc-700'
             }`}
           >
-            <p className="whitespace-pre-wrap">{msg.content}</p>
+            {msg.image_id && (
+              <a href={fileUrl(msg.image_id)} target="_blank" rel="noopener noreferrer">
+                <img
+                  src={fileUrl(msg.image_id, true)}
+                  alt="Uploaded image"
+                  loading="lazy"
+                  className="mb-2 max-h-64 rounded-md"
+                />
+              </a>
+            )}
+            <p className="whitespace-pre-wrap">
+              {msg.content}
+              {/* A blinking caret while the response is still streaming in */}
+              {msg.pending && <span className="ml-0.5 inline-block animate-pulse">▍</span>}
+            </p>
           </div>
 
           {/* Show the User avatar for 'user' role */}
@@ -7,13 +7,17 @@ import ChatView from '../components/ChatView';
 import OpenSidebarButton from '../components/OpenSidebarButton';
 import SettingsModal from '../components/modals/SettingsModal';
 import { useAuth } from '../contexts/AuthContext';
-import { fetchUserWithHistory, deleteConversation, Conversation, Message } from '../services/chatApi';
+import { fetchConversations, fetchMessages, deleteConversation, streamChatMessage, Conversation, Message } from '../services/chatApi';
 
 export default function ChatPage() {
   const { user } = useAuth();
   const [conversations, setConversations] = useState<Conversation[]>([]);
+  // Cursor for the next page of conversations, null once everything is loaded
+  const [conversationsCursor, setConversationsCursor] = useState<string | null>(null);
   const [activeConversationId, setActiveConversationId] = useState<string | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  // Cursor for older messages of the active conversation, null at the start of it
+  const [olderMessagesCursor, setOlderMessagesCursor] = useState<number | null>(null);
   const [isSidebarOpen, setIsSidebarOpen] = useState(true);
   const [isSettingsOpen, setIsSettingsOpen] = useState(false);
   const [isRagActive, setIsRagActive] = useState(false);
@@ -23,20 +27,45 @@ export default function ChatPage() {
 
   const refreshConversations = () => {
     if (user) {
-      fetchUserWithHistory().then(data => {
-        setConversations(data.chat_history.reverse());
+      fetchConversations().then(page => {
+        setConversations(page.conversations);
+        setConversationsCursor(page.next_cursor);
+      });
+    }
+  };
+  const loadMoreConversations = () => {
+    if (user && conversationsCursor) {
+      fetchConversations(conversationsCursor).then(page => {
+        setConversations(prev => [...prev, ...page.conversations]);
+        setConversationsCursor(page.next_cursor);
       });
     }
   };
   useEffect(() => { refreshConversations(); }, [user]);
+  // Only the newest page of messages is loaded when a conversation is opened.
   useEffect(() => {
-    if (activeConversationId) {
-      const activeConvo = conversations.find(c => c.id === activeConversationId);
-      setMessages(activeConvo ? activeConvo.messages : []);
+    if (user && activeConversationId) {
+      fetchMessages(activeConversationId)
+        .then(page => {
+          setMessages(page.messages);
+          setOlderMessagesCursor(page.next_before);
+        })
+        .catch(error => console.error("Failed to fetch messages:", error));
     } else {
       setMessages([]);
+      setOlderMessagesCursor(null);
+    }
+  }, [activeConversationId]);
+  const loadOlderMessages = async () => {
+    if (!user || !activeConversationId || olderMessagesCursor === null) return;
+    try {
+      const page = await fetchMessages(activeConversationId, olderMessagesCursor);
+      setMessages(prev => [...page.messages, ...prev]);
+      setOlderMessagesCursor(page.next_before);
+    } catch (error) {
+      console.error("Failed to fetch older messages:", error);
     }
-  }, [activeConversationId, conversations]);
+  };
   
   const handleConversationUpdate = (newlyCreatedConversation: Conversation | null) => {
     if (newlyCreatedConversation) {
@@ -62,6 +91,19 @@ export default function ChatPage() {
     const userMessage: Message = { role: 'user', content: message || (image ? "Image uploaded" : "File uploaded") };
     setMessages(prev => [...prev, userMessage]);
     try {
+      // Plain text chats stream the AI response in as it is generated.
+      if (!image && !textFile && !useRag) {
+        setMessages(prev => [...prev, { role: 'ai', content: '', pending: true }]);
+        const streamed = await streamChatMessage(user.email, message, activeConversationId, model, token => {
+          setMessages(prev => {
+            const last = prev[prev.length - 1];
+            return [...prev.slice(0, -1), { ...last, content: last.content + token }];
+          });
+        });
+        setMessages(prev => [...prev.slice(0, -1), { role: 'ai', content: streamed.ai_response }]);
+        handleConversationUpdate(streamed.new_conversation || null);
+        return;
+      }
       let data;
       let response;
       // 3. The 'model' variable from the arguments is now used here
@@ -100,12 +142,17 @@ export default function ChatPage() {
       if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
       data = await response.json();
       const aiMessage: Message = { role: 'ai', content: data.ai_response };
-      setMessages(prev => [...prev, aiMessage]);
+      if (data.image_id) {
+        // Show the stored image (and its thumbnail) on the message that sent it.
+        setMessages(prev => [...prev.slice(0, -1), { ...prev[prev.length - 1], image_id: data.image_id }, aiMessage]);
+      } else {
+        setMessages(prev => [...prev, aiMessage]);
+      }
       handleConversationUpdate(data.new_conversation || null);
     } catch (error) {
       console.error("Failed to fetch response from backend:", error);
       const errorMessage: Message = { role: 'ai', content: "Sorry, I couldn't connect to the server." };
-      setMessages(prev => [...prev, errorMessage]);
+      setMessages(prev => [...prev.filter(m => !m.pending), errorMessage]);
     }
   };
 
@@ -128,6 +175,8 @@ export default function ChatPage() {
               onSelectConversation={setActiveConversationId}
               onDeleteConversation={handleDeleteConversation}
               activeConversationId={activeConversationId}
+              hasMoreConversations={conversationsCursor !== null}
+              onLoadMoreConversations={loadMoreConversations}
               onOpenSettings={() => setIsSettingsOpen(true)}
             />
           )}
@@ -141,6 +190,8 @@ export default function ChatPage() {
             isNewChat={activeConversationId === null && messages.length === 0}
             isSidebarOpen={isSidebarOpen}
             messages={messages}
+            hasOlderMessages={olderMessagesCursor !== null}
+            onLoadOlderMessages={loadOlderMessages}
             onSendMessage={handleSendMessage}
             isRagActive={isRagActive}
             setIsRagActive={setIsRagActive}
@@ -8,12 +8,39 @@ const API_URL = 'http://localhost:8000/api';
 export interface Message {
   role: 'user' | 'ai';
   content: string;
+  image_id?: string | null; // An uploaded image, see fileUrl()
+  pending?: boolean; // True while the AI response is still streaming in
 }
 
 export interface Conversation {
   id: string;
   title: string;
+  rag_mode?: number;
+  messages?: Message[];
+}
+
+export interface ConversationPage {
+  conversations: Conversation[];
+  next_cursor: string | null;
+}
+
+export interface MessagePage {
   messages: Message[];
+  next_before: number | null;
+}
+
+export interface SearchHit {
+  conversation_id: string;
+  conversation_title: string;
+  message_seq: number | null; // null when the conversation's title matched
+  role: 'user' | 'ai' | null;
+  snippet: string;
+  score: number;
+}
+
+export interface SearchPage {
+  hits: SearchHit[];
+  next_offset: number | null;
 }
 
 interface ChatResponse {
@@ -22,18 +49,54 @@ interface ChatResponse {
 }
 
 // --- API FUNCTIONS ---
-export const fetchUserWithHistory = async (): Promise<{ chat_history: Conversation[] }> => {
+/**
+ * URL of an uploaded image (or its thumbnail). The server sends these with
+ * long-lived cache headers, so the browser only downloads each image once.
+ */
+export const fileUrl = (imageId: string, thumbnail = false): string =>
+  `${API_URL}/files/${imageId}${thumbnail ? '/thumbnail' : ''}`;
+
+/**
+ * Fetches one page of the user's conversations (id, title and rag_mode only),
+ * most recently updated first. Pass the returned `next_cursor` to get the next page.
+ */
+export const fetchConversations = async (cursor?: string | null): Promise<ConversationPage> => {
   try {
-    const response = await axios.get<{ chat_history: Conversation[] }>(`${API_URL}/user`, {
+    const response = await axios.get<ConversationPage>(`${API_URL}/conversations`, {
+      params: { cursor: cursor ?? undefined },
       withCredentials: true,
     });
-    return response.data?.chat_history ? { chat_history: response.data.chat_history } : { chat_history: [] };
+    return response.data;
   } catch (error) {
-    console.error('Failed to fetch user history:', error);
-    return { chat_history: [] };
+    console.error('Failed to fetch conversations:', error);
+    return { conversations: [], next_cursor: null };
   }
 };
 
+/**
+ * Searches the user's messages and conversation titles, best match first.
+ * Pass the returned `next_offset` as `offset` to get the next page.
+ */
+export const searchConversations = async (query: string, offset = 0): Promise<SearchPage> => {
+  const response = await axios.get<SearchPage>(`${API_URL}/search`, {
+    params: { q: query, offset },
+    withCredentials: true,
+  });
+  return response.data;
+};
+
+/**
+ * Fetches the newest messages of a conversation, oldest first.
+ * Pass the returned `next_before` as `before` to load older messages.
+ */
+export const fetchMessages = async (conversationId: string, before?: number | null): Promise<MessagePage> => {
+  const response = await axios.get<MessagePage>(`${API_URL}/conversations/${conversationId}/messages`, {
+    params: { before: before ?? undefined },
+    withCredentials: true,
+  });
+  return response.data;
+};
+
 export const postChatMessage = async (
   email: string,
   message: string,
@@ -51,6 +114,60 @@ export const postChatMessage = async (
   return response.data;
 };
 
+/**
+ * Sends a message to the streaming chat endpoint. `onToken` is called with each
+ * piece of the AI response as it arrives; the promise resolves with the final
+ * payload once the turn has been saved. Abort `signal` to stop generation.
+ */
+export const streamChatMessage = async (
+  email: string,
+  message: string,
+  conversationId: string | null,
+  model: string,
+  onToken: (text: string) => void,
+  signal?: AbortSignal
+): Promise<ChatResponse> => {
+  const payload = {
+    user_email: email,
+    human_text: message,
+    conversation_id: conversationId,
+    user_model: model,
+  };
+  const response = await fetch(`${API_URL}/chat/invoke_stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(payload),
+    credentials: 'include',
+    signal,
+  });
+  if (!response.ok || !response.body) throw new Error(`HTTP error! status: ${response.status}`);
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += value;
+    // Server-Sent Events are separated by a blank line.
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of rawEvent.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      const parsed = data ? JSON.parse(data) : {};
+      if (event === 'token') onToken(parsed.text);
+      else if (event === 'done') return parsed as ChatResponse;
+      else if (event === 'error') throw new Error(parsed.detail);
+    }
+  }
+  throw new Error('The response stream ended before the message was saved.');
+};
+
 export const deleteConversation = async (email: string, conversationId: string): Promise<void> => {
     try {
         const payload = { user_email: email };